@@ -0,0 +1,174 @@
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+extension = ".hltex"
+
+
+def expand(patterns):
+    """
+    patterns: paths of files or directories, or glob patterns (with `**` matching any
+        number of directories)
+    returns: the files the patterns name (for directories, every `.hltex` file in
+        them), in order and without duplicates, and the patterns that name nothing
+    """
+    files = []
+    missing = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            paths = sorted(glob.glob(pattern, recursive=True))
+        else:
+            paths = [pattern] if os.path.exists(pattern) else []
+        if not paths:
+            missing.append(pattern)
+        for path in paths:
+            if os.path.isdir(path):
+                for directory, dirs, names in os.walk(path):
+                    dirs.sort()
+                    files.extend(
+                        os.path.join(directory, name)
+                        for name in sorted(names)
+                        if name.endswith(extension)
+                    )
+            else:
+                files.append(path)
+    unique = {}
+    for path in files:
+        unique.setdefault(os.path.abspath(path), path)
+    return list(unique.values()), missing
+
+
+def output_paths(files, out_dir=None, root=None):
+    """
+    returns: where the translation of each of `files` is written: next to it, or if
+        `out_dir` is given, in the same place in a copy of the tree of directories the
+        files are in, rooted at `out_dir`
+    root: the directory whose tree is copied (by default, the innermost one all of
+        `files` are in)
+    """
+    outputs = [os.path.splitext(path)[0] + ".tex" for path in files]
+    if out_dir is None or not files:
+        return outputs
+    if root is None:
+        root = os.path.commonpath(
+            [os.path.dirname(os.path.abspath(path)) for path in files]
+        )
+    return [
+        os.path.join(out_dir, os.path.relpath(os.path.abspath(path), root))
+        for path in outputs
+    ]
+
+
+def translate_file(filename, out, use_cache=True):
+    """
+    postcondition: the translation of `filename` is written to `out`, unless it fails
+    returns: (seconds taken, error message or None)
+    """
+    start = time.perf_counter()
+    try:
+        with open(filename, "r") as f:
+            source = f.read()
+        res = cache = None
+        if use_cache:
+            from .cache import Cache
+            from .control.pysplice import has_python_blocks
+
+            # as by the CLI, documents with Python blocks are translated every time
+            if not has_python_blocks(source):
+                cache = Cache()
+                key = cache.key(source)
+                res = cache.get(key)
+        if res is None:
+            from .translator import translate
+
+            if not use_cache:
+                res = translate(source)
+            else:
+                from .cache import pysplice_cache
+
+                res = translate(source, pysplice_cache=pysplice_cache())
+                if cache is not None:
+                    cache.put(key, res)
+        directory = os.path.dirname(out)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(out, "w") as f:
+            f.write(res)
+    except Exception as e:  # pylint: disable=broad-except
+        # reported in the summary, so that one file failing doesn't stop the rest
+        return time.perf_counter() - start, "{}: {}".format(type(e).__name__, e)
+    return time.perf_counter() - start, None
+
+
+def _translate_file(args):
+    return translate_file(*args)
+
+
+def translate_files(files, outputs, jobs=None, use_cache=True):
+    """
+    Translates `files` to `outputs` across `jobs` processes (one per CPU by default, or
+    in this process if 1)
+    yields: (file, output, seconds taken, error message or None) for each file, in
+        order, as they're translated
+    """
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    tasks = [(path, out, use_cache) for path, out in zip(files, outputs)]
+    if jobs == 1 or len(tasks) <= 1:
+        results = map(_translate_file, tasks)
+        for (path, out, _), (elapsed, error) in zip(tasks, results):
+            yield path, out, elapsed, error
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        # sent to the workers a few at a time, since most files take less time to
+        # translate than to send to a worker on their own
+        chunksize = max(1, min(32, len(tasks) // (jobs * 4)))
+        results = pool.map(_translate_file, tasks, chunksize=chunksize)
+        for (path, out, _), (elapsed, error) in zip(tasks, results):
+            yield path, out, elapsed, error
+
+
+def run(files, outputs, jobs=None, use_cache=True, slowest=10, log=None):
+    """
+    Translates `files` to `outputs` (see `translate_files`), reporting each file, and
+    then a summary with the `slowest` files and the ones that failed, to `log`
+    returns: the exit status, which is 1 if any file failed
+    """
+    if log is None:
+        log = sys.stdout
+    start = time.perf_counter()
+    timings = []
+    failures = []
+    for path, out, elapsed, error in translate_files(
+        files, outputs, jobs=jobs, use_cache=use_cache
+    ):
+        timings.append((elapsed, path))
+        if error is None:
+            print("{:>9.1f} ms  {} -> {}".format(elapsed * 1000, path, out), file=log)
+        else:
+            failures.append((path, error))
+            print(
+                "{:>9.1f} ms  {} FAILED: {}".format(elapsed * 1000, path, error),
+                file=log,
+            )
+    total = time.perf_counter() - start
+    print(file=log)
+    print(
+        "Translated {} of {} file(s) in {:.2f} s".format(
+            len(files) - len(failures), len(files), total
+        ),
+        file=log,
+    )
+    if slowest and timings:
+        print("Slowest:", file=log)
+        for elapsed, path in sorted(timings, reverse=True)[:slowest]:
+            print("{:>9.1f} ms  {}".format(elapsed * 1000, path), file=log)
+    if failures:
+        print("Failed:", file=log)
+        for path, error in failures:
+            print("  {}: {}".format(path, error), file=log)
+    status = 1 if failures else 0
+    print("Exit status: {}".format(status), file=log)
+    return status
@@ -0,0 +1,9 @@
+"""
+Benchmarks of the translator (run with `python -m hltex.bench`):
+corpus: generates synthetic documents
+micro: times each parse function of `hltex.translator` on its own
+e2e: times translating whole documents
+results: saves results as JSON, and compares them against a baseline
+scaling: checks that translation time grows linearly with the size of the document
+loadtest: measures the latency and throughput of a running `hltex serve`
+"""
@@ -0,0 +1,83 @@
+"""
+Runs the microbenchmarks and the end-to-end benchmarks, prints how long each took, and
+saves the results as JSON, comparing them against a baseline if one is given.
+
+Usage (from a checkout, for the end-to-end benchmarks of its examples):
+    python -m hltex.bench [--out FILE] [--baseline FILE] [--threshold FRACTION]
+        [--quick] [--only SUBSTRING] [--pysplice]
+
+Save a baseline with `--out baseline.json` before a change, and compare against it
+with `--baseline baseline.json` after. The exit status is 1 if any benchmark got slower
+than the baseline by more than the threshold (its own, if the baseline has a
+"thresholds" entry for it).
+"""
+import argparse
+import sys
+
+from . import e2e, micro
+from .results import THRESHOLD, compare, load, results, save
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--out", default="bench.json")
+    parser.add_argument("--baseline")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    parser.add_argument("--quick", action="store_true", help="smaller documents")
+    parser.add_argument("--only", help="only benchmarks whose names contain this")
+    parser.add_argument(
+        "--pysplice", action="store_true", help="include Python blocks (needs Docker)"
+    )
+    args = parser.parse_args()
+
+    only = None
+    if args.only is not None:
+        only = lambda name: args.only in name  # noqa: E731
+    scale = 10 if args.quick else 1
+    repeat = 3 if args.quick else 5
+    timings = []
+    print("{:<34} {:>10} {:>12} {:>10}".format("benchmark", "chars", "ms", "us/char"))
+    for prefix, bench in [
+        ("micro.", micro.run(size=20000 // scale, repeat=repeat, only=only)),
+        (
+            "e2e.",
+            e2e.run(
+                size=100000 // scale,
+                scales=(1, 64 // scale),
+                repeat=repeat,
+                pysplice=args.pysplice,
+                only=only,
+            ),
+        ),
+    ]:
+        for name, chars, seconds in bench:
+            timings.append((prefix + name, chars, seconds))
+            print(
+                "{:<34} {:>10} {:>12.3f} {:>10.3f}".format(
+                    prefix + name, chars, seconds * 1000, seconds / chars * 1e6
+                )
+            )
+    res = results(timings)
+    save(res, args.out)
+    print("Saved results to `{}`".format(args.out))
+    if args.baseline is None:
+        return 0
+
+    regressions = 0
+    print()
+    print("{:<34} {:>12} {:>12} {:>8}".format("vs. baseline", "before ms", "now ms", "ratio"))
+    for name, old, new, ratio, regressed in compare(
+        res, load(args.baseline), threshold=args.threshold
+    ):
+        regressions += regressed
+        print(
+            "{:<34} {:>12.3f} {:>12.3f} {:>8.2f}{}".format(
+                name, old * 1000, new * 1000, ratio, "  REGRESSED" if regressed else ""
+            )
+        )
+    print("{} regression(s)".format(regressions))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""
+Synthetic HLTeX documents for benchmarking, generated from a seed so that the same
+arguments always give the same document
+"""
+import random
+import re
+
+WORDS = (
+    "the of and a to in is you that it he was for on are as with his they at be this "
+    "from have or by one had not but what all were when we there can an your which "
+    "their said if do will each about how up out them then she many some so these "
+    "would other into has more her two like him see time could no make than first "
+    "been its who now people my made over did down only way find use may water long "
+    "little very after words called just where most know"
+).split()
+COMMANDS = ["textbf", "emph", "textit", "ref", "cite", "label", "texttt"]
+ENVIRONMENTS = ["itemize", "enumerate", "center", "quote", "proof", "theorem"]
+# what the environments in the document are indented by
+INDENT = "    "
+
+
+def words(rng, length, commands=0, groups=0):
+    """
+    returns: a line of about `length` characters of words, some of them in commands
+        (with probability `commands`) or groups (with probability `groups`)
+    """
+    parts = []
+    size = 0
+    while size < length:
+        word = rng.choice(WORDS)
+        r = rng.random()
+        if r < commands:
+            word = "\\%s{%s}" % (rng.choice(COMMANDS), word)
+        elif r < commands + groups:
+            word = "{%s {%s}}" % (word, rng.choice(WORDS))
+        parts.append(word)
+        size += len(word) + 1
+    return " ".join(parts)
+
+
+def _equation(rng, indent):
+    terms = ["%s^%d" % (rng.choice("xyz"), rng.randint(2, 9)) for _ in range(3)]
+    if rng.random() < 0.5:
+        return "%s\\eq: f(x) = %s" % (indent, " + ".join(terms))
+    return "%s\\eq[%s]:\n%s%sf(x) = %s" % (
+        indent,
+        rng.choice(WORDS),
+        indent,
+        INDENT,
+        " + ".join(terms),
+    )
+
+
+def generate(
+    seed=0,
+    size=10000,
+    depth=3,
+    line_length=60,
+    commands=0.1,
+    groups=0.05,
+    comments=0.05,
+    equations=0.05,
+    pysplice=0,
+):
+    """
+    returns: a document of at least `size` characters, whose environments are nested up
+        to `depth` deep, and whose lines are of about `line_length` characters
+    commands, groups: the fraction of words in commands or groups
+    comments: the fraction of lines ending in a comment
+    equations: the fraction of lines that are `\\eq` blocks instead
+    pysplice: how many `\\pysplice` blocks there are, spread over the document
+    """
+    rng = random.Random(seed)
+    lines = ["\\documentclass{article}", "\\title{%s}" % words(rng, 20, 0, 0), "==="]
+    length = sum(map(len, lines)) + len(lines)
+    level = 0
+    while length < size:
+        indent = INDENT * level
+        r = rng.random()
+        if r < equations:
+            line = _equation(rng, indent)
+        elif level < depth and r < equations + 0.1:
+            line = "%s\\%s:" % (indent, rng.choice(ENVIRONMENTS))
+            level += 1
+        else:
+            line = indent + words(
+                rng, max(line_length - len(indent), 20), commands, groups
+            )
+            if rng.random() < comments:
+                line += " % " + words(rng, 20, 0, 0)
+            if level and rng.random() < 0.1:
+                level -= 1
+        lines.append(line)
+        length += len(line) + 1
+    if lines[-1].endswith(":"):
+        # every environment needs a body
+        lines.append(INDENT * level + words(rng, line_length, commands, groups))
+    if pysplice:
+        # at the top level, at evenly spaced lines of the document's body
+        tops = [i for i, line in enumerate(lines) if i > 2 and not line[0].isspace()]
+        step = max(1, len(tops) // pysplice)
+        for n, i in reversed(list(enumerate(tops[::step][:pysplice]))):
+            lines.insert(i, "\\pysplice:\n%sprint(%d * %d)" % (INDENT, n, n))
+    return "\n".join(lines) + "\n"
+
+
+_pysplice_pattern = re.compile(
+    r"^([ \t]*)\\pysplice\b[^\n]*(?:\n(?:\1[ \t]+[^\n]*|[ \t]*)(?=\n|\Z))*\n?",
+    re.MULTILINE,
+)
+
+
+def without_pysplice(source):
+    """
+    returns: `source` without its `\\pysplice` blocks, so that it can be translated
+        without a Python sandbox
+    """
+    return _pysplice_pattern.sub("", source)
+
+
+def scale(source, times):
+    """
+    returns: `source` with the body of its document repeated `times` times
+    """
+    preamble, delimiter, body = source.partition("\n===\n")
+    if not delimiter:
+        return source * times
+    if not body.endswith("\n"):
+        body += "\n"
+    return preamble + delimiter + body * times
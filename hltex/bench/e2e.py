@@ -0,0 +1,84 @@
+"""
+End-to-end benchmarks of translating whole documents: the examples next to the package
+(`demo.hltex` and `simple.hltex`, when run from a checkout) with their bodies repeated,
+and generated documents of a few shapes
+"""
+import os
+
+from ..translator import Translator, translate
+from .corpus import generate, scale, without_pysplice
+from .timing import best_time, timed
+
+EXAMPLES = ["demo.hltex", "simple.hltex"]
+# name: the arguments to `generate` (besides `size`)
+SHAPES = {
+    "corpus": {},
+    "corpus_deep": {"depth": 12},
+    "corpus_dense": {"commands": 0.5, "groups": 0.3, "comments": 0.3},
+    "corpus_long_lines": {"line_length": 2000},
+    "corpus_equations": {"equations": 0.5},
+}
+
+
+def example_path(name):
+    """
+    returns: the path of the example `name` in the checkout the package is in, or None
+        if it isn't in one
+    """
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    path = os.path.join(root, name)
+    return path if os.path.isfile(path) else None
+
+
+def _update_run(source):
+    # an edit at the end of a line in the middle of the document, made and then undone,
+    # translated incrementally
+    translator = Translator()
+    translator.translate(source)
+    end = source.index("\n", len(source) // 2)
+    edits = [(end, end, " x"), (end, end + 2, "")]
+
+    def run():
+        edit = edits[0]
+        edits.reverse()
+        return timed(translator.update, *edit)()
+
+    return run
+
+
+def documents(size=100000, scales=(1, 64), pysplice=False):
+    """
+    pysplice: whether to keep the `\\pysplice` blocks (which need a Python sandbox) in
+        the documents, and generate one with some
+    yields: (name, source) for each document benchmarked
+    """
+    strip = (lambda source: source) if pysplice else without_pysplice
+    for example in EXAMPLES:
+        path = example_path(example)
+        if path is None:
+            continue
+        with open(path, "r") as f:
+            source = strip(f.read())
+        for times in scales:
+            yield "%s_x%d" % (os.path.splitext(example)[0], times), scale(source, times)
+    for name, kwargs in SHAPES.items():
+        yield name, generate(size=size, **kwargs)
+    if pysplice:
+        yield "corpus_pysplice", generate(size=size, pysplice=4)
+
+
+def run(size=100000, scales=(1, 64), repeat=5, pysplice=False, only=None):
+    """
+    only: a function of a benchmark's name that returns whether to run it, or None to
+        run all of them
+    yields: (name, characters, best seconds per run) for translating each document (see
+        `documents`), and for translating an edit to the first generated one
+    """
+    update = None
+    for name, source in documents(size=size, scales=scales, pysplice=pysplice):
+        if update is None and name.startswith("corpus"):
+            update = source
+        if only is None or only(name):
+            yield name, len(source), best_time(timed(translate, source), repeat=repeat)
+    if only is None or only("corpus_update"):
+        yield "corpus_update", len(update), best_time(_update_run(update), repeat=repeat)
@@ -0,0 +1,101 @@
+"""
+Sends translation requests to a running `hltex serve` from several threads at once,
+and reports the p50 and p99 latency and the requests per second.
+
+Usage (with a server running, e.g. `hltex serve --quiet`):
+    python -m hltex.bench.loadtest [--port PORT | --socket PATH] [--requests N]
+        [--concurrency N] [--distinct N] [--size CHARS]
+
+Requests cycle through `--distinct` different documents, so with fewer distinct
+documents than the server's `--cache-size` most requests after the first few are
+served from its cache, and with `--distinct` at least `--requests` none are. The
+documents are generated (see `corpus.generate`), each from a seed of its own.
+"""
+import argparse
+import http.client
+import json
+import socket
+import threading
+import time
+
+from .corpus import generate
+
+
+class UnixConnection(http.client.HTTPConnection):
+    def __init__(self, path):
+        super().__init__("localhost")
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+def percentile(latencies, p):
+    return latencies[min(int(len(latencies) * p / 100), len(latencies) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--socket", dest="path")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--distinct", type=int, default=1000)
+    parser.add_argument("--size", type=int, default=2000)
+    args = parser.parse_args()
+
+    sources = [generate(seed=i, size=args.size) for i in range(args.distinct)]
+    bodies = [json.dumps({"source": source}).encode("utf-8") for source in sources]
+    latencies = []
+    errors = []
+    counter = iter(range(args.requests))
+    lock = threading.Lock()
+
+    def client():
+        if args.path is not None:
+            conn = UnixConnection(args.path)
+        else:
+            conn = http.client.HTTPConnection(args.host, args.port)
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                break
+            start = time.perf_counter()
+            conn.request(
+                "POST",
+                "/translate",
+                body=bodies[i % len(bodies)],
+                headers={"Content-Type": "application/json"},
+            )
+            response = conn.getresponse()
+            response.read()
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if response.status != 200:
+                    errors.append(response.status)
+        conn.close()
+
+    threads = [threading.Thread(target=client) for _ in range(args.concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print("requests:    {}".format(len(latencies)))
+    print("errors:      {}".format(len(errors)))
+    print("concurrency: {}".format(args.concurrency))
+    print("chars:       {}".format(len(sources[0])))
+    print("p50:         {:.2f} ms".format(percentile(latencies, 50) * 1000))
+    print("p99:         {:.2f} ms".format(percentile(latencies, 99) * 1000))
+    print("requests/s:  {:.1f}".format(len(latencies) / elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Microbenchmarks of each parse function of `hltex.translator`, on an argument or body of
+about `size` characters, in the same state it's in when the translator gets to it (each
+run parses a new `State`, whose setup isn't timed)
+"""
+import random
+import time
+
+from .. import translator
+from ..control import Command, commands, environments
+from ..indentation import LineTable
+from ..lexer import Tokens
+from ..state import State
+from .corpus import INDENT, generate, words
+from .timing import best_time
+
+_command = Command("cmd", lambda state, arg: arg, params="!")
+
+
+def _text(size, seed=0):
+    # one line, since arguments can't span lines unless they're in braces
+    return words(random.Random(seed), size, commands=0.1, groups=0.05)
+
+
+def _lines(size, seed=0):
+    rng = random.Random(seed)
+    lines = []
+    length = 0
+    while length < size:
+        lines.append(INDENT + words(rng, 56, commands=0.1, groups=0.05))
+        length += len(lines[-1]) + 1
+    return "\n".join(lines) + "\n"
+
+
+def _equations(size, seed=0):
+    rng = random.Random(seed)
+    lines = []
+    length = 0
+    while length < size:
+        terms = ["%s^%d" % (rng.choice("xyz"), rng.randint(2, 9)) for _ in range(8)]
+        lines.append(INDENT + "f(x) &= " + " + ".join(terms) + " \\\\")
+        length += len(lines[-1]) + 1
+    return "\n".join(lines) + "\n"
+
+
+# name: a function of `size` that returns the source, where the parse function starts
+# in it, and a function of the state that calls the parse function
+BENCHMARKS = {
+    "parse_arg_control": lambda size: (
+        "\\cmd{%s}" % _text(size),
+        1,
+        translator.parse_arg_control,
+    ),
+    "parse_group": lambda size: (
+        "{%s}" % _text(size),
+        1,
+        lambda state: translator.parse_group(state, end="}"),
+    ),
+    "parse_optional_arg": lambda size: (
+        "[%s]" % _text(size),
+        0,
+        translator.parse_optional_arg,
+    ),
+    "parse_required_arg": lambda size: (
+        "{%s}" % _text(size),
+        0,
+        lambda state: translator.parse_required_arg(state, name="cmd"),
+    ),
+    "parse_args": lambda size: (
+        "[%s]{%s}" % (_text(size // 2), _text(size // 2, seed=1)),
+        0,
+        lambda state: translator.parse_args(state, name="cmd", params="?!"),
+    ),
+    "parse_optional_argstr": lambda size: (
+        "%s]" % _text(size),
+        0,
+        translator.parse_optional_argstr,
+    ),
+    "parse_argstr": lambda size: (
+        "".join("{%s}" % _text(40, seed=i) for i in range(max(1, size // 45))),
+        0,
+        translator.parse_argstr,
+    ),
+    "parse_custom_command": lambda size: (
+        "\\cmd{%s}" % _text(size),
+        4,
+        lambda state: translator.parse_custom_command(state, command=_command),
+    ),
+    "parse_native_control": lambda size: (
+        "\\itemize:\n" + _lines(size),
+        8,
+        lambda state: translator.parse_native_control(
+            state, name="itemize", outer_indent_level=0
+        ),
+    ),
+    "parse_custom_environment": lambda size: (
+        "\\eq:\n" + _equations(size),
+        3,
+        lambda state: translator.parse_custom_environment(
+            state, environment=environments["eq"], outer_indent_level=0
+        ),
+    ),
+    "parse_raw_environment_body": lambda size: (
+        ":\n" + _equations(size),
+        1,
+        lambda state: translator.parse_raw_environment_body(
+            state, outer_indent_level=0
+        ),
+    ),
+    "parse_environment_body": lambda size: (
+        ":\n" + _lines(size),
+        1,
+        lambda state: translator.parse_environment_body(state, outer_indent_level=0),
+    ),
+    "parse_block": lambda size: (
+        generate(size=size),
+        0,
+        lambda state: translator.parse_block(state, preamble=True),
+    ),
+}
+
+
+def _parse_run(source, pos, parse):
+    custom = dict(commands, cmd=_command)
+
+    def run():
+        state = State(source, pos=pos, commands=custom)
+        start = time.perf_counter()
+        parse(state)
+        return time.perf_counter() - start
+
+    return run
+
+
+def _setup_run(setup, source):
+    def run():
+        start = time.perf_counter()
+        setup(source)
+        return time.perf_counter() - start
+
+    return run
+
+
+def run(size=20000, repeat=5, only=None):
+    """
+    only: a function of a benchmark's name that returns whether to run it, or None to
+        run all of them
+    yields: (name, characters, best seconds per run) for each benchmark
+    """
+    for name, make in BENCHMARKS.items():
+        if only is None or only(name):
+            source, pos, parse = make(size)
+            seconds = best_time(_parse_run(source, pos, parse), repeat=repeat)
+            yield name, len(source) - pos, seconds
+    # what every `State` does before any parse function runs
+    source = generate(size=size)
+    for name, setup in [("lexer", Tokens), ("line_table", LineTable)]:
+        if only is None or only(name):
+            yield name, len(source), best_time(_setup_run(setup, source), repeat=repeat)
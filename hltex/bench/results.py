@@ -0,0 +1,63 @@
+"""
+Benchmark results, as saved to (and compared against) JSON files of the form
+    {
+        "hltex": version, "python": version, "machine": description,
+        "benchmarks": {name: {"chars": characters, "seconds": best seconds per run}},
+        "thresholds": {name: allowed slowdown}  (optional)
+    }
+"""
+import json
+import platform
+
+from .. import __version__
+
+# how much slower than the baseline a benchmark may get (as a fraction of its time in
+# the baseline) before it counts as a regression, unless the baseline says otherwise
+THRESHOLD = 0.25
+
+
+def results(timings):
+    """
+    timings: (name, characters, seconds) for each benchmark
+    returns: the results of `timings`, for `save`
+    """
+    return {
+        "hltex": __version__,
+        "python": platform.python_version(),
+        "machine": "{} {}".format(platform.system(), platform.machine()),
+        "benchmarks": {
+            name: {"chars": chars, "seconds": seconds}
+            for name, chars, seconds in timings
+        },
+    }
+
+
+def save(res, path):
+    with open(path, "w") as f:
+        json.dump(res, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def load(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def compare(res, baseline, threshold=THRESHOLD):
+    """
+    returns: (name, seconds in the baseline, seconds now, ratio, whether it regressed)
+        for each benchmark in both `res` and `baseline`, where one regresses if it got
+        slower by more than its threshold in `baseline` (or `threshold`)
+    """
+    thresholds = baseline.get("thresholds", {})
+    old = baseline["benchmarks"]
+    comparison = []
+    for name, new in res["benchmarks"].items():
+        if name not in old:
+            continue
+        ratio = new["seconds"] / old[name]["seconds"]
+        allowed = thresholds.get(name, threshold)
+        comparison.append(
+            (name, old[name]["seconds"], new["seconds"], ratio, ratio > 1 + allowed)
+        )
+    return comparison
@@ -0,0 +1,61 @@
+"""
+Times `translate` on documents of doubling size, to check that translation time grows
+linearly with the size of the document (i.e. that the time per character stays flat).
+Lexing (which `translate` does first) is also timed on its own.
+
+Usage:
+    python -m hltex.bench.scaling [--steps N] [--start CHARS]
+"""
+import argparse
+
+from ..lexer import Tokens
+from ..translator import translate
+from .corpus import generate
+from .timing import best_time, timed
+
+# name: the arguments to `generate` (besides `size`), or None for a document that's a
+# single paragraph of `size` characters
+SHAPES = {
+    "long paragraph": None,
+    "long document": {},
+}
+
+
+def document(shape, size):
+    kwargs = SHAPES[shape]
+    if kwargs is None:
+        kwargs = {"depth": 0, "line_length": size, "comments": 0, "equations": 0}
+    return generate(size=size, **kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--steps", type=int, default=6)
+    parser.add_argument("--start", type=int, default=50000)
+    args = parser.parse_args()
+
+    for shape in SHAPES:
+        print(shape)
+        print(
+            "{:>12} {:>10} {:>12} {:>12}".format(
+                "chars", "seconds", "us/char", "lex us/char"
+            )
+        )
+        size = args.start
+        for _ in range(args.steps):
+            source = document(shape, size)
+            elapsed = best_time(timed(translate, source), repeat=3)
+            lexing = best_time(timed(Tokens, source), repeat=3)
+            print(
+                "{:>12} {:>10.4f} {:>12.4f} {:>12.4f}".format(
+                    len(source),
+                    elapsed,
+                    elapsed / len(source) * 1e6,
+                    lexing / len(source) * 1e6,
+                )
+            )
+            size *= 2
+
+
+if __name__ == "__main__":
+    main()
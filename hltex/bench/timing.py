@@ -0,0 +1,33 @@
+import time
+
+
+def best_time(run, repeat=5, min_time=0.02):
+    """
+    run: a function of no arguments that does what's timed once, and returns how many
+        seconds that took (so that it can leave out whatever it has to set up first)
+    returns: the seconds per run of the fastest of `repeat` rounds, each of as many runs
+        as take at least `min_time` seconds
+    """
+    best = None
+    for _ in range(repeat):
+        runs = 0
+        elapsed = 0.0
+        while elapsed < min_time or not runs:
+            elapsed += run()
+            runs += 1
+        per_run = elapsed / runs
+        best = per_run if best is None else min(best, per_run)
+    return best
+
+
+def timed(fn, *args, **kwargs):
+    """
+    returns: a function for `best_time` that calls `fn(*args, **kwargs)`
+    """
+
+    def run():
+        start = time.perf_counter()
+        fn(*args, **kwargs)
+        return time.perf_counter() - start
+
+    return run
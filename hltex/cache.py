@@ -0,0 +1,196 @@
+import hashlib
+import json
+import os
+
+from . import __version__
+from .control import commands, environments
+
+# 256 MiB
+default_max_size = 256 * 1024 * 1024
+
+
+def default_directory():
+    """
+    returns: `$XDG_CACHE_HOME/hltex`, or `~/.cache/hltex` if `XDG_CACHE_HOME` isn't set
+    """
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "hltex")
+
+
+def pysplice_cache():
+    """
+    returns: the Cache of Python block outputs (see `MemoPybox`), kept apart from the
+        translations
+    """
+    return Cache(os.path.join(default_directory(), "pysplice"), suffix=".json")
+
+
+def _describe_controls(controls):
+    """
+    returns: a description of the registered commands or environments `controls`,
+        which changes whenever one is registered, removed or given other parameters or
+        another translate function
+    """
+    return [
+        [
+            name,
+            control.params,
+            getattr(control, "raw", False),
+            getattr(control.translate_fn, "__module__", None),
+            _describe_function(control.translate_fn),
+        ]
+        for name, control in sorted(controls.items())
+    ]
+
+
+def _describe_function(fn):
+    """
+    returns: the qualified name of the translate function `fn`, or for callables without
+        one (e.g. a `functools.partial`), their repr, which may differ from one process
+        to the next (so that their translations are only found by the same process,
+        rather than found for another callable of the same type)
+    """
+    name = getattr(fn, "__qualname__", None)
+    if name is None:
+        return repr(fn)
+    return name
+
+
+class Cache:
+    """
+    A content-addressed cache of translations (or other text) on disk, with one file
+    per translation named after its key (see `key`)
+    directory: where the translations are kept (created when the first one is stored)
+    max_size: the most bytes the translations may take up; storing one past that
+        evicts the translations least recently used (i.e. stored or loaded) until they
+        fit again
+    suffix: the extension of the files the translations are kept in
+    """
+
+    def __init__(self, directory=None, max_size=default_max_size, suffix=".tex"):
+        if directory is None:
+            directory = default_directory()
+        self.directory = directory
+        self.max_size = max_size
+        self.suffix = suffix
+
+    @staticmethod
+    def key(source, file_env=None, commands=commands, environments=environments):
+        """
+        returns: the key of the translation of `source` with `file_env` and the custom
+            `commands` and `environments`, which also depends on the version of hltex
+        """
+        if file_env is None:
+            file_env = {}
+        setup = json.dumps(
+            [
+                __version__,
+                sorted(file_env.items()),
+                _describe_controls(commands),
+                _describe_controls(environments),
+            ]
+        )
+        digest = hashlib.sha256(setup.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(source.encode("utf-8"))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def _entries(self):
+        """
+        returns: (last used, size, path) for every translation in the cache
+        """
+        try:
+            scan = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return []
+        entries = []
+        for entry in scan:
+            if not entry.name.endswith(self.suffix) or not entry.is_file():
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:  # evicted by another process meanwhile
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        return entries
+
+    def get(self, key):
+        """
+        returns: the translation stored under `key`, or None if there isn't one
+        """
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8", newline="") as f:
+                res = f.read()
+            # the modification time is when a translation was last used
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return res
+
+    def put(self, key, res):
+        """
+        postcondition: the translation `res` is stored under `key`, and translations are
+            evicted for the cache to fit in `max_size`
+        """
+        import tempfile  # only needed on a miss
+
+        os.makedirs(self.directory, exist_ok=True)
+        # written to a temporary file and renamed, so that other processes never read a
+        # partly written translation
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with open(fd, "w", encoding="utf-8", newline="") as f:
+                f.write(res)
+            os.replace(tmp, self._path(key))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self.evict()
+
+    def evict(self):
+        """
+        postcondition: the translations least recently used are removed until the rest
+            take up at most `max_size` bytes
+        """
+        entries = self._entries()
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+
+    def stats(self):
+        """
+        returns: a dict with the directory of the cache, the number of translations in
+            it, the bytes they take up and the most they may take up
+        """
+        entries = self._entries()
+        return {
+            "directory": self.directory,
+            "entries": len(entries),
+            "size": sum(entry[1] for entry in entries),
+            "max_size": self.max_size,
+        }
+
+    def clear(self):
+        """
+        postcondition: every translation in the cache is removed
+        returns: the number of translations removed
+        """
+        entries = self._entries()
+        for _, _, path in entries:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        return len(entries)
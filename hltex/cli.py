@@ -1,22 +1,214 @@
 import click
+import contextlib
 import os
-from hltex.translator import translate
+import sys
 
+# The modules behind each command are imported by the command, so that `hltex --help`
+# (and every other command) only pays for what it uses
 
-@click.command()
+
+class _DefaultGroup(click.Group):
+    """
+    A group of commands that runs `translate` unless the first argument is the name of
+    another command, so that `hltex myfile.hltex` keeps working
+    """
+
+    def parse_args(self, ctx, args):
+        if not args or (args[0] not in self.commands and args[0] not in ('--help', '-h')):
+            args = ['translate'] + args
+        return super().parse_args(ctx, args)
+
+
+@click.group(cls=_DefaultGroup)
+def main():
+    pass
+
+
+@main.command('translate')
 @click.option('--out', type=click.Path(),
-              help='Output file to save compiled LaTeX into (input file basename with the `.tex` extension by default)')
-@click.argument('filename', type=click.Path(exists=True))
-def _translate(filename, out=None):
+              help='Output file to save compiled LaTeX into (input file basename with the `.tex` extension by default, '
+                   'or `-` for standard output, the default when reading standard input)')
+@click.option('--out-dir', type=click.Path(file_okay=False),
+              help='Directory to save the translations of several files into, mirroring the directories they\'re in')
+@click.option('--jobs', '-j', type=click.IntRange(min=1),
+              help='Number of files to translate at once (one per CPU by default)')
+@click.option('--slowest', type=click.IntRange(min=0),
+              help='Number of slowest files to list after translating several files (10 by default)')
+@click.option('--no-cache', is_flag=True,
+              help='Translate the file (and run its Python blocks) even if it\'s cached, and don\'t cache it')
+@click.option('--watch', is_flag=True,
+              help='Keep translating the files (or the `.hltex` files in the directories) as they change')
+@click.argument('paths', nargs=-1, required=True)
+@click.pass_context
+def _translate(ctx, paths, out=None, out_dir=None, jobs=None, slowest=None, no_cache=False, watch=False):
+    """
+    Translate a file (or standard input, as `-`), or every file the PATHS name (as
+    files, directories of `.hltex` files or glob patterns), next to them or into
+    --out-dir
+    """
+    from hltex.cache import Cache, pysplice_cache
+    if watch:
+        from hltex.watch import Builder, default_output, watch as watch_paths
+        for path in paths:
+            if not os.path.exists(path):
+                raise click.BadParameter('No such file or directory: {}'.format(path))
+        if jobs is not None or slowest is not None:
+            raise click.UsageError('--jobs and --slowest don\'t work with --watch')
+        single = len(paths) == 1 and not os.path.isdir(paths[0])
+        if out is not None and (not single or out_dir is not None):
+            raise click.UsageError('--out only works when watching a single file (see --out-dir)')
+        if out is not None:
+            output = lambda filename: out
+        elif single and out_dir is None:
+            output = default_output
+        else:
+            # where translating them all at once puts them (see `output_paths`), so that
+            # files with the same name don't overwrite each other's translations; rooted
+            # at the paths given, since the files in them may change
+            from hltex.batch import output_paths
+            root = os.path.commonpath(
+                [os.path.abspath(path if os.path.isdir(path) else os.path.dirname(path)) for path in paths])
+            output = lambda filename: output_paths([filename], out_dir, root=root)[0]
+        builder = Builder(output=output, pysplice_cache=None if no_cache else pysplice_cache())
+        print('Watching for changes (press Ctrl-C to stop)')
+        watch_paths(paths, builder)
+        return
+    if len(paths) != 1 or not (paths[0] == '-' or os.path.isfile(paths[0])) or out_dir is not None:
+        from hltex.batch import expand, output_paths, run
+        if out is not None:
+            raise click.UsageError('--out only works for a single file (see --out-dir)')
+        files, missing = expand(paths)
+        if missing:
+            raise click.BadParameter('No such file or directory: {}'.format(', '.join(missing)))
+        outputs = output_paths(files, out_dir)
+        ctx.exit(run(files, outputs, jobs=jobs, use_cache=not no_cache,
+                     slowest=10 if slowest is None else slowest))
+    filename = paths[0]
+    if out is None:
+        out = '-' if filename == '-' else os.path.splitext(os.path.basename(filename))[0] + '.tex'
+    if no_cache or '-' in (filename, out):
+        # translated a few blocks at a time, since without the cache the source doesn't
+        # have to be read (nor its translation held) as a whole
+        _translate_stream(filename, out, None if no_cache else pysplice_cache())
+        return
     with open(filename, 'r') as f:
-        res = translate(f.read())
+        source = f.read()
+    from hltex.control.pysplice import has_python_blocks
+    # documents with Python blocks are translated every time, since their blocks may
+    # print something else each time (see `# hltex: no-cache`); the outputs of the
+    # blocks are cached on their own
+    cache = key = res = None
+    if not has_python_blocks(source):
+        cache = Cache()
+        key = cache.key(source)
+        res = cache.get(key)
+    if res is None:
+        # a cached translation is written without even importing the translator
+        from hltex.translator import translate
+        res = translate(source, pysplice_cache=pysplice_cache())
+        if res is not None and cache is not None:
+            cache.put(key, res)
     if res is not None:
-        if out is None:
-            out = os.path.splitext(os.path.basename(filename))[0] + '.tex'
         with open(out, 'w') as f:
             f.write(res)
         print('Wrote output to `{}`'.format(out))
 
 
+def _translate_stream(filename, out, pysplice_cache):
+    from hltex.translator import translate_mapped, translate_stream
+
+    def translate(outfile):
+        if filename == '-':
+            translate_stream(sys.stdin, outfile, pysplice_cache=pysplice_cache)
+        elif _mappable(filename, outfile):
+            # memory-mapped, so that the lines that translate to themselves are copied
+            # from it without being decoded
+            outfile.flush()
+            translate_mapped(filename, outfile.buffer, pysplice_cache=pysplice_cache)
+            outfile.buffer.flush()
+        else:
+            with open(filename, 'r') as infile:
+                translate_stream(infile, outfile, pysplice_cache=pysplice_cache)
+
+    if out == '-':
+        translate(sys.stdout)
+        return
+    with open(out, 'w') as outfile:
+        try:
+            translate(outfile)
+        except BaseException:
+            # rather than leaving the translation up to where it failed
+            outfile.close()
+            with contextlib.suppress(OSError):
+                os.remove(out)
+            raise
+    print('Wrote output to `{}`'.format(out))
+
+
+def _mappable(filename, outfile):
+    """
+    returns: whether translating the bytes of `filename` to `outfile` (see
+        `translate_mapped`) gives what translating it in text mode does, as the other
+        paths do: when both are in UTF-8 and newlines are written as they are, and the
+        file has no `\\r` for text mode to read as a newline
+    """
+    import codecs
+    import locale
+    import mmap
+    encodings = (locale.getpreferredencoding(False), getattr(outfile, 'encoding', None) or 'ascii')
+    if os.linesep != '\n' or any(codecs.lookup(encoding).name != 'utf-8' for encoding in encodings):
+        return False
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return True
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return data.find(b'\r') == -1
+
+
+@main.command('serve')
+@click.option('--host', default='127.0.0.1', help='Host to serve HTTP on')
+@click.option('--port', type=int, help='Port to serve HTTP on (8765 unless --socket is given)')
+@click.option('--socket', 'path', type=click.Path(), help='Unix socket to serve on')
+@click.option('--workers', type=int, help='Number of worker processes (one per CPU by default)')
+@click.option('--cache-size', type=int, default=256, help='Number of recent translations kept in memory')
+@click.option('--quiet', is_flag=True, help='Don\'t log every request')
+def _serve(host, port, path, workers, cache_size, quiet):
+    """Serve translations over HTTP (`POST /translate`) until interrupted"""
+    from hltex.errors import TranslationError
+    from hltex.server import Service, serve
+    try:
+        service = Service(workers=workers, cache_size=cache_size)
+    except TranslationError as e:
+        raise click.UsageError(e.msg)
+    if port is None and path is None:
+        port = 8765
+    if port is not None:
+        print('Serving on http://{}:{}'.format(host, port))
+    if path is not None:
+        print('Serving on {}'.format(path))
+    serve(service, host=host, port=port, path=path, quiet=quiet)
+
+
+@main.group('cache')
+def _cache():
+    """Inspect or clear the cache of translations"""
+
+
+@_cache.command('stats')
+def _cache_stats():
+    from hltex.cache import Cache, pysplice_cache
+    for name, cache in [('Translations', Cache()), ('Python blocks', pysplice_cache())]:
+        stats = cache.stats()
+        print('{}: {} entries, {} of {} bytes in `{}`'.format(
+            name, stats['entries'], stats['size'], stats['max_size'], stats['directory']))
+
+
+@_cache.command('clear')
+def _cache_clear():
+    from hltex.cache import Cache, pysplice_cache
+    print('Removed {} cached translations and {} cached Python blocks'.format(
+        Cache().clear(), pysplice_cache().clear()))
+
+
 if __name__ == '__main__':
-    _translate()
+    main()
@@ -1,3 +1,9 @@
+import re
+
+_whitespace_pattern = re.compile(r"[^\S\n]*")
+_letters_pattern = re.compile(r"[A-Za-z]*")
+
+
 def parse_while(state, pred):
     """
     pred: a boolean-valued function (i.e. a predicate) on a character
@@ -12,15 +18,46 @@ def parse_while(state, pred):
     return state.text[start : state.pos]
 
 
-def parse_until(state, pred):
+def parse_token(state):
     """
-    pred: a boolean-valued function (i.e. a predicate) on a character
-    postcondition: `state.pos` is at the first character satisfying `pred`,
-        after the original `state.pos` at call-time, or `len(self.text)` if there is
-        no such character
-    returns: the text *not* satisfying `pred` starting from the original `state.pos`
+    precondition: a token (see `hltex.lexer`) starts at `state.pos`
+    postcondition: `state.pos` is at the end of that token
+    returns: the text of the token
+    """
+    start = state.pos
+    state.pos = state.tokens.end_at(start)
+    return state.text[start : state.pos]
+
+
+def next_token(state):
+    """
+    returns: the kind of the token starting at `state.pos` (see `Tokens.kind_at`)
     """
-    return parse_while(state, pred=lambda c: not pred(c))
+    return state.tokens.kind_at(state.pos)
+
+
+def parse_whitespace(state):
+    """
+    postcondition: `state.pos` is at the first character that is either a newline or
+        not whitespace
+    returns: the whitespace skipped over
+    """
+    start = state.pos
+    state.pos = _whitespace_pattern.match(state.text, start).end()
+    return state.text[start : state.pos]
+
+
+def parse_letters(state):
+    """
+    postcondition: `state.pos` is at the first non-alphabetic character
+    returns: the letters skipped over, same as `parse_while(state, str.isalpha)`
+    """
+    start = state.pos
+    state.pos = _letters_pattern.match(state.text, start).end()
+    if not state.finished() and state.text[state.pos] >= "\x80":
+        # ASCII letters cover nearly all control names; anything else takes the slow path
+        parse_while(state, pred=str.isalpha)
+    return state.text[start : state.pos]
 
 
 def increment(state):
@@ -5,6 +5,8 @@ environments = {}
 
 
 class Command:
+    __slots__ = ("name", "translate_fn", "params")
+
     def __init__(self, name, translate_fn, params=""):
         self.name = name
         self.translate_fn = translate_fn
@@ -16,6 +18,8 @@ class Command:
 
 
 class Environment:
+    __slots__ = ("name", "translate_fn", "params", "raw")
+
     def __init__(self, name, translate_fn, params="", raw=False):
         self.name = name
         self.translate_fn = translate_fn
@@ -1,13 +1,292 @@
-from ..pybox import Pybox, default_docker
+from collections import deque
+
+from ..errors import TranslationError
+from ..indentation import preprocess_block
+from ..nodes import (
+    Body,
+    Command,
+    Control,
+    CustomEnvironment,
+    Document,
+    Environment as EnvironmentNode,
+    Group,
+    Raw,
+    Text,
+)
 from .control import Environment, environments
 
 
+def _pybox(state, docker):
+    """
+    returns: the sandbox of `state` for the Docker image `docker`, created if need be
+    """
+    # imported here, since most documents have no Python blocks
+    from ..pybox import MemoPybox, pool
+
+    if state.pyboxes.get(docker) is None:
+        if state.pysplice_cache is None:
+            pybox = pool().acquire(
+                docker=docker, file_env=state.file_env, executor=state.executor
+            )
+        else:
+            pybox = MemoPybox(
+                state.pysplice_cache,
+                docker=docker,
+                file_env=state.file_env,
+                executor=state.executor,
+            )
+        state.pyboxes[docker] = pybox
+    return state.pyboxes[docker]
+
+
 def translate_pysplice(state, body, docker):
+    from ..pybox import default_docker
+
     if docker is None:
         docker = default_docker
-    if state.pyboxes.get(docker) is None:
-        state.pyboxes[docker] = Pybox(docker=docker, file_env=state.file_env)
-    return state.pyboxes[docker].run(body)
+    # run ahead of time by `run_python_blocks` or `run_concurrently`, if they found
+    # this block
+    queue = state.pysplice_outputs.get(docker)
+    if queue:
+        if queue[0][0] == body:
+            res = queue.popleft()[1]
+            if state.pysplice_runners is not None:
+                return res.result()  # a Future (see `_submit_block`)
+            if isinstance(res, TranslationError):
+                raise res
+            return res
+        queue.clear()
+    if state.pysplice_runners is not None:
+        # after the blocks already given to the sandbox's thread
+        return _runner(state, docker).submit(body).result()
+    return _pybox(state, docker).run(body)
+
+
+def has_python_blocks(source, environments=environments):
+    """
+    returns: whether `source` may have Python blocks, with the custom `environments`
+        (i.e. whether it uses the name of an environment that runs them)
+    """
+    return any(
+        "\\" + name in source
+        for name, environment in environments.items()
+        if environment.translate_fn is translate_pysplice
+    )
+
+
+def _foreign(control):
+    """
+    returns: whether the custom command or environment `control` was registered outside
+        hltex (and so may run Python blocks of its own)
+    """
+    return not control.translate_fn.__module__.startswith(__package__)
+
+
+def _block_docker(state, node):
+    """
+    returns: the Docker image of the Python block `node`, or None if it isn't known
+        until the block's argument is translated
+    """
+    from ..pybox import default_docker
+
+    [docker] = node.args
+    if docker is None:
+        return default_docker
+    if all(type(child) is Text for child in docker.children):
+        return state.text[docker.start + 1 : docker.end - 1]
+    return None
+
+
+def _find_blocks(nodes, found):
+    """
+    postcondition: the Python blocks among `nodes` (at any depth) are appended to
+        `found`, in the order they're emitted in, up to the first use of a control
+        registered outside hltex (which may run Python blocks of its own)
+    returns: False if the blocks were only found up to such a control
+    """
+    for node in nodes:
+        kind = type(node)
+        if kind is Command or kind is CustomEnvironment:
+            control = node.command if kind is Command else node.environment
+            if control.translate_fn is translate_pysplice:
+                found.append(node)
+                continue
+            if _foreign(control):
+                return False
+            children = [arg for arg in node.args if type(arg) is Group]
+            if kind is CustomEnvironment and type(node.body) is Body:
+                children.append(node.body)
+        elif kind is EnvironmentNode:
+            children = node.argstr + [node.body]
+        elif kind is Control:
+            children = node.argstr
+        elif kind is Group or kind is Body or kind is Document:
+            children = node.children
+        else:
+            continue
+        if not _find_blocks(children, found):
+            return False
+    return True
+
+
+def run_python_blocks(state, nodes):
+    """
+    nodes: nodes about to be emitted (see `hltex.emitter`)
+    postcondition: the Python blocks among `nodes` are run, the blocks for each Docker
+        image in a single round trip to its sandbox (see `Pybox.run_all`), and
+        `translate_pysplice` takes their outputs (or the error of the block that
+        failed, or that the sandbox couldn't be started with) from
+        `state.pysplice_outputs` as they're emitted
+    """
+    if state.pysplice_runners is not None:
+        # already running (see `run_concurrently`)
+        return
+    if not has_python_blocks(state.text, state.environments):
+        return
+    found = []
+    _find_blocks(nodes, found)
+    batches = {}
+    for node in found:
+        docker = _block_docker(state, node)
+        if docker is None or type(node.body) is not Raw:
+            break
+        body = preprocess_block(state.text[node.body.start : node.body.end])
+        batches.setdefault(docker, []).append(body)
+    for docker, bodies in batches.items():
+        try:
+            outputs, error = _pybox(state, docker).run_all(bodies)
+        except TranslationError as e:
+            # the sandbox couldn't be started, which the first block fails with
+            outputs, error = [], e
+        queue = state.pysplice_outputs.setdefault(docker, deque())
+        queue.extend(zip(bodies, outputs))
+        if error is not None:
+            queue.append((bodies[len(outputs)], error))
+
+
+class _Runner:
+    """
+    A thread running the Python blocks of the sandbox for the Docker image `docker`, in
+    the order they're submitted, and as a batch the blocks submitted while it was busy
+    running others (see `Pybox.run_all`)
+    """
+
+    def __init__(self, state, docker):
+        import threading  # only needed to translate concurrently
+
+        self.state = state
+        self.docker = docker
+        self.lock = threading.Lock()
+        # the blocks waiting to be run, as (body, Future)
+        self.pending = []
+        self.thread = None
+        # the error of the block that failed, which every block after it fails with
+        self.error = None
+        self.closed = False
+
+    def submit(self, body):
+        """
+        returns: a Future of the output of the Python block `body`
+        """
+        import threading
+        from concurrent.futures import Future
+
+        future = Future()
+        with self.lock:
+            self.pending.append((body, future))
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self._run, name="hltex-pysplice", daemon=True
+                )
+                self.thread.start()
+        return future
+
+    def _run(self):
+        while True:
+            with self.lock:
+                batch, self.pending = self.pending, []
+                if not batch or self.closed:
+                    for _, future in batch:
+                        future.cancel()
+                    self.thread = None
+                    return
+            outputs, error = [], self.error
+            if error is None:
+                try:
+                    pybox = _pybox(self.state, self.docker)
+                    outputs, error = pybox.run_all([body for body, _ in batch])
+                except Exception as e:  # pylint: disable=broad-except
+                    error = e
+            for (_, future), output in zip(batch, outputs):
+                future.set_result(output)
+            if error is not None:
+                self.error = error
+                for _, future in batch[len(outputs) :]:
+                    future.set_exception(error)
+
+    def close(self):
+        """
+        postcondition: the blocks waiting to be run are cancelled, and the thread has
+            finished running the others
+        """
+        with self.lock:
+            self.closed = True
+            thread = self.thread
+        if thread is not None:
+            thread.join()
+
+
+def _runner(state, docker):
+    runner = state.pysplice_runners.get(docker)
+    if runner is None:
+        runner = state.pysplice_runners[docker] = _Runner(state, docker)
+    return runner
+
+
+def _submit_block(state, submitted, node):
+    """
+    The `state.on_custom` of `run_concurrently`, which submits each Python block to its
+    sandbox's thread as it's parsed, up to the first one that can't be run ahead of
+    time (see `_find_blocks`), after which the rest are run as they're emitted
+    submitted: the offsets of the blocks submitted so far
+    """
+    control = node.command if type(node) is Command else node.environment
+    if control.translate_fn is not translate_pysplice:
+        if _foreign(control):
+            state.on_custom = None
+        return
+    docker = _block_docker(state, node)
+    if docker is None or type(node.body) is not Raw:
+        state.on_custom = None
+        return
+    if node.start in submitted:
+        return
+    submitted.add(node.start)
+    body = preprocess_block(state.text[node.body.start : node.body.end])
+    future = _runner(state, docker).submit(body)
+    state.pysplice_outputs.setdefault(docker, deque()).append((body, future))
+
+
+def run_concurrently(state):
+    """
+    postcondition: until `finish_concurrently`, the Python blocks of `state.text` are
+        run (in the order they come in for each Docker image) by a thread for each
+        image as soon as they're parsed, instead of as they're emitted, with
+        `translate_pysplice` waiting for their outputs
+    """
+    state.pysplice_runners = {}
+    submitted = set()
+    state.on_custom = lambda node: _submit_block(state, submitted, node)
+
+
+def finish_concurrently(state):
+    """
+    postcondition: every thread of `run_concurrently` has finished, after cancelling
+        the blocks it hadn't started running
+    """
+    state.on_custom = None
+    for runner in state.pysplice_runners.values():
+        runner.close()
 
 
 environments["pysplice"] = Environment(
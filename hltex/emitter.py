@@ -0,0 +1,258 @@
+from .control import latex_env
+from .errors import TranslationError
+from .indentation import (
+    has_line_breaks,
+    postprocess_block,
+    preprocess_block,
+    write_block_text,
+)
+from .nodes import (
+    Command,
+    Comment,
+    Control,
+    CustomEnvironment,
+    Document,
+    Environment,
+    Group,
+    Newline,
+    Raw,
+    Text,
+)
+from .output import collect
+
+
+def emit_text(state, node, out):
+    """
+    postcondition: the source text of `node` is written to `out`
+    """
+    out.write(state.text[node.start : node.end])
+
+
+def emit_group(state, node, out):
+    """
+    postcondition: the translation of the Group `node`, including its braces or
+        brackets, is written to `out`
+    """
+    out.write(state.text[node.start])
+    emit_all(state, node.children, out)
+    out.write(state.text[node.end - 1])
+
+
+def emit_arg(state, arg):
+    """
+    arg: an argument, as for `Command.args`
+    returns: the translation of `arg` (without its braces or brackets), or None for a
+        missing optional argument
+    """
+    if arg is None:
+        return None
+    if type(arg) is Raw:
+        return state.text[arg.start : arg.end]
+    return collect(emit_all, state, nodes=arg.children)
+
+
+def emit_command(state, node, out):
+    """
+    postcondition: the translation of the Command `node` is written to `out`
+    """
+    args = [emit_arg(state, arg) for arg in node.args]
+    try:
+        res = node.command.translate(state, args)
+    except TranslationError as e:
+        raise state.locate(e, node.end)
+    out.write(res)
+
+
+_emitters = {
+    Text: emit_text,
+    Comment: emit_text,
+    Raw: emit_text,
+    Group: emit_group,
+    Command: emit_command,
+}
+
+
+def emit_all(state, nodes, out):
+    """
+    nodes: nodes from inside a group or an argstr
+    postcondition: the translation of `nodes` is written to `out`
+    """
+    for node in nodes:
+        _emitters[type(node)](state, node, out)
+
+
+def emit_newline(state, node, out):
+    """
+    postcondition: the Newline `node` is written to `out`, and `state.irregular` is
+        incremented if the line after it doesn't start with the margin of the body
+        it's in (see `write_block_text`)
+    """
+    write_block_text(state, out, state.text[node.start : node.end])
+    if state.margin and not state.text.startswith(state.margin, node.end):
+        # e.g. tabs where the base indentation is spaces
+        state.irregular += 1
+
+
+def emit_block_group(state, node, out):
+    """
+    postcondition: the translation of the Group `node`, found in a block, is written to
+        `out`
+    """
+    write_block_text(state, out, collect(emit_group, state, node=node))
+
+
+def emit_discarded_command(state, node, out):
+    """
+    postcondition: the Command `node` is translated, but nothing is written to `out`
+    """
+    # A custom command in a block is followed by the control sequence with the same
+    # name (see `parse_block_control`), which is what's written
+    collect(emit_command, state, node=node)
+
+
+def emit_control(state, node, out):
+    """
+    postcondition: the Control `node` is written to `out`
+    """
+    argstr = collect(emit_all, state, nodes=node.argstr)
+    write_block_text(state, out, "\\" + node.name + argstr)
+
+
+def emit_body(state, node, out):
+    """
+    precondition: `state.depth` counts the environment `node` is the Body of
+    postcondition: the translation of the Body `node` is written to `out`, and
+        `state.margin` is the indentation of its lines, or None for one-liners
+    """
+    if node.level is None:
+        state.margin = None
+    else:
+        state.margin = (state.indent_str or "") * node.level
+        if node.comment is not None:
+            out.write("\n" + state.margin)
+            emit_text(state, node.comment, out)
+    emit_block(state, node.children, out)
+
+
+def emit_environment(state, node, out):
+    """
+    postcondition: the translation of the Environment `node` is written to `out`
+    """
+    argstr = collect(emit_all, state, nodes=node.argstr)
+    # As long as every line of the body starts with the body's margin, dedenting the
+    # body, indenting it a level and then indenting it to `node.level` leaves it as it
+    # is, so it's written straight to `out`; bodies where that doesn't hold (counted by
+    # `state.irregular`) are translated again from what was written
+    mark = out.mark()
+    irregular = state.irregular
+    margin = state.margin
+    out.write("\\begin{%s}%s" % (node.name, argstr))
+    body = out.mark()
+    if state.lines.line_breaks or has_line_breaks(node.name + argstr):
+        state.irregular += 1
+    state.depth += 1
+    emit_body(state, node.body, out)
+    state.depth -= 1
+    state.margin = margin
+    indented = node.body.level is not None
+    if indented and margin is None:  # a block inside a one-liner
+        state.irregular += 1
+    if state.irregular == irregular:
+        if indented:
+            if not out.endswith("\n", body):
+                out.write("\n")
+            out.write((state.indent_str or "") * node.level)
+        out.write("\\end{%s}" % node.name)
+        return
+    body = "".join(out[body:])
+    out.truncate(mark)
+    state.irregular = irregular
+    res = latex_env(state, node.name, argstr, preprocess_block(body))
+    # Don't indent the first line
+    write_block_text(state, out, postprocess_block(res, state, node.level))
+
+
+def emit_custom_environment(state, node, out):
+    """
+    postcondition: the translation of the CustomEnvironment `node` is written to `out`
+    """
+    args = [emit_arg(state, arg) for arg in node.args]
+    irregular = state.irregular
+    margin = state.margin
+    state.depth += 1
+    if type(node.body) is Raw:
+        body = state.text[node.body.start : node.body.end]
+    else:
+        body = collect(emit_body, state, node=node.body)
+    state.depth -= 1
+    state.margin = margin
+    state.irregular = irregular
+    try:
+        res = node.environment.translate(state, preprocess_block(body), args)
+    except TranslationError as e:
+        raise state.locate(e, node.end)
+    write_block_text(state, out, postprocess_block(res, state, node.level))
+
+
+def emit_document(state, node, out):
+    """
+    postcondition: the translation of the Document `node` is written to `out`
+    """
+    # The document isn't indented, so its body is written straight to `out` (see
+    # `emit_environment`)
+    mark = out.mark()
+    irregular = state.irregular
+    margin = state.margin
+    out.write("\\begin{document}")
+    body = out.mark()
+    state.depth += 1
+    state.margin = ""
+    emit_block(state, node.children, out)
+    state.depth -= 1
+    state.margin = margin
+    end_document(state, out, mark, body, irregular=state.irregular != irregular)
+    state.irregular = irregular
+
+
+def end_document(state, out, mark, body, irregular):
+    """
+    precondition: `\\begin{document}` was written to `out` at `mark`, followed by the
+        body of the document at `body`, as it stands
+    postcondition: the translation of the document is finished, by writing
+        `\\end{document}` after the body or, if the body is `irregular` (see
+        `emit_environment`), by translating the document again from the body
+    """
+    if not irregular:
+        if not out.endswith("\n", body):
+            out.write("\n")
+        out.write("\\end{document}")
+        return
+    body = preprocess_block("".join(out[body:]))
+    out.truncate(mark)
+    out.write(
+        postprocess_block(
+            latex_env(state, "document", "", body, indent=False), state, 0
+        )
+    )
+
+
+_block_emitters = {
+    Text: emit_text,
+    Comment: emit_text,
+    Newline: emit_newline,
+    Group: emit_block_group,
+    Command: emit_discarded_command,
+    Control: emit_control,
+    Environment: emit_environment,
+    CustomEnvironment: emit_custom_environment,
+    Document: emit_document,
+}
+
+
+def emit_block(state, nodes, out):
+    """
+    nodes: nodes from a block (or a one-liner)
+    postcondition: the translation of `nodes` is written to `out`
+    """
+    for node in nodes:
+        _block_emitters[type(node)](state, node, out)
@@ -1,8 +1,16 @@
 class TranslationError(Exception):
-    def __init__(self, msg):
+    def __init__(self, msg, line=None, col=None):
         self.msg = msg
+        # zero-based, like `State.get_line` and `State.get_col`
+        self.line = line
+        self.col = col
         super().__init__()
 
+    def __str__(self):
+        if self.line is None:
+            return str(self.msg)
+        return "line {}, column {}: {}".format(self.line + 1, self.col + 1, self.msg)
+
 
 class InternalError(TranslationError):
     def __init__(self):
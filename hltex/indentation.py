@@ -1,11 +1,86 @@
-import textwrap
+import re
+from array import array
+from bisect import bisect_left
+from itertools import accumulate, compress
+from operator import eq, not_
 
-from .context import increment, parse_while
+from .context import parse_whitespace
 from .errors import InvalidIndentation
 
+NO_INDENT = 0
+SPACES = 1
+TABS = 2
+MIXED = 3
 
-def iswhitespace(char):
-    return str.isspace(char) and not char == "\n"
+_indent_pattern = re.compile(r"^[^\S\n]*", re.MULTILINE)
+# lines that `textwrap.dedent` empties
+_space_lines_pattern = re.compile(r"^[ \t]+$", re.MULTILINE)
+# the indentation of the lines `textwrap.dedent` finds the common margin of
+_dedent_indent_pattern = re.compile(r"^([ \t]*)[^ \t\n]", re.MULTILINE)
+# characters other than "\n" that `textwrap.indent` can start a new line after (a "\r"
+# only does when it isn't followed by "\n", but the "\n" may not end up following it
+# in the translation, e.g. at the end of a one-liner)
+_line_break_pattern = re.compile("[\r\v\f\x1c\x1d\x1e\x85\u2028\u2029]")
+_margin_patterns = {}
+
+
+class _IndentKinds(dict):
+    """
+    Maps indentation strings to NO_INDENT, SPACES, TABS or MIXED (anything else),
+    classifying each distinct string only once
+    """
+
+    def __missing__(self, indent):
+        if not indent:
+            kind = NO_INDENT
+        elif indent == " " * len(indent):
+            kind = SPACES
+        elif indent == "\t" * len(indent):
+            kind = TABS
+        else:
+            kind = MIXED
+        self[indent] = kind
+        return kind
+
+
+class LineTable:
+    """
+    Facts about every line of a source text, computed in a single pass and stored in
+    parallel arrays indexed by (zero-based) line number:
+    starts: the offset of the first character of the line
+    widths: the number of leading whitespace characters of the line
+    kinds: what the leading whitespace is made of (NO_INDENT, SPACES, TABS or MIXED)
+    blank: whether the line is entirely whitespace
+    nonblank: the line numbers of the lines that aren't blank, in increasing order
+    line_breaks: whether the text contains line breaks other than "\n" (see
+        `write_block_text`)
+    """
+
+    def __init__(self, text):
+        lengths = array("q", map(len, text.split("\n")))
+        indents = _indent_pattern.findall(text)
+        assert len(indents) == len(lengths)
+        # each line takes up its length plus one for its newline
+        self.starts = array("q", accumulate(map((1).__add__, lengths), initial=0))
+        self.starts.pop()
+        self.widths = array("q", map(len, indents))
+        self.kinds = array("b", map(_IndentKinds().__getitem__, indents))
+        self.blank = array("b", map(eq, self.widths, lengths))
+        self.nonblank = array("q", compress(range(len(lengths)), map(not_, self.blank)))
+        self.line_breaks = _line_break_pattern.search(text) is not None
+
+    def __len__(self):
+        return len(self.starts)
+
+    def next_nonblank(self, line):
+        """
+        returns: the first line at or after `line` that isn't blank, or `len(self)` if
+            there isn't one
+        """
+        i = bisect_left(self.nonblank, line)
+        if i == len(self.nonblank):
+            return len(self)
+        return self.nonblank[i]
 
 
 def postprocess_block(res, state, outer_indent_level):
@@ -14,89 +89,126 @@ def postprocess_block(res, state, outer_indent_level):
     assert lines
     res = lines[0]
     if len(lines) > 1:
+        import textwrap  # only needed for blocks that aren't written as they stand
+
         res += "\n" + textwrap.indent("\n".join(lines[1:]), indent_str)
     return res
 
 
 def preprocess_block(body):
+    import textwrap
+
     body = textwrap.dedent(body)
     if body and body[0] == "\n" and body[-1] != "\n":  # indented block
         body += "\n"
     return body
 
 
+def empty_space_lines(text):
+    """
+    returns: `text` with its lines of only spaces and tabs emptied, as by
+        `textwrap.dedent`
+    """
+    return _space_lines_pattern.sub("", text)
+
+
+def dedent_indents(text):
+    """
+    precondition: `text` has no lines of only spaces and tabs (see `empty_space_lines`)
+    returns: the indentation of every line of `text` that `textwrap.dedent` takes the
+        common margin of
+    """
+    return _dedent_indent_pattern.findall(text)
+
+
 def indent_body(body, state):
     if body and body[0] == "\n":  # indented block
         if state.indent_str is not None:
+            import textwrap
+
             body = textwrap.indent(body, state.indent_str)
     return body
 
 
-def parse_empty(state):
+def _margin_pattern(margin):
     """
-    precondition: `state.pos` is at the start of a line
-    postcondition: `state.pos` is at the start of the next non-whitespace line (i.e.
-        after the preceeding newline), or at `len(state.text)` if there isn't a
-        next non-whitespace line
+    returns: a compiled pattern matching a line (after its newline) that doesn't start
+        with `margin`, or that is only `margin` followed by whitespace (except for empty
+        lines when `margin` is empty, which dedenting leaves as they are)
     """
-    start = state.pos
-    body = parse_while(state, pred=iswhitespace)
-    if state.finished():
-        return body
-    if state.text[state.pos] == "\n":
-        increment(state)
-        return body + "\n" + parse_empty(state)
-    state.pos = start
-    return ""
+    pattern = _margin_patterns.get(margin)
+    if pattern is None:
+        if margin:
+            escaped = re.escape(margin)
+            pattern = re.compile(
+                r"\n(?:(?!%s)(?!\n|\Z)|%s[^\S\n]*(?=\n|\Z))" % (escaped, escaped)
+            )
+        else:
+            pattern = re.compile(r"\n[^\S\n]+(?=\n|\Z)")
+        _margin_patterns[margin] = pattern
+    return pattern
 
 
-def validate_indent_str(indent):
+def has_line_breaks(text):
     """
-    indent: str
-    raises: InvalidIndentation if `indent` is nonempty and isn't either all tabs or all spaces
+    returns: whether `text` would be split into several lines by `textwrap.indent`
     """
-    if not (all(s == " " for s in indent) or all(s == "\t" for s in indent)):
-        raise InvalidIndentation("Indentation must be all spaces or all tabs")
+    return "\n" in text or _line_break_pattern.search(text) is not None
 
 
-def validate_indent(state, indent):
+def _ends_open_line(text):
     """
-    indent: str
-    precondition: `state.indent_str` is not None
-    raises: InvalidIndentation if `indent` is nonempty and isn't either all tabs or all spaces,
-        or if `indent` isn't a multiple of `state.indent_str`, or if `indent` doesn't
-        use the same indentation character as indent_str
+    returns: whether `text` isn't just empty lines but ends in one, which whatever is
+        written next will continue without its indentation having been checked
     """
-    validate_indent_str(indent)
-    if not len(indent) % len(state.indent_str) == 0:
-        raise InvalidIndentation(
-            "Indentation must be in multiples of the base indentation {}".format(
-                repr(state.indent_str)
-            )
-        )
+    text = text.rstrip(" \t")
+    return text[-1:] == "\n" and not text.isspace()
 
 
-def level_of_indent(state, indent):
+def write_block_text(state, out, text):
     """
-    indent: str
-    precondition: `state.indent_str` is not None
-
-    returns: the whole number of non-overlapping `state.indent_str` in `indent`
-        (i.e. the indentation level where `state.indent_str` is the base unit of indentation)
+    precondition: `text` is part of the body of the environment being emitted (the
+        innermost one, if `state.depth` is positive), and `state.margin` is the
+        indentation of that body's lines, or None for one-liners
+    postcondition: `text` is written to `out` as it will appear in the translation, with
+        lines of only spaces and tabs emptied (as dedenting the body would), and
+        `state.irregular` is incremented if the body can no longer be translated as it
+        stands (see `emit_environment`)
     """
-    return len(indent) // len(state.indent_str)
+    if state.depth and text != "\n":
+        newline = text.find("\n")
+        if newline != -1:
+            text = text[:newline] + _space_lines_pattern.sub("", text[newline:])
+            if (
+                state.margin is None
+                or _margin_pattern(state.margin).search(text, newline)
+                or _ends_open_line(text)
+            ):
+                state.irregular += 1
+        if state.margin and _line_break_pattern.search(text):
+            state.irregular += 1
+    out.write(text)
 
 
-def get_indent(state):
+def parse_empty(state):
     """
-    precondition: `self.pos` is at the start of a line
-    postcondition: `self.pos` is where it started
-    returns: the indentation string of the current line
+    precondition: `state.pos` is at the start of a line
+    postcondition: `state.pos` is at the start of the next non-whitespace line (i.e.
+        after the preceeding newline), or at `len(state.text)` if there isn't a
+        next non-whitespace line
     """
     start = state.pos
-    indent = parse_while(state, pred=iswhitespace)
-    state.pos = start
-    return indent
+    parse_whitespace(state)
+    if state.finished():
+        return state.text[start:]
+    if state.text[state.pos] != "\n":
+        state.pos = start
+        return ""
+    # the rest of this line is empty, so skip straight to the next non-empty line
+    lines = state.lines
+    line = lines.next_nonblank(state.get_line() + 1)
+    state.pos = lines.starts[line] if line < len(lines) else len(state.text)
+    return state.text[start : state.pos]
 
 
 def line_is_empty(state):
@@ -104,11 +216,9 @@ def line_is_empty(state):
     precondition: `self.pos` is at the start of a line
     postcondition: `self.pos` is where it started
     """
-    start = state.pos
-    parse_while(state, pred=iswhitespace)
-    res = state.finished() or state.text[state.pos] == "\n"
-    state.pos = start
-    return res
+    if state.finished():
+        return True
+    return bool(state.lines.blank[state.get_line()])
 
 
 def calc_indent_level(state):
@@ -119,12 +229,25 @@ def calc_indent_level(state):
         both tabs and spaces)
     returns: the indentation level of the current line, in terms of `self.indent_str` units
     """
-    assert not line_is_empty(state)
-    indent = get_indent(state)
-    if indent == "":
+    lines = state.lines
+    line = state.get_line()
+    assert state.pos == lines.starts[line] and not lines.blank[line]
+    width = lines.widths[line]
+    if width == 0:
         return 0
+    if lines.kinds[line] == MIXED:
+        raise InvalidIndentation(
+            "Indentation must be all spaces or all tabs", line=line, col=0
+        )
     if state.indent_str is None:
-        validate_indent_str(indent)
-        state.indent_str = indent
-    validate_indent(state, indent)
-    return level_of_indent(state, indent)
+        state.indent_str = state.text[state.pos : state.pos + width]
+        state.indent_pos = state.pos
+    if width % len(state.indent_str) != 0:
+        raise InvalidIndentation(
+            "Indentation must be in multiples of the base indentation {}".format(
+                repr(state.indent_str)
+            ),
+            line=line,
+            col=0,
+        )
+    return width // len(state.indent_str)
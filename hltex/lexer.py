@@ -0,0 +1,131 @@
+import re
+from array import array
+from bisect import bisect_left
+from itertools import chain, compress
+
+TEXT = 0
+CONTROL = 1
+OPEN_BRACE = 2
+CLOSE_BRACE = 3
+OPEN_BRACKET = 4
+CLOSE_BRACKET = 5
+COMMENT = 6
+NEWLINE = 7
+COLON = 8
+DELIMITER = 9
+# returned by `Tokens.kind_at` past the end of the text
+END = -1
+
+_token_pattern = re.compile(r"\\[A-Za-z]*|[{}\[\]%\n:]")
+_delimiter_pattern = re.compile(r"^={3,}", re.MULTILINE)
+_kinds = {
+    "\\": CONTROL,
+    "{": OPEN_BRACE,
+    "}": CLOSE_BRACE,
+    "[": OPEN_BRACKET,
+    "]": CLOSE_BRACKET,
+    "%": COMMENT,
+    "\n": NEWLINE,
+    ":": COLON,
+    "": END,
+}
+
+
+class Tokens:
+    """
+    A source text split into tokens in a single pass, stored in parallel arrays indexed
+    by token number:
+    kinds: CONTROL (a backslash and any ASCII letters after it), OPEN_BRACE,
+        CLOSE_BRACE, OPEN_BRACKET, CLOSE_BRACKET, COMMENT (a percent sign), NEWLINE,
+        COLON or DELIMITER (at least three equals signs starting a line)
+    starts: the offset of the first character of the token
+    ends: the offset of the first character after the token
+    Whatever is between two tokens is a TEXT token; those aren't stored, since they're
+    just the gaps (`__iter__` includes them).
+
+    Every character that means something to the translator starts a token, and only
+    the first character of a token ever does, so whatever a character means where the
+    translator finds it (e.g. a percent sign is plain text in raw blocks), the tokens
+    after it are still the right ones.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        spans = array(
+            "q", chain.from_iterable(map(re.Match.span, _token_pattern.finditer(text)))
+        )
+        self.starts = spans[0::2]
+        self.ends = spans[1::2]
+        self.kinds = array(
+            "b", map(_kinds.__getitem__, map(text.__getitem__, self.starts))
+        )
+        self.delimiters = set()
+        for match in _delimiter_pattern.finditer(text):
+            # delimiters are the only tokens that don't start with a character that
+            # means something everywhere, so they're found separately
+            i = bisect_left(self.starts, match.start())
+            self.starts.insert(i, match.start())
+            self.ends.insert(i, match.end())
+            self.kinds.insert(i, DELIMITER)
+            self.delimiters.add(match.start())
+        self._stops = {}
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self):
+        """
+        yields: (kind, start, end) for every token in order, including TEXT tokens
+        """
+        pos = 0
+        for kind, start, end in zip(self.kinds, self.starts, self.ends):
+            if pos < start:
+                yield TEXT, pos, start
+            yield kind, start, end
+            pos = end
+        if pos < len(self.text):
+            yield TEXT, pos, len(self.text)
+
+    def kind_at(self, pos):
+        """
+        returns: the kind of the token starting at `pos`, TEXT if `pos` is in the middle
+            of a token, or END if `pos` is past the end of the text
+        """
+        # the kind of a token only depends on its first character (or for delimiters,
+        # where it is), and the rest of a token is always text, so there's no need to
+        # look the token up
+        kind = _kinds.get(self.text[pos : pos + 1], TEXT)
+        if kind == TEXT and pos in self.delimiters:
+            return DELIMITER
+        return kind
+
+    def end_at(self, pos):
+        """
+        precondition: a token other than a TEXT token starts at `pos`
+        returns: the offset of the end of the token starting at `pos`
+        """
+        i = bisect_left(self.starts, pos)
+        assert self.starts[i] == pos
+        return self.ends[i]
+
+    def find(self, pos, stops):
+        """
+        stops: frozenset of token kinds other than TEXT
+        returns: the offset and kind of the first token starting at or after `pos` whose
+            kind is in `stops`, or `len(self.text)` and END if there isn't one
+        """
+        found = self._stops.get(stops)
+        if found is None:
+            # where each set of stops is, computed the first time it's needed
+            # (ending with the end of the text, so that there always is one)
+            selected = list(map(stops.__contains__, self.kinds))
+            found = (
+                array("q", compress(self.starts, selected)),
+                array("b", compress(self.kinds, selected)),
+            )
+            found[0].append(len(self.text))
+            found[1].append(END)
+            self._stops[stops] = found
+        starts, kinds = found
+        i = bisect_left(starts, pos)
+        return starts[i], kinds[i]
@@ -0,0 +1,164 @@
+class Node:
+    """
+    A piece of a parsed document, spanning `state.text[start:end]`
+
+    Nodes don't copy any of the source: text is only taken from the source (by
+    offset) when the tree is emitted (see `hltex.emitter`).
+    """
+
+    __slots__ = ("start", "end")
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+
+    def __repr__(self):
+        return "{}({}, {})".format(type(self).__name__, self.start, self.end)
+
+
+class Text(Node):
+    """
+    Source text that is translated as it stands
+    """
+
+    __slots__ = ()
+
+
+class Comment(Node):
+    """
+    A percent sign and the rest of its line
+    """
+
+    __slots__ = ()
+
+
+class Raw(Node):
+    """
+    The body of a raw argument or a raw environment, which isn't parsed
+    """
+
+    __slots__ = ()
+
+
+class Newline(Node):
+    """
+    A newline continuing a block, along with any empty lines after it (but not the
+    indentation of the next non-empty line, which is the start of the next node)
+    """
+
+    __slots__ = ()
+
+
+class Group(Node):
+    """
+    A group in braces or brackets, spanning the braces or brackets themselves
+    children: the nodes inside the braces or brackets
+    """
+
+    __slots__ = ("children",)
+
+    def __init__(self, start, end, children):
+        super().__init__(start, end)
+        self.children = children
+
+
+class Command(Node):
+    """
+    A use of a custom command
+    command: the `hltex.control.Command` used
+    args: for each of the command's parameters, None for a missing optional argument,
+        a Group for an argument in brackets or braces, or Raw for a raw argument
+    """
+
+    __slots__ = ("command", "args")
+
+    def __init__(self, start, end, command, args):
+        super().__init__(start, end)
+        self.command = command
+        self.args = args
+
+
+class Control(Node):
+    """
+    A native control sequence (i.e. one translated as it stands) that isn't an
+    environment
+    name: the name of the control sequence, without its backslash
+    argstr: the nodes of its argstr (Text for whitespace and Group for arguments)
+    """
+
+    __slots__ = ("name", "argstr")
+
+    def __init__(self, start, end, name, argstr):
+        super().__init__(start, end)
+        self.name = name
+        self.argstr = argstr
+
+
+class Body(Node):
+    """
+    The body of an environment, after its colon
+    level: the indentation level of the body, or None for one-liners
+    comment: the Comment after the colon of an indented body, or None
+    children: the nodes of the body (for indented bodies, starting with the Newline
+        after the colon, or after `comment`)
+    """
+
+    __slots__ = ("level", "comment", "children")
+
+    def __init__(self, start, end, level, comment, children):
+        super().__init__(start, end)
+        self.level = level
+        self.comment = comment
+        self.children = children
+
+
+class Environment(Node):
+    """
+    A native environment, translated to `\\begin` and `\\end`
+    name: the name of the environment
+    argstr: as for Control
+    level: the indentation level of the line the environment is on
+    body: a Body
+    """
+
+    __slots__ = ("name", "argstr", "level", "body")
+
+    def __init__(self, start, end, name, argstr, level, body):
+        super().__init__(start, end)
+        self.name = name
+        self.argstr = argstr
+        self.level = level
+        self.body = body
+
+
+class CustomEnvironment(Node):
+    """
+    A use of a custom environment
+    environment: the `hltex.control.Environment` used
+    args: as for Command
+    level: the indentation level of the line the environment is on
+    body: a Body, or Raw for raw environments
+    """
+
+    __slots__ = ("environment", "args", "level", "body")
+
+    def __init__(self, start, end, environment, args, level, body):
+        super().__init__(start, end)
+        self.environment = environment
+        self.args = args
+        self.level = level
+        self.body = body
+
+
+class Document(Node):
+    """
+    The document after the preamble, from its `===` delimiter to the end of the file
+    children: the nodes of the document's body, starting with the Newline after the
+        delimiter
+    """
+
+    __slots__ = ("children",)
+
+    def __init__(self, start, end, children):
+        super().__init__(start, end)
+        self.children = children
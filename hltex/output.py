@@ -0,0 +1,51 @@
+class Output(list):
+    """
+    The translation being built up, as a list of string fragments that is only joined
+    once at the end (so that building it up stays linear in its length)
+    """
+
+    write = list.append
+
+    def mark(self):
+        """
+        returns: a marker for the current end of the output, for `truncate`
+        """
+        return len(self)
+
+    def truncate(self, mark):
+        """
+        postcondition: everything written since `mark` was taken is discarded
+        """
+        del self[mark:]
+
+    def endswith(self, char, mark=0):
+        """
+        char: a single character
+        returns: whether the text written since `mark` ends with `char`
+        """
+        for i in range(len(self) - 1, mark - 1, -1):
+            if self[i]:
+                return self[i][-1] == char
+        return False
+
+    def getvalue(self):
+        return "".join(self)
+
+    def writeto(self, f):
+        """
+        postcondition: the output is written to the text file `f` without first being
+            joined into a single string
+        """
+        f.writelines(self)
+
+
+def collect(context, state, **kwargs):
+    """
+    context: a parse function that writes its translation to an `out` keyword argument
+    returns: what `context` wrote, as a string, or None if `context` returned False
+        (i.e. if it didn't find what it was looking for)
+    """
+    out = Output()
+    if context(state, out=out, **kwargs) is False:
+        return None
+    return out.getvalue()
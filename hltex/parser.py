@@ -0,0 +1,623 @@
+from .context import (
+    increment,
+    next_token,
+    parse_letters,
+    parse_token,
+    parse_whitespace,
+)
+from .errors import (
+    InternalError,
+    InvalidSyntax,
+    MissingArgument,
+    UnexpectedEOF,
+    UnexpectedIndentation,
+)
+from .indentation import calc_indent_level, line_is_empty, parse_empty
+from .lexer import (
+    CLOSE_BRACE,
+    CLOSE_BRACKET,
+    COLON,
+    COMMENT,
+    CONTROL,
+    DELIMITER,
+    END,
+    NEWLINE,
+    OPEN_BRACE,
+    OPEN_BRACKET,
+)
+from .nodes import (
+    Body,
+    Command,
+    Comment,
+    Control,
+    CustomEnvironment,
+    Document,
+    Environment,
+    Group,
+    Newline,
+    Raw,
+    Text,
+)
+
+_closing_kinds = {"}": CLOSE_BRACE, "]": CLOSE_BRACKET}
+_group_stops = {
+    end: frozenset({OPEN_BRACE, CLOSE_BRACE, CONTROL, COMMENT, kind})
+    for end, kind in _closing_kinds.items()
+}
+_argstr_stops = frozenset(
+    {NEWLINE, OPEN_BRACE, CLOSE_BRACE, CONTROL, OPEN_BRACKET, CLOSE_BRACKET, COMMENT}
+)
+_block_stops = frozenset({CONTROL, NEWLINE, OPEN_BRACE, CLOSE_BRACE, COMMENT})
+_line_stops = frozenset({NEWLINE})
+_raw_arg_stops = frozenset({CLOSE_BRACE})
+
+
+def parse_text(state, stops, nodes):
+    """
+    stops: frozenset of token kinds (see `hltex.lexer`) to stop at
+    postcondition: `state.pos` is at the start of the first token after the original
+        `state.pos` whose kind is in `stops`, or `len(state.text)` if there is no such
+        token, and a Text node for what was skipped over (if anything) is appended to
+        `nodes`
+    returns: the kind of the token stopped at, or END if there is no such token
+    """
+    start = state.pos
+    state.pos, kind = state.tokens.find(start, stops)
+    if state.pos > start:
+        nodes.append(Text(start, state.pos))
+    return kind
+
+
+def parse_control_name(state):
+    """
+    precondition: `state.pos` is at the first character following a backslash
+    postcondition: `state.pos` is at the first character following the name of the
+        control sequence
+    raises: UnexpectedEOF if there is no character following the name of the control
+        sequence
+    """
+    assert state.text[state.pos - 1] == "\\"
+    if state.finished():
+        raise UnexpectedEOF(
+            "Unescaped backslashes must be followed by at least one character"
+        )
+    name = parse_letters(state)
+    if not name:
+        name = increment(state)
+    assert (
+        state.finished()
+        or not str.isalpha(state.text[state.pos])
+        or not str.isalpha(state.text[state.pos - 1])
+    )
+    return name
+
+
+def parse_arg_control(state):
+    """
+    precondition: `state.pos` is at the first character following a backslash
+    postcondition: `state.pos` is either at the first character following the
+    command name (for native commands) or at the first character following the last
+    argument (for custom commands)
+    returns: a Command for custom commands, or else a Text for the backslash and name
+    """
+    assert state.text[state.pos - 1] == "\\"
+    start = state.pos - 1
+    name = parse_control_name(state)
+    if name in state.commands:
+        return parse_custom_command(state, command=state.commands[name], start=start)
+    return Text(start, state.pos)
+
+
+def parse_comment(state):
+    """
+    precondition: `state.pos` is after a percent sign
+    postcondition: `state.pos` is at the newline following the percent sign (or at the
+        EOF if there is no following newline)
+    returns: a Comment
+    """
+    assert state.text[state.pos - 1] == "%"
+    start = state.pos - 1
+    state.pos, _ = state.tokens.find(state.pos, _line_stops)
+    assert state.finished() or state.text[state.pos] == "\n"
+    return Comment(start, state.pos)
+
+
+def parse_group(state, end):
+    """
+    precondition: `state.pos` is somewhere inside a group (typically would be called
+        from the first character following the opening brace or bracket)
+    postcondition: `state.pos` is at the first character following the closing brace or
+        bracket
+    returns: the nodes of the rest of the group, up to the closing brace or bracket
+    """
+    nodes = []
+    stops = _group_stops[end]
+    closing = _closing_kinds[end]
+    while True:
+        kind = parse_text(state, stops, nodes)
+        if kind == END:
+            raise UnexpectedEOF("Missing closing `{}`".format(end))
+        if kind == closing:
+            increment(state)
+            assert state.text[state.pos - 1] == end
+            return nodes
+        if kind == CLOSE_BRACE:
+            raise InvalidSyntax("Unexpected `}`")
+        if kind == OPEN_BRACE:
+            nodes.append(parse_enclosed_group(state, end="}"))
+        elif kind == CONTROL:
+            increment(state)
+            nodes.append(parse_arg_control(state))
+        elif kind == COMMENT:
+            increment(state)
+            nodes.append(parse_comment(state))
+        else:
+            raise InternalError()
+
+
+def parse_enclosed_group(state, end):
+    """
+    precondition: `state.pos` is at the opening brace or bracket of a group
+    postcondition: `state.pos` is at the first character following the closing brace or
+        bracket
+    returns: a Group
+    """
+    start = state.pos
+    increment(state)
+    nodes = parse_group(state, end=end)
+    return Group(start, state.pos, nodes)
+
+
+def parse_optional_arg(state):
+    """
+    precondition: `state.pos` is at the first character following the previous argument
+    postcondition: `state.pos` is either at the first character following the closing
+        bracket, or where it started if no closing bracket was found
+    returns: a Group, or None if there is no optional argument
+    """
+    start = state.pos
+    parse_whitespace(state)
+    if next_token(state) != OPEN_BRACKET:
+        state.pos = start
+        return None
+    res = parse_enclosed_group(state, end="]")
+    assert state.text[state.pos - 1] == "]"
+    return res
+
+
+def parse_required_arg(state, name, raw=False):
+    """
+    precondition: `state.pos` is at the first character following the previous argument
+    postcondition: `state.pos` is at the first character following the closing brace
+    returns: a Group, or a Raw (of what's between the braces) if `raw`
+    """
+    parse_whitespace(state)
+    if state.finished():
+        raise UnexpectedEOF("Missing required argument for `{}`".format(name))
+    if next_token(state) != OPEN_BRACE:
+        raise MissingArgument("Missing required argument for `{}`".format(name))
+    if raw:
+        increment(state)
+        start = state.pos
+        state.pos, _ = state.tokens.find(start, _raw_arg_stops)
+        if state.finished():
+            raise UnexpectedEOF("Missing closing `}}` for `{}`".format(name))
+        increment(state)
+        assert state.text[state.pos - 1] == "}"
+        return Raw(start, state.pos - 1)
+    res = parse_enclosed_group(state, end="}")
+    assert state.text[state.pos - 1] == "}"
+    return res
+
+
+def parse_args(state, name, params):
+    """
+    precondition: `state.pos` is at the first character following the name of a control
+        sequence
+    postcondition: `state.pos` is at the first character following the last argument's
+        closing bracket or brace
+    returns: the arguments, as for `Command.args`
+    """
+    args = []
+    for param in params:
+        if param == "?":
+            arg = parse_optional_arg(state)
+        elif param == "!":
+            arg = parse_required_arg(state, name=name)
+        elif param == "x":
+            arg = parse_required_arg(state, name=name, raw=True)
+        else:
+            raise InternalError()
+        args.append(arg)
+    assert all(p == "?" for p in params) or state.text[state.pos - 1] in "]}"
+    return args
+
+
+def parse_optional_argstr(state):
+    """
+    precondition: `state.pos` is somewhere an optional argstr (typically would be called
+        from the first character following the opening bracket)
+    postcondition: `state.pos` is at the first character following the closing bracket,
+        or where it started if the line ends before it finds it
+    returns: the nodes of the rest of the argstr, up to the closing bracket, or None if
+        the line ends before the closing bracket
+    """
+    start = state.pos
+    nodes = []
+    # Where the argstr goes from each position reached below only depends on that
+    # position, so if the line ends first, it'll end first from any of them too;
+    # remembering them keeps unclosed brackets from being rescanned to the end of the
+    # line by every control sequence before them
+    reached = []
+    while True:
+        if state.pos in state.unclosed_argstrs:
+            break
+        reached.append(state.pos)
+        kind = parse_text(state, _argstr_stops, nodes)
+        if kind in (END, NEWLINE, COMMENT):
+            break
+        if kind == CLOSE_BRACKET:
+            increment(state)
+            return nodes
+        if kind == CLOSE_BRACE:
+            raise InvalidSyntax("Unexpected `}`")
+        if kind == OPEN_BRACE:
+            nodes.append(parse_enclosed_group(state, end="}"))
+        elif kind == OPEN_BRACKET:
+            nodes.append(parse_enclosed_group(state, end="]"))
+        elif kind == CONTROL:
+            increment(state)
+            nodes.append(parse_arg_control(state))
+        else:
+            raise InternalError()
+    state.unclosed_argstrs.update(reached)
+    state.pos = start
+    return None
+
+
+def parse_argstr(state):
+    """
+    precondition: `state.pos` is at the first character following the name of a control
+        sequence
+    postcondition: `state.pos` is at the first character following the last argument's
+        closing bracket or brace
+    returns: the nodes of the argstr (a Text for any whitespace before each argument,
+        and a Group for the argument)
+    """
+    nodes = []
+    while True:
+        start = state.pos
+        parse_whitespace(state)
+        kind = next_token(state)
+        if kind not in (OPEN_BRACE, OPEN_BRACKET):
+            state.pos = start
+            return nodes
+        if kind == OPEN_BRACE:
+            group = parse_enclosed_group(state, end="}")
+            assert state.text[state.pos - 1] == "}"
+        else:
+            bracket = state.pos
+            increment(state)
+            group = parse_optional_argstr(state)
+            if group is None:
+                state.pos = start
+                return nodes
+            group = Group(bracket, state.pos, group)
+            assert state.text[state.pos - 1] == "]"
+        if group.start > start:
+            nodes.append(Text(start, group.start))
+        nodes.append(group)
+
+
+def parse_custom_command(state, command, start):
+    """
+    precondition: `state.pos` is at the first character following the name of a custom
+        command, whose backslash is at `start`
+    postcondition: `state.pos` is at the first character following the last argument's
+        closing bracket or brace
+    returns: a Command
+    """
+    args = parse_args(state, name=command.name, params=command.params)
+    node = Command(start, state.pos, command, args)
+    if state.on_custom is not None:
+        state.on_custom(node)
+    return node
+
+
+def parse_native_control(state, name, outer_indent_level, start):
+    """
+    precondition: `state.pos` is at the first character following the name of a
+        native control sequence, whose backslash is at `start`
+    postcondition: `state.pos` is at the first character following either the last
+        argument's closing bracket or brace for commands, or at the start of the next
+        non-empty block after the indented block
+    returns: an Environment if the control sequence is followed by a colon, or else a
+        Control
+    """
+    argstr = parse_argstr(state)
+    end = state.pos
+    parse_whitespace(state)
+    if next_token(state) != COLON:
+        state.pos = end
+        return Control(start, end, name, argstr)
+    increment(state)
+    body = parse_environment_body(state, outer_indent_level=outer_indent_level)
+    return Environment(start, state.pos, name, argstr, outer_indent_level, body)
+
+
+def parse_custom_environment(state, environment, outer_indent_level, start):
+    """
+    precondition: `state.pos` is at the first character following the name of a custom
+        environment, whose backslash is at `start`
+    postcondition: `state.pos` is at the start of the next non-empty line following the
+        indented block
+    returns: a CustomEnvironment
+    """
+    args = parse_args(state, name=environment.name, params=environment.params)
+    parse_whitespace(state)
+    if state.finished():
+        raise UnexpectedEOF("Environments must be followed by colons")
+    if next_token(state) != COLON:
+        raise InvalidSyntax("Environments must be followed by colons")
+    increment(state)
+    if environment.raw:
+        body = parse_raw_environment_body(state, outer_indent_level)
+    else:
+        body = parse_environment_body(state, outer_indent_level)
+    node = CustomEnvironment(
+        start, state.pos, environment, args, outer_indent_level, body
+    )
+    if state.on_custom is not None:
+        state.on_custom(node)
+    return node
+
+
+def parse_oneliner(state, outer_indent_level, nodes):
+    """
+    precondition: `state.pos` is somewhere inside a one-liner (typically would be
+        called from the first character after the colon)
+    postcondition: `state.pos` is at the end of the line, or at `len(state.text)`, and
+        the nodes of the one-liner are appended to `nodes`
+    """
+    while True:
+        kind = parse_text(state, _block_stops, nodes)
+        if kind in (END, NEWLINE):
+            return
+        if kind == CONTROL:
+            parse_block_control(state, outer_indent_level, nodes)
+        elif kind == OPEN_BRACE:
+            nodes.append(parse_enclosed_group(state, end="}"))
+        elif kind == COMMENT:
+            increment(state)
+            nodes.append(parse_comment(state))
+            return
+        elif kind == CLOSE_BRACE:
+            raise InvalidSyntax("Unexpected `}`")
+        else:
+            raise InternalError()
+
+
+def parse_raw_block(state, outer_indent_level):
+    """
+    precondition: `state.pos` is somewhere inside a raw block
+    postcondition: `state.pos` is at the newline after the raw block (or at
+        `len(state.text)`); if there are empty lines after the block, `state.pos` is
+        before them
+    """
+    while True:
+        state.pos, _ = state.tokens.find(state.pos, _line_stops)
+        if state.finished():
+            return
+        start = state.pos
+        increment(state)
+        parse_empty(state)
+        if state.finished():
+            state.pos = start
+            return
+        indent_level = calc_indent_level(state)
+        if indent_level < outer_indent_level:
+            state.pos = start
+            return
+
+
+def parse_raw_environment_body(state, outer_indent_level):
+    """
+    precondition: `state.pos` is at the first character following the colon
+    returns: a Raw
+    """
+    assert state.text[state.pos - 1] == ":"
+    parse_whitespace(state)
+    if state.finished():
+        raise UnexpectedEOF("Environment missing body")
+    start = state.pos
+    if next_token(state) != NEWLINE:
+        state.pos, _ = state.tokens.find(start, _line_stops)
+        return Raw(start, state.pos)
+    parse_empty(state)
+    if line_is_empty(state):
+        raise UnexpectedEOF("Environment missing body")
+    indent_level = calc_indent_level(state)
+    if indent_level != outer_indent_level + 1:
+        raise InvalidSyntax("Missing indentation after environment")
+    parse_raw_block(state, indent_level)
+    return Raw(start, state.pos)
+
+
+def parse_environment_body(state, outer_indent_level):
+    """
+    precondition: `state.pos` is at the first character following the colon
+    postcondition: `state.pos` is at the next non-empty line following the indented
+        block, or at the end of the line for one-liners
+    returns: a Body
+    """
+    assert state.text[state.pos - 1] == ":"
+    parse_whitespace(state)
+    if state.finished():
+        raise UnexpectedEOF("Environment missing body")
+    start = state.pos
+    nodes = []
+    kind = next_token(state)
+    if kind not in (NEWLINE, COMMENT):
+        parse_oneliner(state, outer_indent_level, nodes)
+        return Body(start, state.pos, None, None, nodes)
+    comment = None
+    if kind == COMMENT:
+        increment(state)
+        comment = parse_comment(state)
+    newline = state.pos
+    parse_empty(state)
+    if line_is_empty(state):
+        raise UnexpectedEOF("Environment missing body")
+    indent_level = calc_indent_level(state)
+    if indent_level != outer_indent_level + 1:
+        raise InvalidSyntax("Missing indentation after environment")
+    nodes.append(Newline(newline, state.pos))
+    parse_block(state, nodes)
+    return Body(start, state.pos, indent_level, comment, nodes)
+
+
+def parse_document(state):
+    """
+    precondition: `state.pos` is at the first =
+    postcondition: `state.pos` is at the end of the file
+    returns: a Document
+    """
+    start = state.pos
+    parse_token(state)
+    if state.finished():
+        raise UnexpectedEOF("Missing document body")
+    if next_token(state) != NEWLINE:
+        raise InvalidSyntax("Missing newline after document delineator")
+    newline = state.pos
+    increment(state)
+    parse_empty(state)
+    nodes = [Newline(newline, state.pos)]
+    if not line_is_empty(state):
+        if calc_indent_level(state) != 0:
+            raise UnexpectedIndentation("The document as a whole must not be indented")
+        parse_block(state, nodes)
+    return Document(start, state.pos, nodes)
+
+
+def parse_block_newline(state, outer_indent_level, nodes, preamble=False):
+    """
+    precondition: `state.pos` is at a newline in a block
+    postcondition: `state.pos` is at the start of the next non-empty line of the block
+        (or at `len(state.text)` after a document), or where it started if the block
+        ends at this newline
+    returns: False (having appended nothing to `nodes`) if the block ends at this
+        newline
+    """
+    assert state.text[state.pos] == "\n"
+    start = state.pos
+    increment(state)
+    parse_empty(state)
+    if preamble and next_token(state) == DELIMITER:
+        nodes.append(Newline(start, state.pos))
+        nodes.append(parse_document(state))
+        return True
+    if state.finished():
+        state.pos = start
+        return False
+    indent_level = calc_indent_level(state)
+    if indent_level < outer_indent_level:
+        state.pos = start
+        return False
+    if indent_level > outer_indent_level:
+        raise UnexpectedIndentation("Indentation should only follow environments")
+    nodes.append(Newline(start, state.pos))
+    return True
+
+
+def parse_block_control(state, outer_indent_level, nodes):
+    """
+    precondition: `state.pos` is at a backslash in a block
+    postcondition: `state.pos` is either at the first character following the last
+        argument's closing brace, or at the start of the next non-empty line for
+        indented environments, or at the start of the next line for one-liners
+    """
+    assert state.text[state.pos] == "\\"
+    start = state.pos
+    increment(state)
+    name = parse_control_name(state)
+    if name in state.commands:
+        # only translated for its side effects (see `emit_block`)
+        nodes.append(
+            parse_custom_command(state, command=state.commands[name], start=start)
+        )
+    if name in state.environments:
+        nodes.append(
+            parse_custom_environment(
+                state,
+                environment=state.environments[name],
+                outer_indent_level=outer_indent_level,
+                start=start,
+            )
+        )
+    else:
+        nodes.append(
+            parse_native_control(
+                state, name=name, outer_indent_level=outer_indent_level, start=start
+            )
+        )
+
+
+def parse_block_body(state, outer_indent_level, nodes, preamble=False):
+    """
+    precondition: `state.pos` is somewhere inside a block
+    postcondition: `state.pos` is at the start of the next non-empty line after the
+        indented block, or at `len(state.text)` if there is no next non-empty line
+    """
+    while True:
+        kind = parse_text(state, _block_stops, nodes)
+        if kind == END:
+            return
+        if kind == NEWLINE:
+            if not parse_block_newline(
+                state, outer_indent_level, nodes, preamble=preamble
+            ):
+                return
+        elif kind == CONTROL:
+            parse_block_control(state, outer_indent_level, nodes)
+        elif kind == OPEN_BRACE:
+            nodes.append(parse_enclosed_group(state, end="}"))
+        elif kind == COMMENT:
+            increment(state)
+            nodes.append(parse_comment(state))
+        elif kind == CLOSE_BRACE:
+            raise InvalidSyntax("Unexpected `}`")
+        else:
+            raise InternalError()
+
+
+def parse_block(state, nodes, preamble=False):
+    """
+    precondition: `state.pos` is at the start of a line in the block (typically
+        `parse_block` should be called from the line after a colon)
+    postcondition: `state.pos` is at the newline after the block; if there are empty
+        lines after the block, `state.pos` is before them; the nodes of the block are
+        appended to `nodes`
+    """
+    start = state.pos
+    parse_empty(state)
+    if state.pos > start:
+        nodes.append(Text(start, state.pos))
+    if line_is_empty(state):
+        return
+    if preamble and next_token(state) == DELIMITER:
+        nodes.append(parse_document(state))
+        return
+    outer_indent_level = calc_indent_level(state)
+    parse_block_body(state, outer_indent_level, nodes, preamble=preamble)
+
+
+def parse(state):
+    """
+    precondition: `state.pos` is at the start of the source
+    postcondition: `state.pos` is at the newline after the source's last non-empty line
+        (or at `len(state.text)`)
+    returns: the nodes of the whole source, preamble and document
+    """
+    nodes = []
+    parse_block(state, nodes, preamble=True)
+    return nodes
@@ -1,5 +1,10 @@
+import atexit
+import hashlib
 import json
 import os
+import re
+import threading
+import time
 from textwrap import dedent
 
 from .errors import DependencyError
@@ -7,49 +12,164 @@ from .errors import DependencyError
 default_docker = "czentye/matplotlib-minimal"
 
 
-class Pybox:
-    def __init__(self, file_env=None, docker=None, cputime=10, memory=64):
-        if file_env is None:
-            file_env = {}
-        if docker is None:
-            docker = default_docker
-        self.docker = docker
-        files = [
-            {
-                "name": "main.py",
-                "content": dedent(
-                    """
-            import json as __json
-            import io as __io
-            from textwrap import indent as __indent
-            from contextlib import redirect_stdout as __redirect_stdout
-
-
-            if __name__ == '__main__':
-                while True:
-                    __code = input()
-                    __request = eval(__code)
-                    if __request is None:
-                        break
-                    __string = None
-                    try:
-                        __string = __io.StringIO()
-                        with __redirect_stdout(__string):
-                            exec(__request)
-                        __res = {'output': __string.getvalue(), 'error': None}
-                    except Exception as e:
-                        __res = {'output': __string.getvalue(), 'error': type(e).__name__ + ': ' + str(e)}
-                    print(__json.dumps(__res))
-            """
-                ).encode("utf-8"),
-            }
-        ]
+# Requests to the driver and its answers are frames of JSON, each made of the length of
+# its payload in bytes, a colon and the payload (which has no newlines). A request is a
+# frame followed by a newline: {"blocks": [...]} to run blocks, or {"exit": true}. Its
+# answer is, for each block run, any number of {"output": ...} frames with what the
+# block printed, in chunks of at most `_chunk_size` characters (so that what a block
+# prints is never held as a whole in the sandbox), then an {"error": ...} frame with
+# the error it raised, or null; up to the first block that raised one, followed by a
+# newline.
+_chunk_size = 1024 * 1024
 
-        for name, content in file_env.items():
-            files.append({"name": name, "content": content.encode("utf-8")})
+# the script the sandbox runs, which runs the Python blocks it's sent
+_driver = dedent(
+    """
+    import io as __io
+    import json as __json
+    import sys as __sys
+    from contextlib import redirect_stdout as __redirect_stdout
 
-        limits = {"cputime": cputime, "memory": memory}
+    __stdin = __sys.stdin.buffer
+    __stdout = __sys.stdout.buffer
+
+
+    def __read_frame():
+        __header = b''
+        while True:
+            __byte = __stdin.read(1)
+            if not __byte:
+                return None
+            if __byte == b':':
+                break
+            __header += __byte
+        __frame = __json.loads(__stdin.read(int(__header)).decode('utf-8'))
+        __stdin.read(1)  # the newline after the request
+        return __frame
+
+
+    def __write_frame(__frame):
+        __payload = __json.dumps(__frame).encode('utf-8')
+        __stdout.write(b'%%d:' %% len(__payload) + __payload)
+
+
+    class __Output(__io.TextIOBase):
+        # what a block prints, sent in chunks as it's printed
+
+        def __init__(self, send, chunk_size):
+            self.send = send
+            self.chunk_size = chunk_size
+            self.parts = []
+            self.size = 0
 
+        def write(self, text):
+            self.parts.append(text)
+            self.size += len(text)
+            if self.size >= self.chunk_size:
+                self.send_parts()
+            return len(text)
+
+        def send_parts(self):
+            text = ''.join(self.parts)
+            for start in range(0, len(text), self.chunk_size):
+                self.send({'output': text[start:start + self.chunk_size]})
+            self.parts = []
+            self.size = 0
+
+
+    if __name__ == '__main__':
+        while True:
+            __request = __read_frame()
+            if __request is None or __request.get('exit'):
+                break
+            for __block in __request['blocks']:
+                __output = __Output(__write_frame, %d)
+                __error = None
+                try:
+                    with __redirect_stdout(__output):
+                        exec(__block, globals())
+                except Exception as e:
+                    __error = type(e).__name__ + ': ' + str(e)
+                __output.send_parts()
+                __write_frame({'error': __error})
+                if __error is not None:
+                    break
+            __stdout.write(b'\\n')
+            __stdout.flush()
+    """
+    % _chunk_size
+).encode("utf-8")
+
+
+def _frame(message):
+    """
+    returns: the frame of the JSON-serializable `message`, as bytes
+    """
+    payload = json.dumps(message).encode("utf-8")
+    return b"%d:" % len(payload) + payload
+
+
+def _read_frame(f):
+    """
+    returns: the message of the next frame read from the binary file `f`, or None if
+        `f` ends before a whole frame
+    """
+    header = b""
+    while True:
+        byte = f.read(1)
+        if not byte:
+            return None
+        if byte == b":":
+            break
+        header += byte
+    if not header.isdigit():
+        return None
+    payload = f.read(int(header))
+    if len(payload) != int(header):
+        return None
+    return json.loads(payload.decode("utf-8"))
+
+
+_exit_request = _frame({"exit": True}) + b"\n"
+
+# sets the rlimits of the local driver (where there are any) before running it
+_local_bootstrap = dedent(
+    """
+    import runpy, sys
+    try:
+        import resource
+    except ImportError:
+        pass
+    else:
+        cputime, memory = int(sys.argv[1]), int(sys.argv[2]) * 1024 * 1024
+        # SIGXCPU at the limit, and SIGKILL a second after, if that's ignored
+        resource.setrlimit(resource.RLIMIT_CPU, (cputime, cputime + 1))
+        # the memory it allocates, rather than its address space, of which libraries
+        # like numpy reserve far more than they use
+        limit = getattr(resource, 'RLIMIT_DATA', resource.RLIMIT_AS)
+        resource.setrlimit(limit, (memory, memory))
+    sys.argv = ['main.py']
+    runpy.run_path('main.py', run_name='__main__')
+    """
+)
+
+
+class HLBoxExecutor:
+    """
+    Runs the driver of a Pybox in a Docker container, with HLBox
+    """
+
+    # the megabytes of memory the driver gets, unless its Pybox is given a limit
+    memory = 64
+
+    def start(self, files, docker, limits):
+        """
+        files: the files to start with, as {"name": ..., "content": bytes}, including
+            the driver as `main.py`
+        limits: {"cputime": seconds, "memory": megabytes}
+        postcondition: the driver is running, with `files` in its working directory
+        raises: DependencyError if it can't be started
+        """
         try:
             import hlbox
 
@@ -67,20 +187,245 @@ class Pybox:
                 + str(e)
             )
 
-    def run(self, body):
+    def run(self, request):
+        """
+        request: a request to the driver, as bytes ending with its newline
+        returns: a binary file to read the driver's answer from, or None if it exited
+        """
+        import io
+
         import hlbox
 
-        result = hlbox.runline(self.sandbox, repr(body) + "\n")
+        # the frames have no newlines, so each request and its answer is a single line
+        result = hlbox.runline(self.sandbox, request.decode("utf-8"))
         if result["exit_code"] != 0:
-            raise DependencyError("Something went wrong executing this Python block")
+            self.exit_code = result["exit_code"]
+            return None
+        return io.BytesIO(result["stdout"])
 
-        output = json.loads(result["stdout"].decode("utf-8"))
-        if output["error"] is not None:
-            raise DependencyError("Python execution failed: {}".format(output["error"]))
-        return output["output"]
+    def failure(self):
+        """
+        returns: what's known of why the driver exited, after `run` found it had
+        """
+        return "The sandbox exited with status {}".format(
+            getattr(self, "exit_code", None)
+        )
 
-    def fetch_generated_files(self):
+    def fetch_generated_files(self, tmp_dir):
+        """
+        postcondition: the files in the driver's working directory are copied into
+            `tmp_dir`, after which the driver can't run anything more
+        """
         import hlbox
+
+        hlbox.runline(self.sandbox, _exit_request.decode("utf-8"))  # trigger tar
+        hlbox.download(self.sandbox, tmp_dir)
+
+    def close(self):
+        import hlbox
+
+        hlbox.destroy(self.sandbox)
+
+
+class LocalExecutor:
+    """
+    Runs the driver of a Pybox in a subprocess of this Python, in a temporary working
+    directory, with its CPU time and memory limited by rlimits (where there are any),
+    for machines without Docker
+
+    The blocks aren't otherwise kept from the rest of the machine, so this is only for
+    documents that are trusted.
+    """
+
+    # more than in a container, since the driver shares the libraries it loads with
+    # nothing else, and Python alone takes up some of it
+    memory = 512
+    # how much of the end of the driver's stderr is reported if it exits
+    stderr_tail = 2000
+
+    def start(self, files, docker, limits):  # pylint: disable=unused-argument
+        import subprocess
+        import sys
+        import tempfile
+
+        for file in files:
+            # the names come from the document's file_env (e.g. from `hltex serve`)
+            name = file["name"]
+            if os.path.isabs(name) or os.path.normpath(name).split(os.sep)[0] in (
+                os.pardir,
+                os.curdir,
+            ):
+                raise DependencyError(
+                    "Files for pysplice must be in its working directory, not at "
+                    + repr(name)
+                )
+        self.work_dir = tempfile.mkdtemp(prefix="hltex_local_")
+        self.stderr = tempfile.TemporaryFile()
+        try:
+            for file in files:
+                path = os.path.join(self.work_dir, file["name"])
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "wb") as f:
+                    f.write(file["content"])
+            self.process = subprocess.Popen(
+                [
+                    sys.executable,
+                    "-u",
+                    "-c",
+                    _local_bootstrap,
+                    str(limits["cputime"]),
+                    str(limits["memory"]),
+                ],
+                cwd=self.work_dir,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=self.stderr,
+            )
+        except OSError as e:
+            self._remove()
+            self.stderr.close()
+            raise DependencyError(
+                "Failed to start Python for pysplice.\n" + str(e)
+            ) from e
+
+    def _remove(self):
+        import shutil
+
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def run(self, request):
+        try:
+            self.process.stdin.write(request)
+            self.process.stdin.flush()
+        except OSError:
+            # once the driver's exited, e.g. past its CPU time
+            return None
+        # the answer is read a frame at a time, as the driver writes it
+        return self.process.stdout
+
+    def failure(self):
+        import signal
+        import subprocess
+
+        try:
+            status = self.process.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            status = None
+        if status is not None and status < 0:
+            try:
+                reason = "was killed by {}".format(signal.Signals(-status).name)
+            except ValueError:
+                reason = "was killed by signal {}".format(-status)
+        else:
+            reason = "exited with status {}".format(status)
+        size = self.stderr.seek(0, os.SEEK_END)
+        self.stderr.seek(max(size - self.stderr_tail, 0))
+        tail = self.stderr.read().decode("utf-8", "replace").strip()
+        return "Python {}{}".format(reason, ":\n" + tail if tail else "")
+
+    def fetch_generated_files(self, tmp_dir):
+        import shutil
+
+        for name in os.listdir(self.work_dir):
+            path = os.path.join(self.work_dir, name)
+            if os.path.isfile(path):
+                shutil.copy(path, tmp_dir)
+
+    def close(self):
+        self.process.kill()
+        self.process.wait()
+        self.process.stdin.close()
+        self.process.stdout.close()
+        self.stderr.close()
+        self._remove()
+
+
+# the ways of running Python blocks, by name
+executors = {"hlbox": HLBoxExecutor, "local": LocalExecutor}
+
+
+def executor_name(executor=None):
+    """
+    returns: `executor`, or by default the `HLTEX_EXECUTOR` environment variable or
+        "hlbox"
+    raises: DependencyError if that isn't the name of one of `executors`
+    """
+    if executor is None:
+        executor = os.environ.get("HLTEX_EXECUTOR") or "hlbox"
+    if executor not in executors:
+        raise DependencyError(
+            "Unknown way of running Python blocks {} (expected one of {})".format(
+                repr(executor), ", ".join(sorted(executors))
+            )
+        )
+    return executor
+
+
+class Pybox:
+    """
+    A sandbox that runs Python blocks one after another, with the `executor` they're
+    run with (see `executors`)
+    cputime: the most seconds of CPU time the blocks take, altogether
+    memory: the most megabytes of memory they take (by default, the executor's
+        `memory`)
+    """
+
+    def __init__(
+        self, file_env=None, docker=None, cputime=10, memory=None, executor=None
+    ):
+        if file_env is None:
+            file_env = {}
+        if docker is None:
+            docker = default_docker
+        self.docker = docker
+        files = [{"name": "main.py", "content": _driver}]
+
+        for name, content in file_env.items():
+            files.append({"name": name, "content": content.encode("utf-8")})
+
+        self.executor = executors[executor_name(executor)]()
+        if memory is None:
+            memory = self.executor.memory
+        limits = {"cputime": cputime, "memory": memory}
+        self.executor.start(files, docker, limits)
+
+    def run(self, body):
+        outputs, error = self.run_all([body])
+        if error is not None:
+            raise error
+        return outputs[0]
+
+    def run_all(self, bodies):
+        """
+        Runs the Python blocks `bodies` one after the other, in a single round trip to
+        the sandbox, up to the first one that fails
+        returns: the outputs of the blocks run before one failed (of all of them, if
+            none did), and the DependencyError of the one that failed, or None
+        """
+        answer = self.executor.run(_frame({"blocks": list(bodies)}) + b"\n")
+        outputs = []
+        while len(outputs) < len(bodies):
+            parts = []
+            frame = None if answer is None else _read_frame(answer)
+            while frame is not None and "output" in frame:
+                parts.append(frame["output"])
+                frame = _read_frame(answer)
+            if frame is None:
+                # the driver exited while running this block
+                return outputs, DependencyError(
+                    "Something went wrong executing this Python block\n"
+                    + self.executor.failure()
+                )
+            if frame["error"] is not None:
+                answer.read(1)
+                return outputs, DependencyError(
+                    "Python execution failed: {}".format(frame["error"])
+                )
+            outputs.append("".join(parts))
+        answer.read(1)  # the newline ending the answer
+        return outputs, None
+
+    def fetch_generated_files(self):
         import tempfile
 
         tmp_dir = os.path.join(
@@ -89,11 +434,415 @@ class Pybox:
             + next(tempfile._get_candidate_names()),  # pylint: disable=protected-access
         )
         os.mkdir(tmp_dir)
-        hlbox.runline(self.sandbox, "None\n")  # trigger tar
-        hlbox.download(self.sandbox, tmp_dir)
+        self.executor.fetch_generated_files(tmp_dir)
 
         generated_files = []
         for f in os.listdir(tmp_dir):
             if os.path.isfile(os.path.join(tmp_dir, f)) and f != "main.py":
                 generated_files.append(os.path.join(tmp_dir, f))
         return generated_files
+
+    def close(self):
+        """
+        postcondition: the sandbox is destroyed, and the Pybox can't be used any more
+        """
+        self.executor.close()
+
+
+class PyboxPool:
+    """
+    Sandboxes started ahead of time, by Docker image and files, so that the first
+    Python block of a document doesn't have to wait for one to start
+
+    Every sandbox is handed out to one document (see `acquire`), and destroyed when
+    the document's done with it, since its blocks leave their state behind in it. A
+    background thread then starts another to take its place, for as long as sandboxes
+    like it keep being asked for.
+    warm: how many started sandboxes to keep ready for each image, files and executor
+        that were asked for in the last `ttl` seconds
+    ttl: how many seconds a ready sandbox is kept without being handed out, before it's
+        destroyed
+    max_live: the most sandboxes alive at once, whether ready, starting or handed out
+    wait: how many seconds `acquire` waits for a sandbox to be destroyed, when there
+        are `max_live` of them already
+    """
+
+    def __init__(self, warm=1, ttl=300, max_live=8, wait=60):
+        self.warm = warm
+        self.ttl = ttl
+        self.max_live = max_live
+        self.wait = wait
+        self._cond = threading.Condition()
+        # by key (see `_key`): the ready sandboxes, as (time ready, Pybox)
+        self._ready = {}
+        # by key: how many sandboxes are being started in the background
+        self._starting = {}
+        # by key: (file_env, docker, executor, time last asked for) for the sandboxes
+        # to keep warm
+        self._wanted = {}
+        self._live = 0
+        self._thread = None
+        self._closed = False
+
+    @staticmethod
+    def _key(file_env, docker, executor):
+        return executor, docker, json.dumps(sorted(file_env.items()))
+
+    def _ensure_thread(self):
+        if self._thread is None and self.warm > 0:
+            self._thread = threading.Thread(
+                target=self._maintain, name="hltex-pybox-pool", daemon=True
+            )
+            self._thread.start()
+
+    def configure(self, warm=None, ttl=None, max_live=None, wait=None):
+        """
+        postcondition: the given settings are changed (see `PyboxPool`)
+        """
+        with self._cond:
+            if warm is not None:
+                self.warm = warm
+            if ttl is not None:
+                self.ttl = ttl
+            if max_live is not None:
+                self.max_live = max_live
+            if wait is not None:
+                self.wait = wait
+            self._cond.notify_all()
+
+    def acquire(self, file_env=None, docker=None, executor=None):
+        """
+        returns: a `PooledPybox`, of a sandbox with the files `file_env` run with
+            `executor` (see `executor_name`) that's had nothing run in it yet, from the
+            ready ones if there is one
+        raises: DependencyError if there's no sandbox and one can't be started, or none
+            can be for `wait` seconds because there are `max_live` of them already
+        """
+        if file_env is None:
+            file_env = {}
+        if docker is None:
+            docker = default_docker
+        executor = executor_name(executor)
+        key = self._key(file_env, docker, executor)
+        victim = None
+        with self._cond:
+            deadline = time.monotonic() + self.wait
+            self._wanted[key] = (file_env, docker, executor, time.monotonic())
+            self._ensure_thread()
+            self._cond.notify_all()
+            while True:
+                if self._closed:
+                    raise DependencyError("The pool of Python sandboxes is closed")
+                ready = self._ready.get(key)
+                if ready:
+                    _, pybox = ready.pop()
+                    self._cond.notify_all()
+                    return PooledPybox(self, pybox)
+                if not self._starting.get(key):
+                    if self._live < self.max_live:
+                        self._live += 1
+                        break
+                    # make room by destroying the sandbox least recently made ready
+                    idle = [
+                        (ready[0][0], other)
+                        for other, ready in self._ready.items()
+                        if ready
+                    ]
+                    if idle:
+                        victim = self._ready[min(idle)[1]].pop(0)[1]
+                        break
+                # there's one starting to wait for, or one may be destroyed in time
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise DependencyError(
+                        "Timed out waiting for a Python sandbox, with {} running".format(
+                            self._live
+                        )
+                    )
+                self._cond.wait(remaining)
+        if victim is not None:
+            victim.close()
+        try:
+            pybox = Pybox(file_env=file_env, docker=docker, executor=executor)
+        except BaseException:
+            self._released()
+            raise
+        return PooledPybox(self, pybox)
+
+    def _released(self):
+        with self._cond:
+            self._live -= 1
+            self._cond.notify_all()
+
+    def _maintain(self):
+        """
+        The background thread, which starts sandboxes for the ready ones that were
+        handed out, and destroys the ones that were ready too long
+        """
+        while True:
+            expired = []
+            start = None
+            with self._cond:
+                if self._closed:
+                    return
+                now = time.monotonic()
+                wake = None
+                for key, ready in self._ready.items():
+                    while ready and now - ready[0][0] >= self.ttl:
+                        expired.append(ready.pop(0)[1])
+                        self._live -= 1
+                    if ready:
+                        wake = min(wake or ready[0][0], ready[0][0])
+                for key, wanted in list(self._wanted.items()):
+                    file_env, docker, executor, asked = wanted
+                    if now - asked >= self.ttl:
+                        del self._wanted[key]
+                        continue
+                    count = len(self._ready.get(key, ())) + self._starting.get(key, 0)
+                    if count < self.warm and self._live < self.max_live:
+                        start = key, file_env, docker, executor
+                        self._starting[key] = self._starting.get(key, 0) + 1
+                        self._live += 1
+                        break
+                    wake = min(wake or asked, asked)
+                if not expired and start is None:
+                    self._cond.wait(None if wake is None else wake + self.ttl - now)
+                    continue
+            for pybox in expired:
+                pybox.close()
+            if start is None:
+                continue
+            key, file_env, docker, executor = start
+            try:
+                pybox = Pybox(file_env=file_env, docker=docker, executor=executor)
+            except Exception:  # pylint: disable=broad-except
+                # raised by `acquire` instead, which starts one itself when none are
+                # ready or starting
+                pybox = None
+            with self._cond:
+                self._starting[key] -= 1
+                if pybox is None or self._closed:
+                    self._live -= 1
+                    self._wanted.pop(key, None)
+                else:
+                    self._ready.setdefault(key, []).append((time.monotonic(), pybox))
+                    pybox = None
+                self._cond.notify_all()
+            if pybox is not None:
+                pybox.close()
+
+    def stats(self):
+        """
+        returns: how many sandboxes are ready, starting and alive in all
+        """
+        with self._cond:
+            return {
+                "ready": sum(map(len, self._ready.values())),
+                "starting": sum(self._starting.values()),
+                "live": self._live,
+            }
+
+    def close(self):
+        """
+        postcondition: every ready sandbox is destroyed, and no more are started (the
+            ones handed out are destroyed as they're closed)
+        """
+        with self._cond:
+            self._closed = True
+            ready = [pybox for boxes in self._ready.values() for _, pybox in boxes]
+            self._live -= len(ready)
+            self._ready.clear()
+            self._cond.notify_all()
+        for pybox in ready:
+            pybox.close()
+
+
+class PooledPybox:
+    """
+    A sandbox handed out by a `PyboxPool`, to be used like a `Pybox`
+    """
+
+    def __init__(self, pool, pybox):
+        self.pool = pool
+        self.pybox = pybox
+
+    def run(self, body):
+        return self.pybox.run(body)
+
+    def run_all(self, bodies):
+        return self.pybox.run_all(bodies)
+
+    def fetch_generated_files(self):
+        return self.pybox.fetch_generated_files()
+
+    def close(self):
+        """
+        postcondition: the sandbox is destroyed, which makes room in the pool
+        """
+        if self.pybox is not None:
+            pybox, self.pybox = self.pybox, None
+            try:
+                pybox.close()
+            finally:
+                self.pool._released()  # pylint: disable=protected-access
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def pool():
+    """
+    returns: the process-wide `PyboxPool` (which keeps no sandboxes ready until
+        configured to, since most processes translate a document or two and exit)
+    """
+    global _pool  # pylint: disable=global-statement
+    with _pool_lock:
+        if _pool is None:
+            _pool = PyboxPool(warm=0)
+            atexit.register(_pool.close)
+        return _pool
+
+
+# a line in a Python block that keeps its output from being memoized, e.g. for blocks
+# that print random numbers or the time
+_no_memo_pattern = re.compile(r"^[ \t]*#[ \t]*hltex:[ \t]*no-cache[ \t]*$", re.MULTILINE)
+
+
+def _chain(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class MemoPybox:
+    """
+    A Pybox whose outputs are memoized in `cache` (a `hltex.cache.Cache`), so that
+    translating blocks again that were translated before doesn't run them
+
+    Since a block can use whatever blocks before it in the same sandbox left behind,
+    the output of a block is memoized under a key chained from the Docker image, the
+    files, the executor (unless it's HLBox) and every block run before it. The sandbox
+    is only created once a block isn't found in the cache, and then runs the blocks
+    found in the cache before it first. A block with a `# hltex: no-cache` line is
+    always run, as is every block after it in the same sandbox.
+    """
+
+    def __init__(self, cache, file_env=None, docker=None, executor=None):
+        if file_env is None:
+            file_env = {}
+        if docker is None:
+            docker = default_docker
+        self.cache = cache
+        self.file_env = file_env
+        self.docker = docker
+        self.executor = executor_name(executor)
+        self.pybox = None
+        # the blocks found in the cache that haven't been run in the sandbox yet
+        self.skipped = []
+        # the key of the blocks run so far, or None once one of them wasn't memoized
+        self.chain = _chain(docker, json.dumps(sorted(file_env.items())))
+        if self.executor != "hlbox":
+            # whose Python (and its packages) may not be the image's
+            self.chain = _chain(self.chain, self.executor)
+
+    def _sandbox(self):
+        if self.pybox is None:
+            self.pybox = pool().acquire(
+                file_env=self.file_env, docker=self.docker, executor=self.executor
+            )
+        while self.skipped:
+            self.pybox.run(self.skipped.pop(0))
+        return self.pybox
+
+    def run(self, body):
+        if self.chain is None or _no_memo_pattern.search(body):
+            self.chain = None
+            return self._sandbox().run(body)
+        self.chain = _chain(self.chain, body)
+        entry = self.cache.get(self.chain)
+        if entry is not None:
+            self.skipped.append(body)
+            return json.loads(entry)["output"]
+        res = self._sandbox().run(body)
+        self.cache.put(self.chain, json.dumps({"output": res}))
+        return res
+
+    def run_all(self, bodies):
+        """
+        As for `Pybox.run_all`, where the blocks up to the last one that isn't found in
+        the cache are run in a single round trip, along with the blocks found in the
+        cache that have to run before them
+        """
+        keys = []
+        entries = []
+        chain = self.chain
+        for body in bodies:
+            if chain is None or _no_memo_pattern.search(body):
+                chain = None
+            else:
+                chain = _chain(chain, body)
+            keys.append(chain)
+            entries.append(None if chain is None else self.cache.get(chain))
+        missing = [i for i, entry in enumerate(entries) if entry is None]
+        cached = [
+            None if entry is None else json.loads(entry)["output"] for entry in entries
+        ]
+        if not missing:
+            self.chain = chain
+            self.skipped.extend(bodies)
+            return cached, None
+        last = missing[-1]
+        replayed = len(self.skipped)
+        batch = self.skipped + list(bodies[: last + 1])
+        self.skipped = []
+        results, error = self._sandbox().run_all(batch)
+        if len(results) < replayed:
+            # as `run` would, the first block that isn't found fails instead
+            self.chain = keys[missing[0]]
+            return cached[: missing[0]], error
+        outputs = []
+        for i, res in enumerate(results[replayed:]):
+            if entries[i] is None:
+                if keys[i] is not None:
+                    self.cache.put(keys[i], json.dumps({"output": res}))
+                outputs.append(res)
+            else:
+                outputs.append(cached[i])
+        if error is not None:
+            self.chain = keys[len(outputs)]
+            return outputs, error
+        self.chain = chain
+        self.skipped.extend(bodies[last + 1 :])
+        return outputs + cached[last + 1 :], None
+
+    def fetch_generated_files(self):
+        import base64
+        import tempfile
+
+        key = None if self.chain is None else _chain(self.chain, "files")
+        if key is not None and self.pybox is None:
+            entry = self.cache.get(key)
+            if entry is not None:
+                tmp_dir = tempfile.mkdtemp(prefix="hltex_python_")
+                generated_files = []
+                for name, content in json.loads(entry)["files"].items():
+                    path = os.path.join(tmp_dir, name)
+                    with open(path, "wb") as f:
+                        f.write(base64.b64decode(content))
+                    generated_files.append(path)
+                return generated_files
+        generated_files = self._sandbox().fetch_generated_files()
+        if key is not None:
+            files = {}
+            for path in generated_files:
+                with open(path, "rb") as f:
+                    files[os.path.basename(path)] = base64.b64encode(f.read()).decode()
+            self.cache.put(key, json.dumps({"files": files}))
+        return generated_files
+
+    def close(self):
+        if self.pybox is not None:
+            self.pybox.close()
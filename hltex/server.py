@@ -0,0 +1,325 @@
+import hashlib
+import json
+import os
+import signal
+import socket
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing.util import Finalize
+from socketserver import ThreadingUnixStreamServer
+
+from .control.pysplice import has_python_blocks
+from .errors import DependencyError, TranslationError
+from .translator import Translator
+
+# how much of a translation is sent in each chunk of a response
+_chunk_size = 64 * 1024
+
+
+def _translate(source, file_env, executor):
+    """
+    Translates `source` in a worker process, in a Translator of its own, whose Python
+    sandboxes are taken ready from the worker's pool and destroyed afterwards (so that
+    one document's blocks can't see what another's left behind)
+    returns: ("ok", translation), or ("error", message, line, col) for a
+        TranslationError (since those can't be pickled back to the server)
+    """
+    with Translator(file_env=file_env, executor=executor) as translator:
+        try:
+            return ("ok", translator.translate(source))
+        except TranslationError as e:
+            return ("error", str(e.msg), e.line, e.col)
+
+
+def _init_worker():
+    # Ctrl-C stops the server, which then shuts the workers down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # a worker serves many documents, so a sandbox is kept started for each Docker image
+    # and file_env that was used recently (imported here, as by `translate_pysplice`)
+    from .pybox import pool
+
+    pool().configure(warm=1)
+    # run as the worker exits, which doesn't run `atexit` handlers
+    Finalize(None, pool().close, exitpriority=5)
+
+
+class ResultCache:
+    """
+    The results of the most recent translations, by the hash of their source and
+    file_env, evicting the least recently used past `size` entries
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.results = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(source, file_env):
+        digest = hashlib.sha256(json.dumps(sorted(file_env.items())).encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(source.encode("utf-8"))
+        return digest.digest()
+
+    def get(self, key):
+        with self.lock:
+            res = self.results.get(key)
+            if res is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.results.move_to_end(key)
+            return res
+
+    def put(self, key, res):
+        if self.size <= 0:
+            return
+        with self.lock:
+            self.results[key] = res
+            self.results.move_to_end(key)
+            while len(self.results) > self.size:
+                self.results.popitem(last=False)
+
+
+class Service:
+    """
+    Translations served by a pool of `workers` processes (each with its own Python
+    sandboxes, started ahead of the requests that need them), with the results of the
+    last `cache_size` distinct requests kept in memory
+    raises: DependencyError if Python blocks would be run with the local executor
+        (see `hltex.pybox.executor_name`), since anything that can reach the server
+        could then run code on this machine
+    """
+
+    def __init__(self, workers=None, cache_size=256):
+        from .pybox import executor_name
+
+        self.executor = executor_name()
+        if self.executor == "local":
+            raise DependencyError(
+                "Python blocks can't be served with the local executor, which doesn't "
+                "sandbox them (set HLTEX_EXECUTOR to hlbox)"
+            )
+        if workers is None:
+            workers = os.cpu_count() or 1
+        self.workers = workers
+        self.pool = self._new_pool()
+        self.pool_lock = threading.Lock()
+        self.cache = ResultCache(cache_size)
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+
+    def _submit(self, source, file_env):
+        """
+        returns: as for `_translate`, run in a new pool if a worker of the current one
+            died (e.g. killed for running out of memory), which breaks it for good
+        raises: BrokenProcessPool if a worker of the new pool dies too
+        """
+        pool = self.pool
+        try:
+            return pool.submit(_translate, source, file_env, self.executor).result()
+        except BrokenProcessPool:
+            with self.pool_lock:
+                # unless another request already replaced it
+                if self.pool is pool:
+                    self.pool = self._new_pool()
+                    pool.shutdown(wait=False)
+                pool = self.pool
+        return pool.submit(_translate, source, file_env, self.executor).result()
+
+    def translate(self, source, file_env=None):
+        """
+        returns: as for `_translate`, along with whether the result was cached
+        """
+        if file_env is None:
+            file_env = {}
+        key = self.cache.key(source, file_env)
+        res = self.cache.get(key)
+        if res is not None:
+            return res, True
+        res = self._submit(source, file_env)
+        if not has_python_blocks(source):
+            # since Python blocks may print something else each time
+            self.cache.put(key, res)
+        return res, False
+
+    def stats(self):
+        return {
+            "cache_hits": self.cache.hits,
+            "cache_misses": self.cache.misses,
+            "cache_entries": len(self.cache.results),
+        }
+
+    def close(self):
+        """
+        postcondition: the workers have exited, destroying their Python sandboxes
+        """
+        self.pool.shutdown()
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    Serves `POST /translate`, with a JSON object with the "source" and optionally its
+    "file_env" as the body (only as `application/json`, which a web page can't send to
+    the server without its consent, unlike a form or `text/plain`), responding
+    with the translation (sent with chunked encoding once it's complete, a chunk
+    encoded at a time), or with a JSON object with the "error" and its "line" and
+    "column" (zero-based, or null) and status 422 if it fails; and `GET /stats`
+    """
+
+    protocol_version = "HTTP/1.1"
+    server_version = "hltex"
+    # buffered (and flushed after each response), so that the headers and the start
+    # of the body go out together instead of waiting on delayed ACKs
+    wbufsize = -1
+
+    def address_string(self):
+        # Unix sockets have no client address
+        if isinstance(self.client_address, tuple):
+            return super().address_string()
+        return "unix"
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+    def send_json(self, status, obj):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/stats":
+            self.send_json(404, {"error": "Not found"})
+            return
+        self.send_json(200, self.server.service.stats())
+
+    def do_POST(self):
+        if self.path != "/translate":
+            self.send_json(404, {"error": "Not found"})
+            return
+        if self.headers.get_content_type() != "application/json":
+            # the body isn't read, so it can't be told from the next request
+            self.close_connection = True
+            self.send_json(415, {"error": "Expected an application/json body"})
+            return
+        if self.headers.get("Content-Length") is None:
+            # a body sent without one (e.g. chunked) runs into the next request
+            self.close_connection = True
+            self.send_json(411, {"error": "Missing Content-Length"})
+            return
+        try:
+            length = int(self.headers["Content-Length"])
+            if length < 0:
+                raise ValueError
+        except ValueError:
+            # the body can't be told from the next request, so it's the last one
+            self.close_connection = True
+            self.send_json(400, {"error": "Invalid Content-Length"})
+            return
+        try:
+            body = self.rfile.read(length).decode("utf-8")
+        except UnicodeDecodeError:
+            self.send_json(400, {"error": "Expected a UTF-8 body"})
+            return
+        try:
+            request = json.loads(body)
+            source = request["source"]
+            file_env = request.get("file_env") or {}
+            if not isinstance(source, str) or not isinstance(file_env, dict):
+                raise TypeError
+        except (ValueError, KeyError, TypeError, AttributeError):
+            self.send_json(400, {"error": 'Expected {"source": ...}'})
+            return
+        try:
+            res, cached = self.server.service.translate(source, file_env)
+        except Exception as e:  # pylint: disable=broad-except
+            # e.g. a worker was killed
+            self.send_json(500, {"error": "{}: {}".format(type(e).__name__, e)})
+            return
+        if res[0] == "error":
+            _, msg, line, col = res
+            self.send_json(422, {"error": msg, "line": line, "column": col})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/x-tex; charset=utf-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("X-Hltex-Cache", "hit" if cached else "miss")
+        self.end_headers()
+        # the translation is already complete, but encoding it a chunk at a time lets
+        # the start of a big one go out before the rest is encoded
+        res = res[1]
+        for i in range(0, len(res), _chunk_size):
+            chunk = res[i : i + _chunk_size].encode("utf-8")
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, service, quiet=False):
+        self.service = service
+        self.quiet = quiet
+        super().__init__(address, Handler)
+
+
+class UnixServer(ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, service, quiet=False):
+        self.service = service
+        self.quiet = quiet
+        if os.path.exists(path):
+            # left behind by a server that didn't shut down cleanly, as long as nothing
+            # answers on it
+            with socket.socket(socket.AF_UNIX) as sock:
+                try:
+                    sock.connect(path)
+                except OSError:
+                    os.unlink(path)
+        super().__init__(path, Handler)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.server_address)
+        except FileNotFoundError:
+            pass
+
+
+def serve(service, host="127.0.0.1", port=None, path=None, quiet=False):
+    """
+    Serves `service` over HTTP on `host` and `port` and/or on the Unix socket at `path`
+    until interrupted
+    """
+    servers = []
+    threads = []
+    try:
+        if port is not None:
+            servers.append(HTTPServer((host, port), service, quiet=quiet))
+        if path is not None:
+            servers.append(UnixServer(path, service, quiet=quiet))
+        for server in servers:
+            threads.append(threading.Thread(target=server.serve_forever, daemon=True))
+            threads[-1].start()
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # only servers that were started can be shut down
+        for server in servers[: len(threads)]:
+            server.shutdown()
+        for server in servers:
+            server.server_close()
+        service.close()
@@ -1,17 +1,80 @@
+from bisect import bisect_right
+
 from .control import commands, environments
+from .indentation import LineTable
+from .lexer import Tokens
 
 
 class State:
-    def __init__(self, text, pos=0, indent_str=None, file_env=None):
+    __slots__ = (
+        "text",
+        "pos",
+        "indent_str",
+        "indent_pos",
+        "commands",
+        "environments",
+        "pyboxes",
+        "file_env",
+        "executor",
+        "pysplice_cache",
+        "pysplice_outputs",
+        "pysplice_runners",
+        "on_custom",
+        "_lines",
+        "tokens",
+        "depth",
+        "margin",
+        "irregular",
+        "unclosed_argstrs",
+    )
+
+    def __init__(
+        self,
+        text,
+        pos=0,
+        indent_str=None,
+        file_env=None,
+        commands=commands,
+        environments=environments,
+        pyboxes=None,
+        pysplice_cache=None,
+        executor=None,
+    ):
         self.text = text
         self.pos = pos
         self.indent_str = indent_str
-        self.commands = commands.copy()
-        self.environments = environments.copy()
-        self.pyboxes = {}
+        # where `indent_str` was found, if it wasn't given
+        self.indent_pos = None
+        # flat copies, since they're looked up for every control sequence
+        self.commands = dict(commands)
+        self.environments = dict(environments)
+        if pyboxes is None:
+            pyboxes = {}
+        self.pyboxes = pyboxes
         if file_env is None:
             file_env = {}
         self.file_env = file_env
+        # how Python blocks are run (see `hltex.pybox.executors`), or None by default
+        self.executor = executor
+        # where Python block outputs are memoized (see `MemoPybox`), if anywhere
+        self.pysplice_cache = pysplice_cache
+        # by Docker image: the (body, output) of the Python blocks run ahead of time
+        # (see `run_python_blocks`)
+        self.pysplice_outputs = {}
+        # by Docker image: the threads running Python blocks while the source is parsed,
+        # or None unless translating concurrently (see `run_concurrently`)
+        self.pysplice_runners = None
+        # a function called with every custom command and environment node as it's
+        # parsed, or None
+        self.on_custom = None
+        self._lines = None
+        self.tokens = Tokens(text)
+        # the environment bodies being emitted (see `emit_environment`)
+        self.depth = 0
+        self.margin = ""
+        self.irregular = 0
+        # positions from which an optional argstr runs into the end of its line
+        self.unclosed_argstrs = set()
 
     def run(self, context, **kwargs):
         return context(self, **kwargs)
@@ -19,5 +82,48 @@ class State:
     def finished(self):
         return self.pos >= len(self.text)
 
-    def get_line(self):
-        return self.text.count("\n", 0, self.pos)
+    @property
+    def lines(self):
+        """
+        a `LineTable` of `self.text`, computed on first use
+        """
+        if self._lines is None:
+            self._lines = LineTable(self.text)
+        return self._lines
+
+    @property
+    def line_starts(self):
+        """
+        the offset of the start of every line in `self.text`
+        """
+        return self.lines.starts
+
+    def get_line(self, pos=None):
+        """
+        returns: the (zero-based) line number of `pos`, or of `self.pos` by default
+        """
+        if pos is None:
+            pos = self.pos
+        return bisect_right(self.line_starts, pos) - 1
+
+    def get_col(self, pos=None):
+        """
+        returns: the (zero-based) column of `pos`, or of `self.pos` by default
+        """
+        if pos is None:
+            pos = self.pos
+        return pos - self.line_starts[self.get_line(pos)]
+
+    def locate(self, error, pos=None):
+        """
+        postcondition: `error` (a TranslationError) carries the line and column of
+            `pos` (or of `self.pos`), unless it already had a location
+        returns: `error`
+        """
+        if error.line is None:
+            if pos is None:
+                pos = self.pos
+            line = self.get_line(pos)
+            error.line = line
+            error.col = pos - self.line_starts[line]
+        return error
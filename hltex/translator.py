@@ -1,103 +1,77 @@
-from .context import increment, parse_until, parse_while
-from .control import latex_env
-from .errors import (
-    InternalError,
-    InvalidSyntax,
-    MissingArgument,
-    UnexpectedEOF,
-    UnexpectedIndentation,
+import os
+import re
+from bisect import bisect_left, bisect_right
+from collections import ChainMap
+from itertools import accumulate, chain
+
+from . import parser
+from .control import commands, environments
+from .control.pysplice import (
+    finish_concurrently,
+    run_concurrently,
+    run_python_blocks,
 )
-from .indentation import (
-    calc_indent_level,
-    iswhitespace,
-    line_is_empty,
-    parse_empty,
-    postprocess_block,
-    preprocess_block,
+from .emitter import (
+    emit_all,
+    emit_arg,
+    emit_block,
+    emit_body,
+    emit_command,
+    emit_text,
+    end_document,
 )
+from .errors import TranslationError
+from .indentation import dedent_indents, empty_space_lines
+from .nodes import Document, Newline
+from .output import Output, collect
+from .parser import parse_control_name  # pylint: disable=unused-import
 from .state import State
 
+# A run of lines of UTF-8 that translates to itself wherever a top-level block can
+# start, up to where an unindented line starts: empty lines, and lines that start with
+# a printable ASCII character (other than `=`, which may start the document) and have
+# no braces, comments, control sequences other than a backslash escaping a character
+# that isn't followed by arguments or a colon (see `parse_native_control`), or line
+# breaks other than "\n" (see `write_block_text`)
+_plain_char = (
+    rb"[^\\{}%\n\r\x0b\x0c\x1c-\x1e\xc2\xe2]|\xc2[^\x85]|\xe2(?!\x80[\xa8\xa9])"
+    rb"|\\[!-@\[-`{-~](?![ \t]*[\[{:])"
+)
+_plain_line = rb"(?=[!-<>-~])(?:%s)+" % _plain_char
+_plain_lines_pattern = re.compile(
+    rb"(?:%s)?(?:\n(?:%s)?)*\n(?=[!-~])" % ((_plain_line,) * 2)
+)
+# where a run of plain lines may start (after the newline)
+_plain_start_pattern = re.compile(rb"\n(?=%s\n)" % _plain_line)
+# where an unindented line starts (after the newline)
+_boundary_pattern = re.compile(rb"\n(?=[!-~])")
 
-def parse_control_name(state):
-    """
-    precondition: `state.pos` is at the first character following a backslash
-    postcondition: `state.pos` is at the first character following the name of the
-        control sequence
-    raises: UnexpectedEOF if there is no character following the name of the control
-        sequence
-    """
-    assert state.text[state.pos - 1] == "\\"
-    if state.finished():
-        raise UnexpectedEOF(
-            "Unescaped backslashes must be followed by at least one character"
-        )
-    name = parse_while(state, pred=str.isalpha)
-    if not name:
-        name = increment(state)
-    assert (
-        state.finished()
-        or not str.isalpha(state.text[state.pos])
-        or not str.isalpha(state.text[state.pos - 1])
-    )
-    return name
+# Each parse function below translates a piece of the source as a whole, by parsing it
+# into nodes (see `hltex.parser`) and emitting them (see `hltex.emitter`)
 
 
-def parse_arg_control(state):
+def parse_arg_control(state, out=None):
     """
     precondition: `state.pos` is at the first character following a backslash
     postcondition: `state.pos` is either at the first character following the
     command name (for native commands) or at the first character following the last
     argument (for custom commands)
     """
-    assert state.text[state.pos - 1] == "\\"
-    name = parse_control_name(state)
-    if name in state.commands:
-        return parse_custom_command(state, command=state.commands[name])
-    return "\\" + name
+    if out is None:
+        return collect(parse_arg_control, state)
+    emit_all(state, [parser.parse_arg_control(state)], out)
 
 
-def parse_comment(state):
-    """
-    precondition: `state.pos` is after a percent sign
-    postcondition: `state.pos` is at the newline following the percent sign (or at the
-        EOF if there is no following newline)
-    """
-    assert state.text[state.pos - 1] == "%"
-    res = "%" + parse_until(state, lambda c: c == "\n")
-    assert state.finished() or state.text[state.pos] == "\n"
-    return res
-
-
-def parse_group(state, end):
+def parse_group(state, end, out=None):
     """
     precondition: `state.pos` is somewhere inside a group (typically would be called
         from the first character following the opening brace or bracket)
     postcondition: `state.pos` is at the first character following the closing brace or
         bracket
     """
-    body = parse_until(state, pred=lambda c: c in "{}\\%" + end)
-    if state.finished():
-        raise UnexpectedEOF("Missing closing `{}`".format(end))
-    if state.text[state.pos] == end:
-        increment(state)
-        assert state.text[state.pos - 1] == end
-        return body
-    if state.text[state.pos] == "}":
-        raise InvalidSyntax("Unexpected `}`")
-    if state.text[state.pos] == "{":
-        increment(state)
-        body += "{" + parse_group(state, end="}") + "}"
-    elif state.text[state.pos] == "\\":
-        increment(state)
-        body += parse_arg_control(state)
-    elif state.text[state.pos] == "%":
-        increment(state)
-        body += parse_comment(state)
-    else:
-        raise InternalError()
-    res = body + parse_group(state, end)
-    assert state.text[state.pos - 1] == end
-    return res
+    if out is None:
+        return collect(parse_group, state, end=end)
+    emit_all(state, parser.parse_group(state, end=end), out)
 
 
 def parse_optional_arg(state):
@@ -106,15 +80,7 @@ def parse_optional_arg(state):
     postcondition: `state.pos` is either at the first character following the closing
         bracket, or where it started if no closing bracket was found
     """
-    start = state.pos
-    parse_while(state, pred=iswhitespace)
-    if state.finished() or not state.text[state.pos] == "[":
-        state.pos = start
-        return None
-    increment(state)
-    res = parse_group(state, end="]")
-    assert state.text[state.pos - 1] == "]"
-    return res
+    return emit_arg(state, parser.parse_optional_arg(state))
 
 
 def parse_required_arg(state, name, raw=False):
@@ -122,22 +88,7 @@ def parse_required_arg(state, name, raw=False):
     precondition: `state.pos` is at the first character following the previous argument
     postcondition: `state.pos` is at the first character following the closing brace
     """
-    parse_while(state, pred=iswhitespace)
-    if state.finished():
-        raise UnexpectedEOF("Missing required argument for `{}`".format(name))
-    if not state.text[state.pos] == "{":
-        raise MissingArgument("Missing required argument for `{}`".format(name))
-    increment(state)
-    if raw:
-        body = parse_while(state, lambda c: c != "}")
-        if state.finished():
-            raise UnexpectedEOF("Missing closing `}}` for `{}`".format(name))
-        increment(state)
-        assert state.text[state.pos - 1] == "}"
-        return body
-    res = parse_group(state, end="}")
-    assert state.text[state.pos - 1] == "}"
-    return res
+    return emit_arg(state, parser.parse_required_arg(state, name=name, raw=raw))
 
 
 def parse_args(state, name, params):
@@ -147,96 +98,53 @@ def parse_args(state, name, params):
     postcondition: `state.pos` is at the first character following the last argument's
         closing bracket or brace
     """
-    args = []
-    for param in params:
-        if param == "?":
-            arg = parse_optional_arg(state)
-        elif param == "!":
-            arg = parse_required_arg(state, name=name)
-        elif param == "x":
-            arg = parse_required_arg(state, name=name, raw=True)
-        else:
-            raise InternalError()
-        args.append(arg)
-    assert all(p == "?" for p in params) or state.text[state.pos - 1] in "]}"
-    return args
+    args = parser.parse_args(state, name=name, params=params)
+    return [emit_arg(state, arg) for arg in args]
 
 
-def parse_optional_argstr(state):
+def parse_optional_argstr(state, out=None):
     """
     precondition: `state.pos` is somewhere an optional argstr (typically would be called
         from the first character following the opening bracket)
     postcondition: `state.pos` is at the first character following the closing bracket,
         or where it started if the line ends before it finds it
+    returns: False (having written nothing) if the line ends before the closing bracket
     """
-    start = state.pos
-    body = parse_until(state, pred=lambda c: c in "\n{}\\[]%")
-    if state.finished() or state.text[state.pos] in "\n%":
-        return None
-    if state.text[state.pos] == "]":
-        increment(state)
-        return body
-    if state.text[state.pos] == "}":
-        raise InvalidSyntax("Unexpected `}`")
-    if state.text[state.pos] == "{":
-        increment(state)
-        body += "{" + parse_group(state, end="}") + "}"
-    elif state.text[state.pos] == "[":
-        increment(state)
-        body += "[" + parse_group(state, end="]") + "]"
-    elif state.text[state.pos] == "\\":
-        increment(state)
-        body += parse_arg_control(state)
-    else:
-        raise InternalError()
-    res = parse_optional_argstr(state)
-    if res is None:
-        state.pos = start
-        return None
-    return body + res
-
-
-def parse_argstr(state):
+    if out is None:
+        return collect(parse_optional_argstr, state)
+    nodes = parser.parse_optional_argstr(state)
+    if nodes is None:
+        return False
+    emit_all(state, nodes, out)
+    return True
+
+
+def parse_argstr(state, out=None):
     """
     precondition: `state.pos` is at the first character following the name of a control
         sequence
     postcondition: `state.pos` is at the first character following the last argument's
         closing bracket or brace
     """
-    start = state.pos
-    body = parse_while(state, pred=iswhitespace)
-    if state.finished() or state.text[state.pos] not in "{[":
-        state.pos = start
-        return ""
-    if state.text[state.pos] == "{":
-        increment(state)
-        body += "{" + parse_group(state, end="}") + "}"
-        assert state.text[state.pos - 1] == "}"
-        return body + parse_argstr(state)
-    if state.text[state.pos] == "[":
-        increment(state)
-        res = parse_optional_argstr(state)
-        if res is None:
-            state.pos = start
-            return ""
-        body += "[" + res + "]"
-        assert state.text[state.pos - 1] == "]"
-        return body + parse_argstr(state)
-    raise InternalError()
+    if out is None:
+        return collect(parse_argstr, state)
+    emit_all(state, parser.parse_argstr(state), out)
 
 
-def parse_custom_command(state, command):
+def parse_custom_command(state, command, out=None):
     """
     precondition: `state.pos` is at the first character following the name of a custom
         command
     postcondition: `state.pos` is at the first character following the last argument's
         closing bracket or brace
     """
-    args = parse_args(state, name=command.name, params=command.params)
-    return command.translate(state, args)
+    if out is None:
+        return collect(parse_custom_command, state, command=command)
+    node = parser.parse_custom_command(state, command=command, start=state.pos)
+    emit_command(state, node, out)
 
 
-def parse_native_control(state, name, outer_indent_level):
+def parse_native_control(state, name, outer_indent_level, out=None):
     """
     precondition: `state.pos` is at the first character following the name of a
         native control sequence
@@ -244,270 +152,749 @@ def parse_native_control(state, name, outer_indent_level):
         argument's closing bracket or brace for commands, or at the start of the next
         non-empty block after the indented block
     """
-    argstr = parse_argstr(state)
-    start = state.pos
-    parse_while(state, pred=iswhitespace)
-    if state.finished() or state.text[state.pos] != ":":
-        state.pos = start
-        return "\\" + name + argstr
-    increment(state)
-    body = parse_environment_body(state, outer_indent_level=outer_indent_level)
-    res = latex_env(state, name, argstr, preprocess_block(body))
-    # Don't indent the first line
-    return postprocess_block(res, state, outer_indent_level)
+    if out is None:
+        return collect(
+            parse_native_control,
+            state,
+            name=name,
+            outer_indent_level=outer_indent_level,
+        )
+    node = parser.parse_native_control(
+        state, name=name, outer_indent_level=outer_indent_level, start=state.pos
+    )
+    emit_block(state, [node], out)
 
 
-def parse_custom_environment(state, environment, outer_indent_level):
+def parse_custom_environment(state, environment, outer_indent_level, out=None):
     """
     precondition: `state.pos` is at the first character following the name of a custom
         environment
     postcondition: `state.pos` is at the start of the next non-empty line following the
         indented block
     """
-    args = parse_args(state, name=environment.name, params=environment.params)
-    parse_while(state, pred=iswhitespace)
-    if state.finished():
-        raise UnexpectedEOF("Environments must be followed by colons")
-    if not state.text[state.pos] == ":":
-        raise InvalidSyntax("Environments must be followed by colons")
-    increment(state)
-    if environment.raw:
-        body = parse_raw_environment_body(state, outer_indent_level)
-    else:
-        body = parse_environment_body(state, outer_indent_level)
-    res = environment.translate(state, preprocess_block(body), args)
-    return postprocess_block(res, state, outer_indent_level)
-
-
-def parse_oneliner(state, outer_indent_level):
-    """
-    precondition: `state.pos` is somewhere inside a one-liner (typically would be
-        called from the first character after the colon)
-    postcondition: `state.pos` is at the end of the line, or at `len(state.text)`
-    """
-    body = parse_until(state, pred=lambda c: c in "\\\n{}%")
-
-    if state.finished() or state.text[state.pos] == "\n":
-        return body
-    if state.text[state.pos] == "\\":
-        body += parse_block_control(state, outer_indent_level)
-        return body + parse_oneliner(state, outer_indent_level)
-    if state.text[state.pos] == "{":
-        increment(state)
-        body += "{" + parse_group(state, end="}") + "}"
-        return body + parse_oneliner(state, outer_indent_level)
-    if state.text[state.pos] == "%":
-        increment(state)
-        body += parse_comment(state)
-        return body
-    if state.text[state.pos] == "}":
-        raise InvalidSyntax("Unexpected `}`")
-    raise InternalError()
-
-
-def parse_raw_block(state, outer_indent_level):
-    """
-    precondition: `state.pos` is somewhere inside a raw block
-    """
-    body = parse_until(state, pred=lambda c: c == "\n")
-
-    if state.finished():
-        return body
-    if state.text[state.pos] == "\n":
-        start = state.pos
-        increment(state)
-        empty = parse_empty(state)
-        if state.finished():
-            state.pos = start
-            return body
-        indent_level = calc_indent_level(state)
-        if indent_level < outer_indent_level:
-            state.pos = start
-            return body
-        return body + "\n" + empty + parse_raw_block(state, outer_indent_level)
-    raise InternalError()
-
-
-def parse_raw_environment_body(state, outer_indent_level):
-    """
-    precondition: `state.pos` is at the first character following the colon
-    """
-    assert state.text[state.pos - 1] == ":"
-    parse_while(state, pred=iswhitespace)
-    if state.finished():
-        raise UnexpectedEOF("Environment missing body")
-    if state.text[state.pos] != "\n":
-        return parse_until(state, lambda c: c == "\n")
-    body = parse_empty(state)
-    if line_is_empty(state):
-        raise UnexpectedEOF("Environment missing body")
-    indent_level = calc_indent_level(state)
-    if indent_level != outer_indent_level + 1:
-        raise InvalidSyntax("Missing indentation after environment")
-    return body + parse_raw_block(state, indent_level)
-
-
-def parse_environment_body(state, outer_indent_level):
-    """
-    precondition: `state.pos` is at the first character following the colon
-    postcondition: `state.pos` is at the next non-empty line following the indented
-        block, or at the end of the line for one-liners
-    """
-    assert state.text[state.pos - 1] == ":"
-    parse_while(state, pred=iswhitespace)
-    if state.finished():
-        raise UnexpectedEOF("Environment missing body")
-    if state.text[state.pos] not in "\n%":
-        return parse_oneliner(state, outer_indent_level)
-    comment = None
-    if state.text[state.pos] == "%":
-        increment(state)
-        comment = parse_comment(state)
-    body = parse_empty(state)
-    # increment(state)
-    if line_is_empty(state):
-        raise UnexpectedEOF("Environment missing body")
-    indent_level = calc_indent_level(state)
-    if indent_level != outer_indent_level + 1:
-        raise InvalidSyntax("Missing indentation after environment")
-    if comment is not None:
-        indent = (state.indent_str or "") * indent_level
-        body = "\n" + indent + comment + body
-    return body + parse_block(state)
-
-
-def parse_document(state):
-    """
-    precondition: `state.pos` is at the first =
-    postcondition: `state.pos` is at the end of the file
-    """
-    parse_while(state, pred=lambda c: c == "=")
-    if state.finished():
-        raise UnexpectedEOF("Missing document body")
-    if state.text[state.pos] != "\n":
-        raise InvalidSyntax("Missing newline after document delineator")
-    increment(state)
-    empty = parse_empty(state)
-    if line_is_empty(state):
-        document = "\n" + empty
-    elif calc_indent_level(state) != 0:
-        raise UnexpectedIndentation("The document as a whole must not be indented")
-    else:
-        document = "\n" + empty + parse_block(state)
-    return postprocess_block(
-        latex_env(state, "document", "", preprocess_block(document), indent=False),
-        state,
-        0,
-    )
-
-
-def parse_block_newline(state, outer_indent_level, preamble=False):
-    """
-    precondition: `state.pos` is at a newline in a block
-    postcondition: `state.pos` is at the start of the next line
-    """
-    assert state.text[state.pos] == "\n"
-    start = state.pos
-    increment(state)
-    empty = parse_empty(state)
-    if preamble and state.text[state.pos : state.pos + 3] == "===":
-        return "\n" + empty + parse_document(state)
-    if state.finished():
-        state.pos = start
-        return ""
-    indent_level = calc_indent_level(state)
-    if indent_level < outer_indent_level:
-        state.pos = start
-        return ""
-    if indent_level > outer_indent_level:
-        raise UnexpectedIndentation("Indentation should only follow environments")
-    return (
-        "\n"
-        + empty
-        + parse_block_body(
-            state, outer_indent_level=outer_indent_level, preamble=preamble
+    if out is None:
+        return collect(
+            parse_custom_environment,
+            state,
+            environment=environment,
+            outer_indent_level=outer_indent_level,
         )
+    node = parser.parse_custom_environment(
+        state,
+        environment=environment,
+        outer_indent_level=outer_indent_level,
+        start=state.pos,
     )
+    emit_block(state, [node], out)
 
 
-def parse_block_control(state, outer_indent_level):
+def parse_raw_environment_body(state, outer_indent_level, out=None):
     """
-    precondition: `state.pos` is at a backslash in a block
-    postcondition: `state.pos` is either at the first character following the last
-        argument's closing brace, or at the start of the next non-empty line for
-        indented environments, or at the start of the next line for one-liners
+    precondition: `state.pos` is at the first character following the colon
     """
-    assert state.text[state.pos] == "\\"
-    increment(state)
-    name = parse_control_name(state)
-    if name in state.commands:
-        body = parse_custom_command(state, command=state.commands[name])
-    if name in state.environments:
-        body = parse_custom_environment(
-            state,
-            environment=state.environments[name],
-            outer_indent_level=outer_indent_level,
+    if out is None:
+        return collect(
+            parse_raw_environment_body, state, outer_indent_level=outer_indent_level
         )
-    else:
-        body = parse_native_control(
-            state, name=name, outer_indent_level=outer_indent_level
-        )
-    return body
+    emit_text(state, parser.parse_raw_environment_body(state, outer_indent_level), out)
 
 
-def parse_block_body(state, outer_indent_level, preamble=False):
+def parse_environment_body(state, outer_indent_level, out=None):
     """
-    precondition: `state.pos` is somewhere inside a block
-    postcondition: `state.pos` is at the start of the next non-empty line after the
-        indented block, or at `len(state.text)` if there is no next non-empty line
+    precondition: `state.pos` is at the first character following the colon
+    postcondition: `state.pos` is at the next non-empty line following the indented
+        block, or at the end of the line for one-liners
     """
-    body = parse_until(state, pred=lambda c: c in "\\\n{}%")
-
-    if state.finished():
-        return body
-    if state.text[state.pos] == "\n":
-        return body + parse_block_newline(
-            state, outer_indent_level=outer_indent_level, preamble=preamble
+    if out is None:
+        return collect(
+            parse_environment_body, state, outer_indent_level=outer_indent_level
         )
-    if state.text[state.pos] == "\\":
-        body += parse_block_control(state, outer_indent_level=outer_indent_level)
-        return body + parse_block_body(state, outer_indent_level, preamble)
-    if state.text[state.pos] == "{":
-        increment(state)
-        body += "{" + parse_group(state, end="}") + "}"
-        return body + parse_block_body(
-            state, outer_indent_level=outer_indent_level, preamble=preamble
-        )
-    if state.text[state.pos] == "%":
-        increment(state)
-        body += parse_comment(state)
-        return body + parse_block_body(
-            state, outer_indent_level=outer_indent_level, preamble=preamble
-        )
-    if state.text[state.pos] == "}":
-        raise InvalidSyntax("Unexpected `}`")
-    raise InternalError()
+    emit_body(state, parser.parse_environment_body(state, outer_indent_level), out)
 
 
-def parse_block(state, preamble=False):
+def parse_block(state, preamble=False, out=None):
     """
     precondition: `state.pos` is at the start of a line in the block (typically
         `parse_block` should be called from the line after a colon)
     postcondition: `state.pos` is at the newline after the block; if there are empty
         lines after the block, `state.pos` is before them
     """
-    body = parse_empty(state)
-    if line_is_empty(state):
-        return body
-    if preamble and state.text[state.pos : state.pos + 3] == "===":
-        return body + parse_document(state)
-    outer_indent_level = calc_indent_level(state)
-    return body + parse_block_body(
-        state, outer_indent_level=outer_indent_level, preamble=preamble
-    )
+    if out is None:
+        return collect(parse_block, state, preamble=preamble)
+    nodes = []
+    parser.parse_block(state, nodes, preamble=preamble)
+    emit_block(state, nodes, out)
+
+
+def _common_prefix(a, b):
+    """
+    returns: the length of the longest common prefix of the strings `a` and `b`
+    """
+    # a binary search comparing slices, which is much faster than comparing the strings
+    # character by character in Python
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[lo:mid] == b[lo:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+class _Blocks:
+    """
+    The top-level (i.e. unindented) blocks of the preamble or of the document, as last
+    translated (see `Translator.update`), where a block is an unindented line along
+    with any indented lines after it, and the newline (and any empty lines) after that
+    start: the offset of the first block
+    lengths: the length of each block's source
+    outputs: the translation of each block
+    irregular: for each block, whether it keeps the document from being written out as
+        it stands (see `emit_environment`)
+    """
+
+    __slots__ = ("start", "lengths", "outputs", "irregular")
+
+    def __init__(self, start):
+        self.start = start
+        self.lengths = []
+        self.outputs = []
+        self.irregular = []
+
+    def starts(self):
+        """
+        returns: the offset of the start of each block, followed by the end of the last
+        """
+        return list(accumulate(self.lengths, initial=self.start))
+
+
+def _emit_blocks(state, nodes, start, end):
+    """
+    nodes: the top-level nodes of `state.text[start:end]`, which is the preamble or
+        (after its first newline) the body of the document
+    postcondition: `nodes` are emitted as they would be as part of the whole source,
+        after running their Python blocks (see `run_python_blocks`)
+    returns: the `_Blocks` of `nodes`
+    """
+    blocks = _Blocks(start)
+    block = []
+    run_python_blocks(state, nodes)
+    for node in nodes:
+        block.append(node)
+        if type(node) is Newline or node is nodes[-1]:
+            irregular = state.irregular
+            out = Output()
+            emit_block(state, block, out)
+            blocks.lengths.append((end if node is nodes[-1] else node.end) - start)
+            blocks.outputs.append(out.getvalue())
+            blocks.irregular.append(state.irregular != irregular)
+            start += blocks.lengths[-1]
+            block = []
+    return blocks
+
+
+def _last_boundary(text):
+    """
+    returns: the offset of the start of the last unindented non-empty line of `text`
+        (other than its first), or -1 if there isn't one
+    """
+    i = len(text) - 1
+    while True:
+        i = text.rfind("\n", 0, i)
+        if i == -1:
+            return -1
+        if not text[i + 1].isspace():
+            return i + 1
+
+
+class _DocumentBody:
+    """
+    The body of the document, as its blocks are translated by `translate_stream`,
+    written to `out` as soon as it's known how they end up in the translation
+    """
+
+    # how much of the body is held in memory (when it has to be) before it's held in a
+    # temporary file instead
+    max_held = 1024 * 1024
+
+    def __init__(self, out):
+        self.out = out
+        # whether some block keeps the document from being written out as it stands,
+        # in which case the body is dedented (see `end_document`)
+        self.irregular = False
+        # whether some line of the body is unindented, in which case dedenting it only
+        # empties lines of spaces and tabs
+        self.flat = False
+        # the rest of the body, once a block would change when dedented, since whether
+        # it's dedented is only known at the end
+        self.held = None
+        self.first = ""
+        self.last = ""
+
+    def write(self, text, irregular):
+        self.irregular = self.irregular or irregular
+        if not text:
+            return
+        emptied = empty_space_lines(text)
+        if not self.first and emptied:
+            self.first = emptied[0]
+        if not self.flat and "" in dedent_indents(emptied):
+            self.flat = True
+        # blocks start at the start of a line, so each one is dedented on its own
+        if self.held is None and emptied == text:
+            if self.flat or not any(dedent_indents(text)):
+                self.out.write(text)
+                self.last = text[-1]
+                return
+        if self.held is None:
+            import tempfile
+
+            self.held = tempfile.SpooledTemporaryFile(
+                max_size=self.max_held, mode="w+", encoding="utf-8", newline="\n"
+            )
+        self.held.write(text)
+
+    def _write_held(self):
+        held = self.held
+        held.seek(0)
+        margin = ""
+        if self.irregular and not self.flat:
+            margin = os.path.commonprefix(
+                [
+                    indent
+                    for line in held
+                    for indent in dedent_indents(empty_space_lines(line))
+                ]
+            )
+            held.seek(0)
+        for line in held:
+            if self.irregular:
+                line = empty_space_lines(line)
+                if margin and line.startswith(margin):
+                    line = line[len(margin) :]
+            if line:
+                self.out.write(line)
+                self.last = line[-1]
+        held.close()
+
+    def finish(self):
+        """
+        postcondition: the rest of the body is written to `out`, followed by
+            `\\end{document}`
+        """
+        if self.held is not None:
+            self._write_held()
+        if self.irregular:
+            # as by `preprocess_block`
+            if self.first == "\n" and self.last != "\n":
+                self.out.write("\n")
+        elif self.last != "\n":
+            self.out.write("\n")
+        self.out.write("\\end{document}")
+
+
+class _Stream:
+    """
+    The translation of a source in chunks of whole top-level blocks, by
+    `Translator.translate_stream`
+    """
+
+    def __init__(self, translator, out):
+        self.translator = translator
+        self.out = out
+        self.indent_str = None
+        # the number of the first line of the next chunk
+        self.line = 0
+        # the `_DocumentBody`, once the document has started
+        self.document = None
+
+    def feed(self, text, at_eof):
+        """
+        precondition: `text` is the next run of top-level blocks of the source, ending
+            at the end of the file (if `at_eof`) or else where an unindented line starts
+        postcondition: if the chunk translates to whole top-level blocks on its own, its
+            translation is written out
+        returns: whether it was (which it always is `at_eof`, or an error is raised)
+        """
+        state = self.translator._state(text, indent_str=self.indent_str)
+        try:
+            nodes = self._parse(state, text, at_eof)
+            if nodes is None:
+                return False
+            self._emit(state, nodes, text)
+        except TranslationError as e:
+            state.locate(e)
+            e.line += self.line
+            raise
+        self.indent_str = state.indent_str
+        self.line += text.count("\n")
+        return True
+
+    def _parse(self, state, text, at_eof):
+        lines = state.lines
+        first = lines.next_nonblank(0)
+        if not at_eof and first < len(lines) and lines.widths[first] != 0:
+            # only the source's first line can be indented, and how much of the source
+            # its first block then takes depends on the rest of it, so it's translated
+            # as a whole
+            return None
+        nodes = []
+        try:
+            parser.parse_block(state, nodes, preamble=self.document is None)
+        except TranslationError:
+            if at_eof:
+                raise
+            return None
+        if not at_eof:
+            tail = nodes
+            if nodes and type(nodes[-1]) is Document:
+                tail = nodes[-1].children
+            if not text.endswith("\n"):
+                return None
+            if state.pos < len(text):
+                # the newline the last block ends at, and the empty lines after it
+                tail.append(Newline(state.pos, len(text)))
+            elif first < len(lines):
+                return None
+        return nodes
+
+    def _emit(self, state, nodes, text):
+        document = None
+        if nodes and type(nodes[-1]) is Document:
+            document = nodes.pop()
+        if self.document is None:
+            end = len(text) if document is None else document.start
+            for output in _emit_blocks(state, nodes, 0, end).outputs:
+                self.out.write(output)
+            if document is None:
+                return
+            self.out.write("\\begin{document}")
+            self.document = _DocumentBody(self.out)
+            nodes, start = document.children, document.start
+        else:
+            start = 0
+        state.depth = 1
+        state.margin = ""
+        blocks = _emit_blocks(state, nodes, start, len(text))
+        for output, irregular in zip(blocks.outputs, blocks.irregular):
+            self.document.write(output, irregular)
+
+    def write_plain(self, data, start, end, chunk_size):
+        """
+        precondition: `data[start:end]` (bytes) is a run of plain lines (see
+            `_plain_lines_pattern`) where a top-level block can start, and `self.out` is
+            an `_EncodedOutput`
+        postcondition: the run is written out, copied as it is unless the document has
+            to be held (see `_DocumentBody`), `chunk_size` bytes (or so) at a time
+        """
+        document = self.document
+        while start < end:
+            # cut after a newline, so as not to cut a character in two
+            cut = data.rfind(b"\n", start, min(start + chunk_size, end)) + 1
+            if cut <= start:
+                cut = data.find(b"\n", start, end) + 1
+            piece = data[start:cut]
+            self.line += piece.count(b"\n")
+            if document is None:
+                self.out.write_bytes(piece)
+            elif document.held is None:
+                # as `_DocumentBody.write` would
+                if not document.first:
+                    document.first = chr(piece[0])
+                document.flat = document.flat or bool(piece.strip(b"\n"))
+                self.out.write_bytes(piece)
+                document.last = "\n"
+            else:
+                document.write(piece.decode("utf-8"), irregular=False)
+            start = cut
+
+    def finish(self):
+        if self.document is not None:
+            self.document.finish()
+
+
+class _EncodedOutput:
+    """
+    A binary file object, written to in UTF-8 as if it were a text one
+    """
+
+    def __init__(self, out):
+        self.out = out
+
+    def write(self, text):
+        self.out.write(text.encode("utf-8"))
+
+    def write_bytes(self, data):
+        self.out.write(data)
+
+
+class Translator:
+    """
+    A translation session, for translating many sources (or many versions of the same
+    source) without setting everything up again for each one
+    commands, environments: the custom commands and environments, as overlays over the
+        global ones (so registering one here leaves the global ones as they are, while
+        ones registered globally later are still seen)
+    file_env: the files (by name) that Python sandboxes are created with
+    pyboxes: the Python sandboxes (by Docker image) created so far, which are kept
+        running, and keep their Python state, from one translation to the next
+    pysplice_cache: the `hltex.cache.Cache` Python block outputs are memoized in (see
+        `MemoPybox`), or None to always run them
+    executor: the name of the executor Python blocks are run with (see
+        `hltex.pybox.executors`), or None for the configured one
+    source: the source last translated (or updated)
+    """
+
+    def __init__(self, file_env=None, pysplice_cache=None, executor=None):
+        self.commands = ChainMap({}, commands)
+        self.environments = ChainMap({}, environments)
+        if file_env is None:
+            file_env = {}
+        self.file_env = file_env
+        self.pyboxes = {}
+        self.pysplice_cache = pysplice_cache
+        self.executor = executor
+        self.source = ""
+        # the `_Blocks` of the preamble and of the document (whose first block is its
+        # delimiter and the empty lines after it), or None if the last translation
+        # failed; and where `indent_str` was found in the source
+        self._preamble = None
+        self._document = None
+        self._indent_str = None
+        self._indent_pos = None
+
+    def _state(self, source, indent_str=None):
+        return State(
+            source,
+            indent_str=indent_str,
+            file_env=self.file_env,
+            commands=self.commands,
+            environments=self.environments,
+            pyboxes=self.pyboxes,
+            pysplice_cache=self.pysplice_cache,
+            executor=self.executor,
+        )
 
+    def translate(self, source, concurrent=False):
+        """
+        concurrent: whether to run the Python blocks in the background as soon as
+            they're parsed, while the rest of the source is parsed and translated,
+            rather than as they're translated (see `run_concurrently`)
+        returns: the translation of `source`
+        """
+        self.source = source
+        self._preamble = self._document = None
+        state = self._state(source)
+        if not concurrent:
+            return self._translate(state)
+        run_concurrently(state)
+        try:
+            return self._translate(state)
+        finally:
+            finish_concurrently(state)
+
+    def _translate(self, state):
+        source = state.text
+        try:
+            nodes = parser.parse(state)
+            document = None
+            if nodes and type(nodes[-1]) is Document:
+                document = nodes.pop()
+            end = len(source) if document is None else document.start
+            preamble = _emit_blocks(state, nodes, 0, end)
+            if document is not None:
+                state.depth = 1
+                state.margin = ""
+                document = _emit_blocks(
+                    state, document.children, document.start, len(source)
+                )
+        except TranslationError as e:
+            state.locate(e)
+            raise
+        self._preamble = preamble
+        self._document = document
+        self._indent_str = state.indent_str
+        self._indent_pos = state.indent_pos
+        return self._output(state)
+
+    def update(self, edit_start, edit_end, new_text):
+        """
+        Translates the source again after `self.source[edit_start:edit_end]` is
+        replaced by `new_text`, reusing the translation of every top-level block the
+        edit can't have changed (Python blocks in the blocks translated again are run
+        again, in the sandboxes they were run in before)
+        returns: the translation of the new source
+        """
+        source = self.source[:edit_start] + new_text + self.source[edit_end:]
+        res = None
+        if self._preamble is not None:
+            delta = len(source) - len(self.source)
+            try:
+                res = self._update(source, edit_start, edit_end, delta)
+            except TranslationError:
+                # translated again as a whole, for the error to be located in it
+                pass
+        if res is None:
+            res = self.translate(source)
+        return res
+
+    def update_source(self, source):
+        """
+        Translates `source`, which is `self.source` after some edit, by finding the
+        edit and translating it with `update`
+        returns: the translation of `source`
+        """
+        old = self.source
+        start = _common_prefix(old, source)
+        # the common suffix of what's left after the common prefix
+        suffix = _common_prefix(old[start:][::-1], source[start:][::-1])
+        return self.update(
+            start, len(old) - suffix, source[start : len(source) - suffix]
+        )
 
-def translate(source, file_env=None):
-    state = State(source, file_env=file_env)
-    res = parse_block(state, preamble=True)
-    return res
+    def _update(self, source, edit_start, edit_end, delta):
+        """
+        returns: the translation of `source`, or None if the edit may have changed more
+            than the blocks around it (e.g. where the document starts)
+        """
+        document = self._document
+        if document is not None and edit_end >= document.start:
+            # the document's first block is the delimiter, which must stay as it is
+            blocks, first, preamble = document, 1, False
+            if edit_start < document.start + document.lengths[0]:
+                return None
+        else:
+            blocks, first, preamble = self._preamble, 0, True
+        starts = blocks.starts()
+        count = len(blocks.lengths)
+        if count <= first:
+            return None
+        # The blocks from the one before the edit on are translated again (an edit at
+        # the start of a line may change where the block before it ends), up to the
+        # first block after the edit whose start is still the start of a block
+        edited = min(bisect_right(starts, edit_start) - 1, count - 1)
+        start = max(edited - 1, first)
+        if self._indent_str is not None and self._indent_pos >= starts[start]:
+            return None
+        end = max(bisect_left(starts, edit_end), edited + 1)
+        at_eof = blocks is document or document is None
+        while True:
+            reparsed = self._reparse(
+                source,
+                starts[start],
+                starts[end] + delta,
+                preamble=preamble,
+                at_eof=at_eof and end == count,
+            )
+            if reparsed is not None:
+                break
+            if end == count:
+                return None
+            end = min(end + (end - edited), count)
+        state, new = reparsed
+        blocks.lengths[start:end] = new.lengths
+        blocks.outputs[start:end] = new.outputs
+        blocks.irregular[start:end] = new.irregular
+        if preamble and document is not None:
+            document.start += delta
+        if self._indent_str is None and state.indent_str is not None:
+            self._indent_str = state.indent_str
+            self._indent_pos = starts[start] + state.indent_pos
+        self.source = source
+        return self._output(state)
+
+    def _reparse(self, source, start, end, preamble, at_eof):
+        """
+        precondition: `source[start:end]` is a run of top-level blocks of the preamble
+            (if `preamble`) or of the document, ending at the end of the file (if
+            `at_eof`) or else where an unindented line starts
+        returns: the state `source[start:end]` was translated in and its `_Blocks`, or
+            None if it doesn't translate to whole top-level blocks on its own
+        """
+        text = source[start:end]
+        state = self._state(text, indent_str=self._indent_str)
+        lines = state.lines
+        line = lines.next_nonblank(0)
+        if line < len(lines) and lines.widths[line] != 0:
+            return None
+        if line != 0 and not (preamble and start == 0):
+            return None
+        nodes = []
+        parser.parse_block(state, nodes, preamble=preamble)
+        if any(type(node) is Document for node in nodes):
+            return None
+        if not at_eof:
+            if not text.endswith("\n"):
+                return None
+            if state.pos < len(text):
+                # the newline the last block ends at, and the empty lines after it
+                nodes.append(Newline(state.pos, len(text)))
+            elif line < len(lines):
+                return None
+        if not preamble:
+            state.depth = 1
+            state.margin = ""
+        return state, _emit_blocks(state, nodes, 0, len(text))
+
+    def translate_stream(self, infile, outfile, chunk_size=64 * 1024):
+        """
+        Translates the source read from the file object `infile` to the file object
+        `outfile` a few top-level blocks at a time, so that neither the source nor its
+        translation is held in memory as a whole (except for a document that has to be
+        dedented as a whole, see `end_document`, which is held in a temporary file)
+        chunk_size: how many characters are read at a time
+        postcondition: the translation is written to `outfile`, up to the block an
+            error is raised in, if any; `self.source` is left empty, so `update` can't
+            be used after this
+        """
+        self.source = ""
+        self._preamble = self._document = None
+        stream = _Stream(self, outfile)
+        pieces = []
+        size = 0
+        # how much of the source has to be read before trying to translate it again,
+        # doubled each time it can't be, so that a block spanning many chunks is only
+        # parsed a few times
+        wanted = chunk_size
+        while True:
+            chunk = infile.read(chunk_size)
+            if not chunk:
+                break
+            pieces.append(chunk)
+            size += len(chunk)
+            if size < wanted:
+                continue
+            text = "".join(pieces)
+            boundary = _last_boundary(text)
+            if boundary > 0 and stream.feed(text[:boundary], at_eof=False):
+                pieces = [text[boundary:]]
+                size = len(pieces[0])
+                wanted = chunk_size
+            else:
+                pieces = [text]
+                wanted = 2 * size
+        stream.feed("".join(pieces), at_eof=True)
+        stream.finish()
+
+    def translate_mapped(self, filename, outfile, chunk_size=1024 * 1024):
+        """
+        Translates the UTF-8 file `filename` to the binary file object `outfile` like
+        `translate_stream`, but by memory-mapping the file and scanning its bytes for
+        runs of lines that translate to themselves, which are copied from it as they
+        are, so that only the rest of it is decoded and translated
+        chunk_size: how many bytes are translated (or copied) at a time
+        """
+        self.source = ""
+        self._preamble = self._document = None
+        import mmap
+
+        with open(filename, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                self._translate_mapped(b"", outfile, chunk_size)
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                self._translate_mapped(data, outfile, chunk_size)
+
+    def _translate_mapped(self, data, outfile, chunk_size):
+        stream = _Stream(self, _EncodedOutput(outfile))
+        size = len(data)
+        # a backslash escaping a character is only plain if it isn't a custom command
+        plain = all(name.isalpha() for name in chain(self.commands, self.environments))
+        # the start of what's left, which is always where a top-level block starts
+        pos = 0
+        # where to look for the next run of plain lines from, which is after the end of
+        # the last chunk that didn't translate on its own, since the run may be part of
+        # a block
+        after = 0
+        span = chunk_size
+        while pos < size:
+            if plain and after == pos:
+                match = _plain_lines_pattern.match(data, pos)
+                if match is not None:
+                    stream.write_plain(data, pos, match.end(), chunk_size)
+                    pos = after = match.end()
+                    continue
+            match = None
+            if plain:
+                match = _plain_start_pattern.search(data, after, pos + span)
+            if match is None:
+                match = _boundary_pattern.search(data, pos + span)
+            cut = size if match is None else match.end()
+            text = data[pos:cut].decode("utf-8")
+            if cut == size:
+                stream.feed(text, at_eof=True)
+                break
+            if stream.feed(text, at_eof=False):
+                pos = after = cut
+                span = chunk_size
+            else:
+                # doubled each time, as by `translate_stream`
+                after = cut
+                span = 2 * (cut - pos)
+        else:
+            stream.feed("", at_eof=True)
+        stream.finish()
+
+    def _output(self, state):
+        out = Output()
+        out.extend(self._preamble.outputs)
+        if self._document is not None:
+            mark = out.mark()
+            out.write("\\begin{document}")
+            body = out.mark()
+            out.extend(self._document.outputs)
+            end_document(
+                state, out, mark, body, irregular=any(self._document.irregular)
+            )
+        return out.getvalue()
+
+    def close(self):
+        """
+        postcondition: every Python sandbox created so far is destroyed (later
+            translations create new ones as needed)
+        """
+        while self.pyboxes:
+            _, pybox = self.pyboxes.popitem()
+            pybox.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def translate(
+    source, file_env=None, pysplice_cache=None, executor=None, concurrent=False
+):
+    with Translator(
+        file_env=file_env, pysplice_cache=pysplice_cache, executor=executor
+    ) as translator:
+        return translator.translate(source, concurrent=concurrent)
+
+
+def translate_mapped(
+    filename, outfile, file_env=None, pysplice_cache=None, executor=None
+):
+    """
+    Translates the UTF-8 file `filename` to the binary file object `outfile` (see
+    `Translator.translate_mapped`)
+    """
+    with Translator(
+        file_env=file_env, pysplice_cache=pysplice_cache, executor=executor
+    ) as translator:
+        translator.translate_mapped(filename, outfile)
+
+
+def translate_stream(
+    infile, outfile, file_env=None, pysplice_cache=None, executor=None
+):
+    """
+    Translates the source read from the file object `infile` to the file object
+    `outfile` (see `Translator.translate_stream`)
+    """
+    with Translator(
+        file_env=file_env, pysplice_cache=pysplice_cache, executor=executor
+    ) as translator:
+        translator.translate_stream(infile, outfile)
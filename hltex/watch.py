@@ -0,0 +1,332 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+from .errors import TranslationError
+from .translator import Translator
+
+_IN_MODIFY = 0x2
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+# editors either write files in place or write a new file and rename it over the old one
+_mask = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+# struct inotify_event, without the name that follows it
+_event = struct.Struct("iIII")
+
+extension = ".hltex"
+
+
+class InotifyWatcher:
+    """
+    Watches directories for files written in them with inotify (so only on Linux)
+    """
+
+    def __init__(self, directories):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.libc = libc
+        self.directories = {}
+        try:
+            for directory in directories:
+                self.add(directory)
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def add(self, directory):
+        """
+        postcondition: files written in `directory` are watched too
+        """
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), _mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed", directory)
+        self.directories[wd] = directory
+
+    def read(self, timeout=None):
+        """
+        returns: the paths of the files written within `timeout` seconds (or as soon as
+            any are written if `timeout` is None), which may be empty
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        data = os.read(self.fd, 64 * 1024)
+        paths = set()
+        pos = 0
+        while pos < len(data):
+            wd, _, _, length = _event.unpack_from(data, pos)
+            pos += _event.size
+            name = data[pos : pos + length].rstrip(b"\0")
+            pos += length
+            if name and wd in self.directories:
+                paths.add(os.path.join(self.directories[wd], os.fsdecode(name)))
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """
+    Watches directories for files written in them by checking the modification time
+    and size of every file in them every `interval` seconds
+    """
+
+    def __init__(self, directories, interval=0.25):
+        self.directories = list(directories)
+        self.interval = interval
+        self.snapshot = self._scan()
+
+    def add(self, directory):
+        """
+        postcondition: files written in `directory` are watched too, starting with
+            those already in it, which are reported as written at the next `read`
+        """
+        self.directories.append(directory)
+
+    def _scan(self):
+        snapshot = {}
+        for directory in self.directories:
+            try:
+                entries = list(os.scandir(directory))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                snapshot[os.path.join(directory, entry.name)] = (
+                    stat.st_mtime_ns,
+                    stat.st_size,
+                )
+        return snapshot
+
+    def read(self, timeout=None):
+        """
+        returns: as for `InotifyWatcher.read`
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.interval
+            if deadline is not None:
+                wait = min(wait, max(deadline - time.monotonic(), 0))
+            time.sleep(wait)
+            snapshot = self._scan()
+            paths = {
+                path
+                for path, stat in snapshot.items()
+                if self.snapshot.get(path) != stat
+            }
+            self.snapshot = snapshot
+            if paths or (deadline is not None and time.monotonic() >= deadline):
+                return paths
+
+    def close(self):
+        pass
+
+
+def make_watcher(directories, interval=0.25):
+    """
+    returns: an InotifyWatcher for `directories`, or a PollingWatcher where inotify
+        isn't available
+    """
+    try:
+        return InotifyWatcher(directories)
+    except (OSError, AttributeError, TypeError):
+        # AttributeError where libc has no inotify (e.g. macOS), and TypeError where
+        # there is no libc to be found
+        return PollingWatcher(directories, interval=interval)
+
+
+class Sources:
+    """
+    The files being watched: the files given, and the `.hltex` files in (any
+    subdirectory of) the directories given
+    """
+
+    def __init__(self, paths):
+        self.files = set()
+        self.roots = []
+        for path in paths:
+            path = os.path.abspath(path)
+            if os.path.isdir(path):
+                self.roots.append(path)
+            else:
+                self.files.add(path)
+
+    def directories(self):
+        """
+        returns: every directory a watched file is (or may be created) in
+        """
+        directories = {os.path.dirname(path) for path in self.files}
+        for root in self.roots:
+            for directory, _, _ in os.walk(root):
+                directories.add(directory)
+        return sorted(directories)
+
+    def __contains__(self, path):
+        path = os.path.abspath(path)
+        if path in self.files:
+            return True
+        return path.endswith(extension) and any(
+            path.startswith(os.path.join(root, "")) for root in self.roots
+        )
+
+    def __iter__(self):
+        """
+        yields: every watched file that exists
+        """
+        paths = set(self.files)
+        for root in self.roots:
+            for directory, _, names in os.walk(root):
+                paths.update(
+                    os.path.join(directory, name)
+                    for name in names
+                    if name.endswith(extension)
+                )
+        return iter(sorted(path for path in paths if os.path.isfile(path)))
+
+
+def default_output(filename):
+    """
+    returns: where the translation of `filename` is written by default, as by `hltex
+        FILE` (its basename with the `.tex` extension, in the working directory)
+    """
+    return os.path.splitext(os.path.basename(filename))[0] + ".tex"
+
+
+class Builder:
+    """
+    Translates files again as they change, keeping a Translator for each file, so that
+    its Python sandboxes stay alive and only the blocks around an edit are translated
+    again (see `Translator.update`)
+    output: a function from a file to where its translation is written
+    pysplice_cache: as for `Translator`
+    """
+
+    def __init__(self, output=default_output, pysplice_cache=None):
+        self.output = output
+        self.pysplice_cache = pysplice_cache
+        self.translators = {}
+
+    def build(self, filename):
+        """
+        postcondition: the translation of `filename` is written to its output
+        returns: the path of the output
+        """
+        with open(filename, "r") as f:
+            source = f.read()
+        translator = self.translators.get(filename)
+        if translator is None:
+            translator = Translator(pysplice_cache=self.pysplice_cache)
+            self.translators[filename] = translator
+        res = translator.update_source(source)
+        out = self.output(filename)
+        directory = os.path.dirname(out)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(out, "w") as f:
+            f.write(res)
+        return out
+
+    def close(self):
+        for translator in self.translators.values():
+            translator.close()
+        self.translators.clear()
+
+
+def rebuild(builder, filenames, log=None):
+    """
+    postcondition: every file in `filenames` is translated again, reporting errors and
+        how long it took to `log`
+    """
+    if log is None:
+        log = sys.stderr
+    begin = time.perf_counter()
+    built = []
+    for filename in filenames:
+        name = os.path.relpath(filename)
+        try:
+            builder.build(filename)
+        # e.g. deleted since it was written, or saved in another encoding than UTF-8
+        except (TranslationError, OSError, UnicodeDecodeError) as e:
+            print("{}: {}".format(name, e), file=log)
+        else:
+            built.append(name)
+    elapsed = (time.perf_counter() - begin) * 1000
+    print(
+        "[{}] Rebuilt {} of {} file(s) in {:.1f} ms{}".format(
+            time.strftime("%H:%M:%S"),
+            len(built),
+            len(filenames),
+            elapsed,
+            ": " + ", ".join(built) if built else "",
+        ),
+        file=log,
+    )
+
+
+def _written(paths, sources, watcher, watched):
+    """
+    paths: paths written, as read from `watcher`
+    watched: the directories `watcher` watches
+    postcondition: directories created under the roots of `sources` since they were
+        last watched are watched too, and added to `watched`
+    returns: the watched files among `paths`, along with the watched files already in
+        the directories that were just added (which may have been written before they
+        were watched)
+    """
+    written = {path for path in paths if path in sources}
+    if not any(os.path.isdir(path) for path in paths - written):
+        return written
+    added = set()
+    for directory in sources.directories():
+        if directory not in watched:
+            try:
+                watcher.add(directory)
+            except OSError:  # e.g. removed since it was created
+                continue
+            watched.add(directory)
+            added.add(directory)
+    if added:
+        written.update(path for path in sources if os.path.dirname(path) in added)
+    return written
+
+
+def watch(paths, builder, delay=0.05, interval=0.25, log=None):
+    """
+    Translates the files in `paths` (see `Sources`), and then every one of them that's
+    written, until interrupted
+    delay: how long to wait after a file is written for more files to be written, so
+        that a burst of saves is rebuilt once
+    interval: how often to check for changes where inotify isn't available
+    """
+    if log is None:
+        log = sys.stderr
+    sources = Sources(paths)
+    watched = set(sources.directories())
+    watcher = make_watcher(sorted(watched), interval=interval)
+    try:
+        rebuild(builder, list(sources), log=log)
+        while True:
+            changed = _written(watcher.read(), sources, watcher, watched)
+            while changed:
+                more = _written(watcher.read(delay), sources, watcher, watched)
+                if not more:
+                    break
+                changed |= more
+            if changed:
+                rebuild(builder, sorted(changed), log=log)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        builder.close()
@@ -1,11 +1,16 @@
+import re
+
 import setuptools
 
 with open("readme.md", "r") as fh:
     long_description = fh.read()
 
+with open("hltex/__init__.py", "r") as fh:
+    version = re.search(r'__version__ = "(.*)"', fh.read()).group(1)
+
 setuptools.setup(
     name="hltex",
-    version="0.0.4",
+    version=version,
     author="Alex Gajewski & Wanqi Zhu",
     author_email="agajews@gmail.com",
     description="A compiler for HLTeX, a higher-level language on top of LaTeX",
@@ -20,7 +25,7 @@ setuptools.setup(
     ],
     # scripts=['scripts/hltex'],
     entry_points = {
-        'console_scripts': ['hltex=hltex.cli:_translate'],
+        'console_scripts': ['hltex=hltex.cli:main'],
     },
     install_requires=['hlbox', 'click'],
 )
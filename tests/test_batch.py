@@ -0,0 +1,91 @@
+import io
+import os
+
+from hltex.batch import expand, output_paths, run
+
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def test_expand(tmp_path):
+    root = str(tmp_path)
+    for name in ["a.hltex", "b.hltex", "c.txt", "sub/d.hltex", "sub/deeper/e.hltex"]:
+        write(os.path.join(root, name), "")
+    files, missing = expand(
+        [
+            os.path.join(root, "sub"),
+            os.path.join(root, "*.hltex"),
+            os.path.join(root, "c.txt"),
+            os.path.join(root, "a.hltex"),
+            os.path.join(root, "missing.hltex"),
+            os.path.join(root, "*.tex"),
+        ]
+    )
+    assert [os.path.relpath(path, root) for path in files] == [
+        os.path.join("sub", "d.hltex"),
+        os.path.join("sub", "deeper", "e.hltex"),
+        "a.hltex",
+        "b.hltex",
+        "c.txt",
+    ]
+    assert missing == [os.path.join(root, "missing.hltex"), os.path.join(root, "*.tex")]
+    files, _ = expand([os.path.join(root, "**", "*.hltex")])
+    assert len(files) == 4
+
+
+def test_output_paths(tmp_path):
+    files = [
+        str(tmp_path / "docs" / "a.hltex"),
+        str(tmp_path / "docs" / "sub" / "b.hltex"),
+    ]
+    assert output_paths(files) == [
+        str(tmp_path / "docs" / "a.tex"),
+        str(tmp_path / "docs" / "sub" / "b.tex"),
+    ]
+    assert output_paths(files, "build") == [
+        os.path.join("build", "a.tex"),
+        os.path.join("build", "sub", "b.tex"),
+    ]
+    assert output_paths(files[1:], "build", root=str(tmp_path)) == [
+        os.path.join("build", "docs", "sub", "b.tex")
+    ]
+
+
+def batch(tmp_path, jobs):
+    root = str(tmp_path / "docs")
+    write(os.path.join(root, "a.hltex"), "\\it: a")
+    write(os.path.join(root, "sub", "b.hltex"), "\\it:\n  a\n b")
+    write(os.path.join(root, "sub", "c.hltex"), "===\nc")
+    files, _ = expand([root])
+    out_dir = str(tmp_path / "build")
+    log = io.StringIO()
+    status = run(
+        files, output_paths(files, out_dir), jobs=jobs, use_cache=False, log=log
+    )
+    assert status == 1
+    assert read(os.path.join(out_dir, "a.tex")) == "\\begin{it}a\\end{it}"
+    assert read(os.path.join(out_dir, "sub", "c.tex")) == (
+        "\\begin{document}\nc\n\\end{document}"
+    )
+    assert not os.path.exists(os.path.join(out_dir, "sub", "b.tex"))
+    log = log.getvalue()
+    assert "Translated 2 of 3 file(s)" in log
+    assert "b.hltex FAILED: InvalidIndentation: line 3" in log
+    assert "Slowest:" in log
+    assert "Exit status: 1" in log
+
+
+def test_run(tmp_path):
+    batch(tmp_path, jobs=1)
+
+
+def test_run_parallel(tmp_path):
+    batch(tmp_path, jobs=2)
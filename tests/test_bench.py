@@ -0,0 +1,61 @@
+from hltex.bench import e2e, micro
+from hltex.bench.corpus import generate, scale, without_pysplice
+from hltex.bench.results import compare, load, results, save
+from hltex.translator import translate
+
+
+def test_generate():
+    source = generate(seed=1, size=5000, depth=6)
+    assert source == generate(seed=1, size=5000, depth=6)
+    assert source != generate(seed=2, size=5000, depth=6)
+    assert len(source) >= 5000
+    assert "\n" + " " * 4 * 6 in source
+    translate(source)
+
+
+def test_generate_pysplice():
+    source = generate(size=5000, pysplice=3)
+    assert source.count("\\pysplice:") == 3
+    stripped = without_pysplice(source)
+    assert "pysplice" not in stripped
+    assert "print(" not in stripped
+    translate(stripped)
+
+
+def test_scale():
+    assert scale("a\n===\nb", 3) == "a\n===\nb\nb\nb\n"
+    assert scale("a\n", 2) == "a\na\n"
+
+
+def test_micro():
+    timings = list(micro.run(size=200, repeat=1))
+    assert [name for name, _, _ in timings] == list(micro.BENCHMARKS) + [
+        "lexer",
+        "line_table",
+    ]
+    assert all(chars > 100 and seconds > 0 for _, chars, seconds in timings)
+
+
+def test_e2e():
+    names = [
+        name
+        for name, _, _ in e2e.run(
+            size=500, scales=(2,), repeat=1, only=lambda name: "deep" not in name
+        )
+    ]
+    assert "corpus" in names
+    assert "corpus_update" in names
+    assert "corpus_deep" not in names
+
+
+def test_compare(tmp_path):
+    path = str(tmp_path / "baseline.json")
+    save(results([("a", 10, 1.0), ("b", 10, 1.0), ("c", 10, 1.0)]), path)
+    baseline = load(path)
+    baseline["thresholds"] = {"b": 1.0}
+    res = results([("a", 10, 1.5), ("b", 10, 1.5), ("d", 10, 1.0)])
+    assert compare(res, baseline) == [
+        ("a", 1.0, 1.5, 1.5, True),
+        ("b", 1.0, 1.5, 1.5, False),
+    ]
+    assert compare(res, baseline, threshold=0.6)[0][-1] is False
@@ -250,3 +250,11 @@ def test_onliner_stacked():
         == "\\begin{equation}\\textbf{Hello}\\end{equation}\n\\begin{equation}f(x)\\end{equation}\n123"
     )
     assert state.pos == len(source)
+
+
+def test_many_lines():
+    source = "\\equation:\n" + "  line\n\n" * 10000 + "123"
+    state = State(source)
+    res = state.run(parse_block)
+    assert res == "\\begin{equation}\n" + "  line\n\n" * 9999 + "  line\n\\end{equation}\n\n123"
+    assert state.pos == len(source)
@@ -0,0 +1,61 @@
+import os
+from functools import partial
+
+from hltex.cache import Cache
+from hltex.control import Command, commands
+
+
+def test_get_put(tmp_path):
+    cache = Cache(str(tmp_path / "cache"))
+    key = cache.key("\\it: a")
+    assert cache.get(key) is None
+    cache.put(key, "\\begin{it}a\\end{it}\r\n")
+    assert cache.get(key) == "\\begin{it}a\\end{it}\r\n"
+    assert Cache(str(tmp_path / "cache")).get(key) == "\\begin{it}a\\end{it}\r\n"
+
+
+def test_key():
+    key = Cache.key("a")
+    assert Cache.key("a") == key
+    assert Cache.key("b") != key
+    assert Cache.key("a", file_env={"data.txt": "1"}) != key
+    assert Cache.key("a", file_env={"data.txt": "1"}) != Cache.key(
+        "a", file_env={"data.txt": "2"}
+    )
+    with_command = dict(commands, foo=Command("foo", lambda state: "", ""))
+    assert Cache.key("a", commands=with_command) != key
+    with_partial = dict(commands, foo=Command("foo", partial(str.upper, "x"), ""))
+    other_partial = dict(commands, foo=Command("foo", partial(str.upper, "y"), ""))
+    assert Cache.key("a", commands=with_partial) == Cache.key(
+        "a", commands=with_partial
+    )
+    assert Cache.key("a", commands=with_partial) != Cache.key(
+        "a", commands=other_partial
+    )
+
+
+def test_evict(tmp_path):
+    cache = Cache(str(tmp_path), max_size=35)
+    for i, key in enumerate(["a", "b", "c"]):
+        cache.put(key, "0123456789")
+        os.utime(cache._path(key), ns=(i, i))  # pylint: disable=protected-access
+    assert cache.get("a") == "0123456789"
+    cache.put("d", "0123456789")
+    assert cache.get("b") is None
+    assert cache.get("c") == "0123456789"
+    assert cache.get("a") == "0123456789"
+    assert cache.get("d") == "0123456789"
+
+
+def test_stats_clear(tmp_path):
+    cache = Cache(str(tmp_path / "cache"), max_size=100)
+    assert cache.stats()["entries"] == 0
+    cache.put("a", "0123456789")
+    cache.put("b", "01234")
+    stats = cache.stats()
+    assert stats["entries"] == 2
+    assert stats["size"] == 15
+    assert stats["max_size"] == 100
+    assert cache.clear() == 2
+    assert cache.stats()["entries"] == 0
+    assert cache.get("a") is None
@@ -0,0 +1,113 @@
+import os
+
+import pytest
+
+from hltex import watch
+
+click_testing = pytest.importorskip("click.testing")
+
+from hltex.cli import main  # pylint: disable=wrong-import-position
+
+random_source = (
+    "\\pysplice:\n"
+    "    import random\n"
+    "    # hltex: no-cache\n"
+    "    print(random.random())\n"
+)
+
+
+@pytest.fixture
+def cli(tmp_path, monkeypatch):
+    """
+    returns: a function running the CLI with some arguments in `tmp_path` (with the
+        caches in it too, and Python blocks run without Docker), returning its result
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setenv("HLTEX_EXECUTOR", "local")
+    runner = click_testing.CliRunner()
+
+    def run(*args, status=0):
+        result = runner.invoke(main, list(args), catch_exceptions=False)
+        assert result.exit_code == status, result.output
+        return result
+
+    return run
+
+
+def write(path, text, newline=None):
+    with open(path, "w", newline=newline) as f:
+        f.write(text)
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read().decode("utf-8")
+
+
+def test_no_cache_python(cli):
+    write("random.hltex", random_source)
+    cli("random.hltex")
+    first = read("random.tex")
+    cli("random.hltex")
+    assert read("random.tex") != first
+    os.mkdir("out")
+    cli("random.hltex", "--out-dir", "out")
+    assert read("out/random.tex") not in (first, read("random.tex"))
+
+
+def test_cache(cli):
+    write("plain.hltex", "\\it: a\n")
+    cli("plain.hltex")
+    assert read("plain.tex") == "\\begin{it}a\\end{it}"
+    write("plain.tex", "")
+    cli("plain.hltex")
+    assert read("plain.tex") == "\\begin{it}a\\end{it}"
+    assert os.listdir(os.path.join("cache", "hltex"))
+
+
+def test_crlf(cli):
+    write("crlf.hltex", "\\it: a\n\n\\begin{b}\nc\n\\end{b}\n", newline="\r\n")
+    cli("crlf.hltex")
+    expected = read("crlf.tex")
+    assert "\r" not in expected
+    cli("crlf.hltex", "--no-cache")
+    assert read("crlf.tex") == expected
+    assert cli("crlf.hltex", "--out", "-").output == expected
+
+
+def test_unopenable_out(cli):
+    write("plain.hltex", "\\it: a\n")
+    os.mkdir("plain.tex")
+    for out in ["missing/plain.tex", "plain.tex"]:
+        with pytest.raises(OSError) as excinfo:
+            cli("plain.hltex", "--no-cache", "--out", out)
+        # the error opening it, rather than one removing it
+        assert excinfo.value.filename == out
+        assert excinfo.value.__context__ is None
+    assert os.path.isdir("plain.tex")
+
+
+def test_watch(cli, monkeypatch):
+    # translating the files once, instead of until interrupted
+    monkeypatch.setattr(
+        watch,
+        "watch",
+        lambda paths, builder: watch.rebuild(builder, list(watch.Sources(paths))),
+    )
+    for directory in ("a", "b"):
+        os.mkdir(directory)
+        write(os.path.join(directory, "doc.hltex"), "\\it: " + directory)
+    cli("a", "b", "--watch", "--out-dir", "out")
+    assert read("out/a/doc.tex") == "\\begin{it}a\\end{it}"
+    assert read("out/b/doc.tex") == "\\begin{it}b\\end{it}"
+    cli("a", "b", "--watch")
+    assert read("a/doc.tex") == "\\begin{it}a\\end{it}"
+    assert read("b/doc.tex") == "\\begin{it}b\\end{it}"
+    result = cli("a", "--watch", "--jobs", "2", status=2)
+    assert "--jobs and --slowest don't work with --watch" in result.output
+
+
+def test_serve_local(cli):
+    result = cli("serve", status=2)
+    assert "local executor" in result.output
@@ -2,43 +2,18 @@ import pytest
 
 from hltex.errors import InvalidIndentation
 from hltex.indentation import (
+    MIXED,
+    NO_INDENT,
+    SPACES,
+    TABS,
+    LineTable,
     calc_indent_level,
-    level_of_indent,
     line_is_empty,
-    validate_indent,
+    parse_empty,
 )
 from hltex.state import State
 
 
-def test_validate_indent_good():
-    state = State("", indent_str="    ")
-    validate_indent(state, "    ")
-    state = State("", indent_str="\t\t\t\t")
-    validate_indent(state, "\t\t\t\t")
-    state = State("", indent_str="    ")
-    validate_indent(state, "")
-
-
-def test_validate_indent_bad():
-    state = State("", indent_str="    ")
-    with pytest.raises(InvalidIndentation) as excinfo:
-        validate_indent(state, "    \t")
-    assert "Indentation must be all spaces or all tabs" in excinfo.value.msg
-    with pytest.raises(InvalidIndentation) as excinfo:
-        validate_indent(state, "   ")
-    assert (
-        "Indentation must be in multiples of the base indentation" in excinfo.value.msg
-    )
-
-
-def test_level_of_indent():
-    state = State("", indent_str="    ")
-    assert level_of_indent(state, "        ") == 2
-    assert level_of_indent(state, "") == 0
-    state = State("", indent_str="\t\t")
-    assert level_of_indent(state, "\t\t\t\t") == 2
-
-
 def test_calc_indent_level():
     source = """    hi"""
     state = State(source, indent_str="    ")
@@ -113,3 +88,54 @@ def test_line_is_empty_not():
     state = State(source)
     assert not line_is_empty(state)
     assert state.pos == 0
+
+
+def test_calc_indent_level_mixed():
+    source = """hi\n \thi"""
+    state = State(source, pos=3)
+    with pytest.raises(InvalidIndentation) as excinfo:
+        calc_indent_level(state)
+    assert "Indentation must be all spaces or all tabs" in excinfo.value.msg
+    assert excinfo.value.line == 1
+
+
+def test_calc_indent_level_bad_line():
+    source = """hi\n    hi\n\n   hi"""
+    state = State(source, pos=3)
+    assert calc_indent_level(state) == 1
+    state.pos = 11
+    with pytest.raises(InvalidIndentation) as excinfo:
+        calc_indent_level(state)
+    assert excinfo.value.line == 3
+
+
+def test_line_table():
+    lines = LineTable("hi\n  \n    there\n\t\tx\n \tx\n")
+    assert list(lines.starts) == [0, 3, 6, 16, 20, 24]
+    assert list(lines.widths) == [0, 2, 4, 2, 2, 0]
+    assert list(lines.kinds) == [NO_INDENT, SPACES, SPACES, TABS, MIXED, NO_INDENT]
+    assert list(lines.blank) == [0, 1, 0, 0, 0, 1]
+    assert list(lines.nonblank) == [0, 2, 3, 4]
+    assert lines.next_nonblank(1) == 2
+    assert lines.next_nonblank(5) == len(lines) == 6
+
+
+def test_parse_empty():
+    source = """  \n\t\n\n  123"""
+    state = State(source)
+    assert parse_empty(state) == "  \n\t\n\n"
+    assert source[state.pos] == " "
+
+
+def test_parse_empty_not_empty():
+    source = """  123\n"""
+    state = State(source)
+    assert parse_empty(state) == ""
+    assert state.pos == 0
+
+
+def test_parse_empty_eof():
+    source = """123\n  \n  """
+    state = State(source, pos=3)
+    assert parse_empty(state) == "\n  \n  "
+    assert state.pos == len(source)
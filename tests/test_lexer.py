@@ -0,0 +1,86 @@
+from hltex.lexer import (
+    CLOSE_BRACE,
+    CLOSE_BRACKET,
+    COLON,
+    COMMENT,
+    CONTROL,
+    DELIMITER,
+    END,
+    NEWLINE,
+    OPEN_BRACE,
+    OPEN_BRACKET,
+    TEXT,
+    Tokens,
+)
+
+
+def test_kinds():
+    tokens = Tokens("\\a{b}[c]%d:\n\\")
+    assert list(tokens.kinds) == [
+        CONTROL,
+        OPEN_BRACE,
+        CLOSE_BRACE,
+        OPEN_BRACKET,
+        CLOSE_BRACKET,
+        COMMENT,
+        COLON,
+        NEWLINE,
+        CONTROL,
+    ]
+    assert list(tokens.starts) == [0, 2, 4, 5, 7, 8, 10, 11, 12]
+    assert list(tokens.ends) == [2, 3, 5, 6, 8, 9, 11, 12, 13]
+
+
+def test_control_names():
+    tokens = Tokens("\\alpha2\\\\")
+    assert list(zip(tokens.kinds, tokens.starts, tokens.ends)) == [
+        (CONTROL, 0, 6),
+        (CONTROL, 7, 8),
+        (CONTROL, 8, 9),
+    ]
+
+
+def test_iter():
+    assert list(Tokens("ab{cd}ef")) == [
+        (TEXT, 0, 2),
+        (OPEN_BRACE, 2, 3),
+        (TEXT, 3, 5),
+        (CLOSE_BRACE, 5, 6),
+        (TEXT, 6, 8),
+    ]
+    assert list(Tokens("")) == []
+    assert len(Tokens("ab{cd}ef")) == 2
+
+
+def test_delimiter():
+    tokens = Tokens("a\n===\nb ===\n====")
+    assert list(tokens) == [
+        (TEXT, 0, 1),
+        (NEWLINE, 1, 2),
+        (DELIMITER, 2, 5),
+        (NEWLINE, 5, 6),
+        (TEXT, 6, 11),
+        (NEWLINE, 11, 12),
+        (DELIMITER, 12, 16),
+    ]
+    assert tokens.kind_at(2) == DELIMITER
+    assert tokens.kind_at(8) == TEXT
+    assert tokens.end_at(12) == 16
+
+
+def test_kind_at():
+    tokens = Tokens("\\ab{")
+    assert tokens.kind_at(0) == CONTROL
+    assert tokens.kind_at(1) == TEXT
+    assert tokens.kind_at(3) == OPEN_BRACE
+    assert tokens.kind_at(4) == END
+    assert tokens.end_at(0) == 3
+
+
+def test_find():
+    tokens = Tokens("a}b\nc}d")
+    stops = frozenset((CLOSE_BRACE, NEWLINE))
+    assert tokens.find(0, stops) == (1, CLOSE_BRACE)
+    assert tokens.find(2, stops) == (3, NEWLINE)
+    assert tokens.find(4, frozenset((NEWLINE,))) == (7, END)
+    assert tokens.find(6, stops) == (7, END)
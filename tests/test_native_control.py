@@ -78,3 +78,49 @@ def test_env():
         == "\\begin{something}{arg1}{arg2}\n    some words\n\\end{something}"
     )
     assert state.pos == len(source)
+
+
+def test_env_nested_empty_lines():
+    source = ":\n    a\n      \n    \\b:\n        c\n    \t\n        d\n    e"
+    state = State(source)
+    assert (
+        state.run(parse_native_control, name="a", outer_indent_level=0)
+        == "\\begin{a}\n    a\n\n    \\begin{b}\n        c\n\n        d\n    \\end{b}\n    e\n\\end{a}"
+    )
+    assert state.pos == len(source)
+
+
+def test_env_less_indented_group():
+    source = ":\n    a{x\n  y}\n    b"
+    state = State(source)
+    assert (
+        state.run(parse_native_control, name="a", outer_indent_level=0)
+        == "\\begin{a}\n      a{x\n    y}\n      b\n\\end{a}"
+    )
+
+
+def test_env_other_indentation_character():
+    source = ":\n\t\tb\n  c"
+    state = State(source, indent_str="  ")
+    assert (
+        state.run(parse_native_control, name="a", outer_indent_level=0)
+        == "\\begin{a}\n  \t\tb\n    c\n\\end{a}"
+    )
+
+
+def test_env_in_one_liner():
+    source = ": \\b:\n    c"
+    state = State(source)
+    assert (
+        state.run(parse_native_control, name="a", outer_indent_level=0)
+        == "\\begin{a}\\begin{b}\n    c\n\\end{b}\\end{a}"
+    )
+
+
+def test_env_escaped_newline():
+    source = ":\n    a\\\n  x"
+    state = State(source)
+    assert (
+        state.run(parse_native_control, name="a", outer_indent_level=0)
+        == "\\begin{a}\n      a\\\n    x\n\\end{a}"
+    )
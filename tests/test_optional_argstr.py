@@ -109,3 +109,20 @@ def test_control_both_args_unexpected():
     with pytest.raises(InvalidSyntax) as excinfo:
         state.run(parse_optional_argstr)
     assert "Unexpected `}`" in excinfo.value.msg
+
+
+def test_missing_remembered():
+    source = "a[b]c{d}e\n]"
+    state = State(source)
+    assert state.run(parse_optional_argstr) is None
+    assert state.unclosed_argstrs == {0, 4, 8}
+    state.pos = 4
+    assert state.run(parse_optional_argstr) is None
+    assert state.pos == 4
+
+
+def test_missing_repeated():
+    source = "[\\x []" * 1000
+    state = State(source)
+    assert state.run(parse_optional_argstr) is None
+    assert len(state.unclosed_argstrs) == 1001
@@ -0,0 +1,74 @@
+import io
+
+from hltex.output import Output, collect
+from hltex.state import State
+from hltex.translator import parse_group, parse_optional_argstr
+
+
+def test_write():
+    out = Output()
+    out.write("some")
+    out.write("thing")
+    assert out.getvalue() == "something"
+
+
+def test_truncate():
+    out = Output()
+    out.write("some")
+    mark = out.mark()
+    out.write("thing")
+    out.truncate(mark)
+    assert out.getvalue() == "some"
+
+
+def test_endswith():
+    out = Output()
+    out.write("some\n")
+    mark = out.mark()
+    assert not out.endswith("\n", mark)
+    out.write("")
+    assert out.endswith("\n")
+    out.write("thing")
+    assert not out.endswith("\n")
+    assert out.endswith("g", mark)
+
+
+def test_writeto():
+    out = Output()
+    out.write("some")
+    out.write("thing")
+    f = io.StringIO()
+    out.writeto(f)
+    assert f.getvalue() == "something"
+
+
+def test_parse_into():
+    source = "some{thi}ng}123"
+    state = State(source)
+    out = Output()
+    out.write("before ")
+    parse_group(state, end="}", out=out)
+    assert out.getvalue() == "before some{thi}ng"
+    assert source[state.pos] == "1"
+
+
+def test_collect():
+    source = "some{thi}ng}123"
+    state = State(source)
+    assert collect(parse_group, state, end="}") == "some{thi}ng"
+
+
+def test_collect_missing():
+    source = "some{thi}ng\n]123"
+    state = State(source)
+    assert collect(parse_optional_argstr, state) is None
+    assert state.pos == 0
+
+
+def test_missing_writes_nothing():
+    source = "some{thi}ng\n]123"
+    state = State(source)
+    out = Output()
+    out.write("before")
+    assert parse_optional_argstr(state, out=out) is False
+    assert out.getvalue() == "before"
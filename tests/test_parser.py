@@ -0,0 +1,109 @@
+from hltex.control import Command
+from hltex.nodes import (
+    Body,
+    Comment,
+    Control,
+    Document,
+    Environment,
+    Group,
+    Newline,
+    Text,
+)
+from hltex.parser import parse, parse_arg_control, parse_argstr, parse_group
+from hltex.state import State
+
+
+def test_text_spans():
+    source = "ab{cd}%ef"
+    state = State(source)
+    nodes = parse(state)
+    assert [(type(node), node.start, node.end) for node in nodes] == [
+        (Text, 0, 2),
+        (Group, 2, 6),
+        (Comment, 6, 9),
+    ]
+    assert [(type(node), node.start, node.end) for node in nodes[1].children] == [
+        (Text, 3, 5)
+    ]
+
+
+def test_group():
+    source = "a\\b{c}]1"
+    state = State(source)
+    nodes = state.run(parse_group, end="]")
+    assert [type(node) for node in nodes] == [Text, Text, Group]
+    assert (nodes[1].start, nodes[1].end) == (1, 3)
+    assert source[state.pos] == "1"
+
+
+def test_command():
+    source = "\\x{a}[b]1"
+    state = State(source)
+    state.commands["x"] = Command("x", lambda _state, a, b: a + b, "!?")
+    state.pos = 1
+    node = state.run(parse_arg_control)
+    assert (node.start, node.end) == (0, 8)
+    assert node.command is state.commands["x"]
+    assert [(arg.start, arg.end) for arg in node.args] == [(2, 5), (5, 8)]
+    assert source[state.pos] == "1"
+
+
+def test_argstr():
+    source = " {a} [b] [c"
+    state = State(source)
+    nodes = state.run(parse_argstr)
+    assert [(type(node), node.start, node.end) for node in nodes] == [
+        (Text, 0, 1),
+        (Group, 1, 4),
+        (Text, 4, 5),
+        (Group, 5, 8),
+    ]
+    assert state.pos == 8
+
+
+def test_environment():
+    source = "\\a{b}:\n    c\n\n    \\d\ne"
+    state = State(source)
+    env, newline, text = parse(state)
+    assert type(env) is Environment
+    assert (env.start, env.end, env.name, env.level) == (0, 20, "a", 0)
+    assert [type(node) for node in env.argstr] == [Group]
+    body = env.body
+    assert type(body) is Body
+    assert (body.level, body.comment) == (1, None)
+    assert [(type(node), node.start, node.end) for node in body.children] == [
+        (Newline, 6, 7),
+        (Text, 7, 12),
+        (Newline, 12, 14),
+        (Text, 14, 18),
+        (Control, 18, 20),
+    ]
+    assert (type(newline), newline.start, newline.end) == (Newline, 20, 21)
+    assert (type(text), text.start, text.end) == (Text, 21, 22)
+
+
+def test_oneliner():
+    source = "\\a: b %c\n"
+    state = State(source)
+    (env,) = parse(state)
+    assert env.body.level is None
+    assert [type(node) for node in env.body.children] == [Text, Comment]
+
+
+def test_document():
+    source = "\\a\n===\nb"
+    state = State(source)
+    control, newline, document = parse(state)
+    assert type(control) is Control
+    assert type(newline) is Newline
+    assert type(document) is Document
+    assert (document.start, document.end) == (3, 8)
+    assert [type(node) for node in document.children] == [Newline, Text]
+
+
+def test_slots():
+    state = State("a{b}")
+    (text, group) = parse(state)
+    assert not hasattr(text, "__dict__")
+    assert not hasattr(group, "__dict__")
+    assert not hasattr(state, "__dict__")
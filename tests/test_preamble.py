@@ -1,5 +1,6 @@
 import pytest
 
+from hltex import emitter
 from hltex.errors import InvalidSyntax, UnexpectedEOF, UnexpectedIndentation
 from hltex.state import State
 from hltex.translator import parse_block
@@ -45,6 +46,24 @@ def test_parse_double_newline_after_preamble():
     assert res == "\\documentclass{article}\n\\begin{document}\n\nHey!\n\\end{document}"
 
 
+def test_parse_empty_lines_as_they_stand(monkeypatch):
+    def latex_env(*args, **kwargs):
+        raise AssertionError("the document wasn't written out as it stands")
+
+    monkeypatch.setattr(emitter, "latex_env", latex_env)
+    source = "\\documentclass{article}\n===\nHey!\n\n  \nYou!"
+    state = State(source)
+    res = parse_block(state, preamble=True)
+    assert res == "\\documentclass{article}\n\\begin{document}\nHey!\n\n\nYou!\n\\end{document}"
+
+
+def test_parse_whitespace_lines():
+    source = "\\documentclass{article}\n===\n \x0c\n \x0c"
+    state = State(source)
+    res = parse_block(state, preamble=True)
+    assert res == "\\documentclass{article}\n\\begin{document}\n\x0c\n\x0c\n\\end{document}"
+
+
 def test_missing_document():
     source = "\\documentclass{article}\n==="
     state = State(source)
@@ -0,0 +1,314 @@
+import io
+import os
+import time
+from contextlib import redirect_stdout
+from textwrap import dedent
+
+import pytest
+
+from hltex import pybox
+from hltex.cache import Cache
+from hltex.control import Environment
+from hltex.control.pysplice import translate_pysplice
+from hltex.errors import DependencyError
+from hltex.pybox import MemoPybox, PyboxPool
+from hltex.translator import Translator, translate
+
+
+class FakePybox:
+    """
+    Runs Python blocks in this process, recording every block it runs
+    """
+
+    created = []
+
+    def __init__(
+        self, file_env=None, docker=None, executor=None
+    ):  # pylint: disable=unused-argument
+        self.globals = {}
+        self.ran = []
+        self.batches = []
+        self.tmp_dir = None
+        self.docker = docker
+        self.closed = False
+        FakePybox.created.append(self)
+
+    def run(self, body):
+        self.ran.append(body)
+        out = io.StringIO()
+        with redirect_stdout(out):
+            exec(body, self.globals)  # pylint: disable=exec-used
+        return out.getvalue()
+
+    def run_all(self, bodies):
+        self.batches.append(len(bodies))
+        outputs = []
+        for body in bodies:
+            try:
+                outputs.append(self.run(body))
+            except Exception as e:  # pylint: disable=broad-except
+                return outputs, DependencyError("Python execution failed: " + str(e))
+        return outputs, None
+
+    def fetch_generated_files(self):
+        path = os.path.join(self.tmp_dir, "plot.png")
+        with open(path, "wb") as f:
+            f.write(self.globals["png"])
+        return [path]
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    monkeypatch.setattr(pybox, "Pybox", FakePybox)
+    FakePybox.created = []
+    # so that the sandboxes the tests leave open don't fill up the process-wide pool
+    monkeypatch.setattr(pybox, "_pool", PyboxPool(warm=0))
+
+
+@pytest.fixture
+def cache(tmp_path, fake):  # pylint: disable=unused-argument
+    return Cache(str(tmp_path / "cache"), suffix=".json")
+
+
+def test_frames():
+    frames = pybox._frame({"output": "a\nb"}) + pybox._frame({"error": None})
+    f = io.BytesIO(frames + frames[:5])
+    assert pybox._read_frame(f) == {"output": "a\nb"}
+    assert pybox._read_frame(f) == {"error": None}
+    assert pybox._read_frame(f) is None
+    assert b"\n" not in frames
+
+
+def wait_for(pool, **stats):
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        current = pool.stats()
+        if all(current[name] == value for name, value in stats.items()):
+            return
+        time.sleep(0.01)
+    raise AssertionError(pool.stats())
+
+
+def test_memo(cache):
+    box = MemoPybox(cache)
+    assert box.run("x = 3") == ""
+    assert box.run("print(x)") == "3\n"
+    assert len(FakePybox.created) == 1
+    box = MemoPybox(cache)
+    assert box.run("x = 3") == ""
+    assert box.run("print(x)") == "3\n"
+    assert box.pybox is None
+    assert len(FakePybox.created) == 1
+
+
+def test_memo_chain(cache):
+    box = MemoPybox(cache)
+    box.run("x = 3")
+    box.run("print(x)")
+    box = MemoPybox(cache)
+    box.run("x = 4")
+    assert box.run("print(x)") == "4\n"
+    box = MemoPybox(cache, docker="python")
+    box.run("x = 5")
+    assert box.run("print(x)") == "5\n"
+    box = MemoPybox(cache, file_env={"data.txt": "1"})
+    assert box.run("x = 6; print(x)") == "6\n"
+
+
+def test_memo_replay(cache):
+    MemoPybox(cache).run("x = 3")
+    box = MemoPybox(cache)
+    box.run("x = 3")
+    assert box.pybox is None
+    assert box.run("print(x + 1)") == "4\n"
+    assert box.pybox.pybox.ran == ["x = 3", "print(x + 1)"]
+
+
+def test_no_memo(cache):
+    source = "import random\n# hltex: no-cache\nprint(random.random())"
+    box = MemoPybox(cache)
+    first = box.run(source)
+    box.run("print(1)")
+    box = MemoPybox(cache)
+    assert box.run(source) != first
+    box.run("print(1)")
+    assert box.pybox.pybox.ran == [source, "print(1)"]
+
+
+def test_memo_files(cache, tmp_path):
+    box = MemoPybox(cache)
+    box.run("png = b'\\x89PNG'")
+    box.pybox.pybox.tmp_dir = str(tmp_path)
+    box.fetch_generated_files()
+    box = MemoPybox(cache)
+    box.run("png = b'\\x89PNG'")
+    [path] = box.fetch_generated_files()
+    assert box.pybox is None
+    assert os.path.basename(path) == "plot.png"
+    with open(path, "rb") as f:
+        assert f.read() == b"\x89PNG"
+
+
+def test_translate(cache):
+    source = "\\pysplice:\n    print(3)\n"
+    assert translate(source, pysplice_cache=cache) == "3\n"
+    assert translate(source, pysplice_cache=cache) == "3\n"
+    assert len(FakePybox.created) == 1
+
+
+def test_pool_release(fake):  # pylint: disable=unused-argument
+    pool = PyboxPool(warm=0)
+    box = pool.acquire()
+    assert box.run("print(1)") == "1\n"
+    assert pool.stats() == {"ready": 0, "starting": 0, "live": 1}
+    box.close()
+    box.close()
+    assert FakePybox.created[0].closed
+    assert pool.stats() == {"ready": 0, "starting": 0, "live": 0}
+
+
+def test_pool_warm(fake):  # pylint: disable=unused-argument
+    pool = PyboxPool(warm=2)
+    first = pool.acquire(docker="python")
+    wait_for(pool, ready=2, live=3)
+    second = pool.acquire(docker="python")
+    assert second.pybox in FakePybox.created[1:]
+    assert second.pybox.ran == []
+    # replenished in place of the one handed out
+    wait_for(pool, ready=2, live=4)
+    assert len(FakePybox.created) == 4
+    first.close()
+    second.close()
+    pool.close()
+    assert pool.stats() == {"ready": 0, "starting": 0, "live": 0}
+    assert all(box.closed for box in FakePybox.created)
+    with pytest.raises(DependencyError):
+        pool.acquire(docker="python")
+
+
+def test_pool_ttl(fake):  # pylint: disable=unused-argument
+    pool = PyboxPool(warm=1, ttl=0.2)
+    pool.acquire().close()
+    wait_for(pool, ready=1)
+    # neither kept ready nor started again, once not asked for within the TTL
+    wait_for(pool, ready=0, live=0)
+    time.sleep(0.1)
+    assert len(FakePybox.created) == 2
+    assert all(box.closed for box in FakePybox.created)
+    pool.close()
+
+
+def test_pool_max_live(fake):  # pylint: disable=unused-argument
+    pool = PyboxPool(warm=0, max_live=2, wait=0.1)
+    first = pool.acquire()
+    pool.acquire(file_env={"data.txt": "1"})
+    with pytest.raises(DependencyError):
+        pool.acquire()
+    first.close()
+    pool.acquire()
+    assert pool.stats()["live"] == 2
+
+
+def test_pool_evicts_ready(fake):  # pylint: disable=unused-argument
+    pool = PyboxPool(warm=1, max_live=2)
+    box = pool.acquire(docker="python")
+    wait_for(pool, ready=1, live=2)
+    # the ready sandbox for another image makes room
+    other = pool.acquire(docker="other")
+    assert other.pybox.docker == "other"
+    assert FakePybox.created[1].closed
+    box.close()
+    other.close()
+    pool.close()
+
+
+def test_batch(fake):  # pylint: disable=unused-argument
+    source = dedent(
+        """\
+        \\pysplice: x = 1
+        \\it:
+            \\pysplice[python]: y = 2
+        \\pysplice: print(x)
+        \\pysplice[python]: print(y)
+        """
+    )
+    assert translate(source) == "\n\\begin{it}\n    \n\\end{it}\n1\n\n2\n"
+    assert sorted(box.batches for box in FakePybox.created) == [[2], [2]]
+
+
+def test_batch_error(fake):  # pylint: disable=unused-argument
+    source = "\\pysplice: print(1)\n\\pysplice: print(y)\n\\pysplice: print(3)\n"
+    with pytest.raises(DependencyError) as excinfo:
+        translate(source)
+    assert "y" in excinfo.value.msg
+    assert excinfo.value.line == 1
+    [box] = FakePybox.created
+    assert box.ran == ["print(1)", "print(y)"]
+
+
+def test_memo_batch(cache):
+    source = "".join("\\pysplice: print({})\n".format(i) for i in range(4))
+    res = translate(source, pysplice_cache=cache)
+    assert translate(source, pysplice_cache=cache) == res
+    assert translate(source.replace("(3)", "(5)"), pysplice_cache=cache) == res.replace(
+        "3", "5"
+    )
+    first, second = FakePybox.created
+    assert first.batches == [4]
+    # the blocks found in the cache are run again in the same round trip
+    assert second.batches == [4]
+    assert second.ran == ["print(0)", "print(1)", "print(2)", "print(5)"]
+
+
+def test_memo_batch_skipped(cache):
+    MemoPybox(cache).run_all(["x = 1", "print(x)"])
+    box = MemoPybox(cache)
+    assert box.run_all(["x = 1", "print(x)"]) == (["", "1\n"], None)
+    assert box.pybox is None
+    outputs, error = box.run_all(["print(x + 1)", "print(y)", "print(3)"])
+    assert outputs == ["2\n"]
+    assert "y" in error.msg
+    assert box.pybox.pybox.batches == [5]
+    assert box.pybox.pybox.ran == ["x = 1", "print(x)", "print(x + 1)", "print(y)"]
+
+
+def test_concurrent(fake):  # pylint: disable=unused-argument
+    source = dedent(
+        """\
+        \\pysplice: x = 1
+        \\it:
+            \\pysplice[python]: y = 2
+        \\pysplice: print(x)
+        \\pysplice[python]: print(y)
+        """
+    )
+    assert translate(source, concurrent=True) == translate(source)
+    first = sorted(box.ran for box in FakePybox.created[:2])
+    assert sorted(box.ran for box in FakePybox.created[2:]) == first
+
+
+def test_concurrent_error(fake):  # pylint: disable=unused-argument
+    source = "\\pysplice: print(1)\n\\pysplice: print(y)\n\\pysplice: print(3)\n"
+    with pytest.raises(DependencyError) as excinfo:
+        translate(source, concurrent=True)
+    assert "y" in excinfo.value.msg
+    assert excinfo.value.line == 1
+    [box] = FakePybox.created
+    assert box.ran[:2] == ["print(1)", "print(y)"]
+    assert "print(3)" not in box.ran
+
+
+def test_concurrent_foreign(fake):  # pylint: disable=unused-argument
+    def translate_increment(state, body):
+        return translate_pysplice(state, "x += 1; print(x)", None) + body
+
+    source = "\\pysplice: x = 1\n\\increment: !\n\\pysplice: print(x)\n"
+    with Translator() as translator:
+        translator.environments["increment"] = Environment(
+            "increment", translate_increment
+        )
+        # the blocks after it are only run once it's translated
+        assert translator.translate(source, concurrent=True) == "\n2\n!\n2\n"
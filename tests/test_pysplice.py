@@ -1,12 +1,20 @@
+import os
 from textwrap import dedent
 
 import pytest
 
 # from hltex.control import environments
 from hltex.errors import DependencyError
+from hltex.pybox import Pybox
 from hltex.translator import translate
 
 
+@pytest.fixture(autouse=True)
+def local(monkeypatch):
+    # so that the blocks run without Docker
+    monkeypatch.setenv("HLTEX_EXECUTOR", "local")
+
+
 def test_pysplice():
     source = '\\pysplice:\n    print("3")'
     res = translate(source)
@@ -68,6 +76,14 @@ def test_nested_file_env():
     )
 
 
+@pytest.mark.parametrize("name", ["/tmp/hltex_escape", "a/../../hltex_escape"])
+def test_file_env_outside(name):
+    with pytest.raises(DependencyError) as excinfo:
+        translate("\\pysplice: pass", file_env={name: "42"})
+    assert repr(name) in excinfo.value.msg
+    assert not os.path.exists("/tmp/hltex_escape")
+
+
 def test_shared_python():
     source = dedent(
         """
@@ -84,3 +100,70 @@ def test_shared_python():
         3
         """
     )
+
+
+def test_executor():
+    source = "\\pysplice: import os; print(os.path.exists('main.py'))"
+    assert translate(source, executor="local") == "True\n"
+    with pytest.raises(DependencyError) as excinfo:
+        translate(source, executor="nope")
+    assert "nope" in excinfo.value.msg
+
+
+def test_start_error_line():
+    source = "a\n\\pysplice: print(1)\nb\nc\n"
+    with pytest.raises(DependencyError) as excinfo:
+        translate(source, executor="nope")
+    assert excinfo.value.line == 1
+
+
+def test_generated_files():
+    pybox = Pybox(file_env={"data.txt": "1"})
+    try:
+        pybox.run("with open('plot.png', 'wb') as f: f.write(b'PNG')")
+        paths = pybox.fetch_generated_files()
+    finally:
+        pybox.close()
+    assert sorted(os.path.basename(path) for path in paths) == ["data.txt", "plot.png"]
+    with open(next(path for path in paths if path.endswith(".png")), "rb") as f:
+        assert f.read() == b"PNG"
+
+
+def test_limits():
+    pybox = Pybox(cputime=1, memory=256)
+    try:
+        with pytest.raises(DependencyError) as excinfo:
+            pybox.run("x = bytearray(512 * 1024 * 1024)")
+        assert "MemoryError" in excinfo.value.msg
+        assert pybox.run("print(1)") == "1\n"
+        with pytest.raises(DependencyError) as excinfo:
+            pybox.run("while True: pass")
+        assert "Something went wrong" in excinfo.value.msg
+        assert "Python was killed by SIGXCPU" in excinfo.value.msg
+    finally:
+        pybox.close()
+
+
+def test_local_exit():
+    # the local executor's own memory limit is enough for big imports
+    pybox = Pybox()
+    try:
+        assert pybox.run("x = bytearray(256 * 1024 * 1024)\nprint(len(x) > 0)") == (
+            "True\n"
+        )
+        with pytest.raises(DependencyError) as excinfo:
+            pybox.run("import os, sys\nsys.stderr.write('oops')\nos._exit(3)")
+        assert excinfo.value.msg.endswith("Python exited with status 3:\noops")
+    finally:
+        pybox.close()
+
+
+def test_large_output():
+    # sent in several frames
+    source = "\\pysplice: print('ab' * 3000000)"
+    assert translate(source) == "ab" * 3000000 + "\n"
+
+
+def test_odd_output():
+    source = "\\pysplice: print('3:\\r\\x00\\u2028\\n\\u00e9\\ud800')"
+    assert translate(source) == "3:\r\x00\u2028\n\u00e9\ud800\n"
@@ -0,0 +1,173 @@
+import http.client
+import json
+import os
+import signal
+import socket
+import threading
+
+import pytest
+
+from hltex.errors import DependencyError
+from hltex.server import HTTPServer, ResultCache, Service, UnixServer
+
+
+class UnixConnection(http.client.HTTPConnection):
+    def __init__(self, path):
+        super().__init__("localhost")
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+@pytest.fixture(scope="module")
+def service():
+    service = Service(workers=1, cache_size=2)
+    yield service
+    service.close()
+
+
+def serving(server):
+    thread = threading.Thread(
+        target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True
+    )
+    thread.start()
+    return thread
+
+
+@pytest.fixture
+def conn(service):
+    server = HTTPServer(("127.0.0.1", 0), service, quiet=True)
+    serving(server)
+    conn = http.client.HTTPConnection(*server.server_address)
+    yield conn
+    conn.close()
+    server.shutdown()
+    server.server_close()
+
+
+def post_body(conn, body, content_type="application/json"):
+    conn.request(
+        "POST", "/translate", body=body, headers={"Content-Type": content_type}
+    )
+    response = conn.getresponse()
+    return response, response.read().decode("utf-8")
+
+
+def post(conn, source):
+    return post_body(conn, json.dumps({"source": source}))
+
+
+def test_translate(conn):
+    response, body = post(conn, "\\it: a")
+    assert response.status == 200
+    assert body == "\\begin{it}a\\end{it}"
+    response, body = post(conn, "\\it: a")
+    assert response.getheader("X-Hltex-Cache") == "hit"
+    assert body == "\\begin{it}a\\end{it}"
+
+
+def test_json(conn):
+    response, body = post_body(
+        conn, json.dumps({"source": "\\it: b", "file_env": {}})
+    )
+    assert response.status == 200
+    assert body == "\\begin{it}b\\end{it}"
+    response, body = post_body(conn, json.dumps({"text": ""}))
+    assert response.status == 400
+
+
+def test_bad_request(conn):
+    response, body = post_body(conn, '{"source": "\xe9"}'.encode("latin-1"))
+    assert response.status == 400
+    assert json.loads(body) == {"error": "Expected a UTF-8 body"}
+    conn.putrequest("POST", "/translate")
+    conn.putheader("Content-Type", "application/json")
+    conn.putheader("Content-Length", "a")
+    conn.endheaders()
+    response = conn.getresponse()
+    assert response.status == 400
+    assert json.loads(response.read()) == {"error": "Invalid Content-Length"}
+
+
+def test_not_json(conn):
+    # which a web page could send without the consent of the server
+    for content_type in ["text/plain", "application/x-www-form-urlencoded"]:
+        response, body = post_body(conn, "\\pysplice: print(1)", content_type)
+        assert response.status == 415
+        assert json.loads(body) == {"error": "Expected an application/json body"}
+        conn.close()
+
+
+def test_missing_length(conn):
+    conn.putrequest("POST", "/translate")
+    conn.putheader("Content-Type", "application/json")
+    conn.endheaders()
+    response = conn.getresponse()
+    assert response.status == 411
+    assert json.loads(response.read()) == {"error": "Missing Content-Length"}
+
+
+def test_local_executor(monkeypatch):
+    monkeypatch.setenv("HLTEX_EXECUTOR", "local")
+    with pytest.raises(DependencyError):
+        Service(workers=1)
+
+
+def test_error(conn):
+    response, body = post(conn, "\\it:\n  a\n b")
+    assert response.status == 422
+    assert json.loads(body) == {
+        "error": "Indentation must be in multiples of the base indentation '  '",
+        "line": 2,
+        "column": 0,
+    }
+
+
+def test_stats(conn):
+    conn.request("GET", "/stats")
+    response = conn.getresponse()
+    stats = json.loads(response.read())
+    assert response.status == 200
+    assert stats["cache_entries"] <= 2
+
+
+def test_killed_worker():
+    service = Service(workers=1, cache_size=0)
+    try:
+        res, _ = service.translate("\\it: a")
+        assert res == ("ok", "\\begin{it}a\\end{it}")
+        for pid in list(service.pool._processes):
+            os.kill(pid, signal.SIGKILL)
+        for _ in range(2):
+            res, _ = service.translate("\\it: b")
+            assert res == ("ok", "\\begin{it}b\\end{it}")
+    finally:
+        service.close()
+
+
+def test_unix(service, tmp_path):
+    path = str(tmp_path / "hltex.sock")
+    server = UnixServer(path, service, quiet=True)
+    serving(server)
+    conn = UnixConnection(path)
+    response, body = post(conn, "\\it: c")
+    conn.close()
+    server.shutdown()
+    server.server_close()
+    assert response.status == 200
+    assert body == "\\begin{it}c\\end{it}"
+
+
+def test_result_cache():
+    cache = ResultCache(2)
+    keys = [cache.key(source, {}) for source in "abc"]
+    assert cache.key("a", {"x": "1"}) != keys[0]
+    cache.put(keys[0], "A")
+    cache.put(keys[1], "B")
+    assert cache.get(keys[0]) == "A"
+    cache.put(keys[2], "C")
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == "A"
+    assert (cache.hits, cache.misses) == (2, 1)
@@ -0,0 +1,81 @@
+import subprocess
+import sys
+
+import pytest
+
+# Modules that translating a document without Python blocks (or printing the CLI's
+# help) shouldn't import, since they're only needed for Python blocks, the cache or
+# the CLI's other commands
+lazy_modules = {
+    "hlbox",
+    "hltex.pybox",
+    "hltex.cache",
+    "hltex.server",
+    "hltex.watch",
+    "json",
+    "tempfile",
+    "textwrap",
+    "hashlib",
+}
+# The most milliseconds starting up may take, on top of starting Python itself. This
+# is generous, so as not to fail on slow machines; importing something big up front
+# again is caught by `lazy_modules` anyway.
+budget_ms = 250
+
+
+def run(code):
+    """
+    returns: the modules imported while running `code` in a new interpreter, and how
+        many milliseconds `code` took to run (the best of three runs)
+    """
+    best = None
+    for _ in range(3):
+        res = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            check=True,
+        )
+        elapsed = float(res.stdout.split()[-1])
+        best = elapsed if best is None else min(best, elapsed)
+    modules = set()
+    for line in res.stderr.splitlines():
+        if line.startswith("import time:") and line.count("|") == 2:
+            modules.add(line.rsplit("|", 1)[1].strip())
+    return modules, best
+
+
+timed = """
+import time
+start = time.perf_counter()
+{}
+print((time.perf_counter() - start) * 1000)
+"""
+
+
+def test_translate_startup():
+    modules, elapsed = run(
+        timed.format("from hltex.translator import translate\ntranslate('x')")
+    )
+    assert "hltex.translator" in modules
+    assert not modules & lazy_modules
+    assert elapsed < budget_ms
+
+
+def test_help_startup():
+    pytest.importorskip("click")
+    code = """
+import sys
+sys.argv = ["hltex", "--help"]
+from hltex.cli import main
+try:
+    main()
+except SystemExit:
+    pass
+"""
+    modules, elapsed = run(timed.format(code))
+    assert "hltex.cli" in modules
+    # click imports textwrap itself, to format the help
+    assert not modules & (lazy_modules - {"textwrap"} | {"hltex.translator"})
+    assert elapsed < budget_ms
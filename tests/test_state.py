@@ -1,4 +1,8 @@
-# from hltex.state import State
+import pytest
+
+from hltex.errors import InvalidSyntax, TranslationError
+from hltex.state import State
+from hltex.translator import translate
 
 # def test_run():
 #     source = "Hello"
@@ -77,3 +81,47 @@
 #     res = state.run(f, a=3, b=1)
 #     assert res == "heyo"
 #     assert state.pos == 3
+
+
+def test_get_line():
+    source = "ab\ncd\n\nef"
+    state = State(source)
+    assert state.get_line() == 0
+    assert [state.get_line(pos) for pos in range(len(source) + 1)] == [
+        source.count("\n", 0, pos) for pos in range(len(source) + 1)
+    ]
+    state.pos = 4
+    assert state.get_line() == 1
+
+
+def test_get_col():
+    source = "ab\ncd\n\nef"
+    state = State(source)
+    assert state.get_col(0) == 0
+    assert state.get_col(2) == 2
+    assert state.get_col(4) == 1
+    assert state.get_col(6) == 0
+    assert state.get_col(len(source)) == 2
+
+
+def test_line_starts():
+    assert list(State("ab\ncd\n\nef").line_starts) == [0, 3, 6, 7]
+    assert list(State("").line_starts) == [0]
+    assert list(State("\n").line_starts) == [0, 1]
+
+
+def test_locate():
+    state = State("ab\ncd", pos=4)
+    error = state.locate(TranslationError("msg"))
+    assert (error.line, error.col) == (1, 1)
+    assert str(error) == "line 2, column 2: msg"
+    state.pos = 0
+    assert state.locate(error).line == 1
+
+
+def test_translate_error_location():
+    source = "\\documentclass{article}\n===\nsome}thing"
+    with pytest.raises(InvalidSyntax) as excinfo:
+        translate(source)
+    assert (excinfo.value.line, excinfo.value.col) == (2, 4)
+    assert "Unexpected `}`" in excinfo.value.msg
@@ -1,6 +1,19 @@
+import io
 from textwrap import dedent
 
-from hltex.translator import translate
+import pytest
+
+from hltex.errors import UnexpectedIndentation
+from hltex.control import Command, commands, environments
+from hltex.pybox import default_docker
+from hltex.translator import (
+    Translator,
+    _DocumentBody,
+    _Stream,
+    translate,
+    translate_mapped,
+    translate_stream,
+)
 
 
 def test_translate():
@@ -96,3 +109,219 @@ def test_translate_spacing():
         \\end{equation}
         \\end{document}"""
     )
+
+
+def test_translator():
+    with Translator() as translator:
+        assert translator.translate("\\a: b") == "\\begin{a}b\\end{a}"
+        assert translator.translate("\\a:\n    b") == "\\begin{a}\n    b\n\\end{a}"
+
+
+def test_translator_registries():
+    translator = Translator()
+    translator.commands["b"] = Command("b", lambda _state: "c")
+    assert translator.translate("a {\\b}") == "a {c}"
+    assert "b" not in commands
+    assert translate("a {\\b}") == "a {\\b}"
+    assert translator.environments["eq"] is environments["eq"]
+
+
+def test_translator_close():
+    class FakePybox:
+        closed = False
+
+        def run(self, body):
+            return body.upper()
+
+        def run_all(self, bodies):
+            return [body.upper() for body in bodies], None
+
+        def close(self):
+            self.closed = True
+
+    pybox = FakePybox()
+    with Translator() as translator:
+        translator.pyboxes[default_docker] = pybox
+        assert translator.translate("\\pysplice: x") == "X"
+        assert translator.translate("\\pysplice: y") == "Y"
+        assert not pybox.closed
+    assert pybox.closed
+    assert not translator.pyboxes
+
+
+def test_update():
+    source = "\\documentclass{article}\n===\nA\n\\it:\n    B\n\nC\n"
+    translator = Translator()
+    translator.translate(source)
+    res = translator.update(source.index("B") + 1, source.index("B") + 1, " b")
+    assert translator.source == source.replace("B", "B b")
+    assert res == translate(translator.source)
+    res = translator.update(0, 0, "\\usepackage{x}\n")
+    assert res == translate(translator.source)
+    end = len(translator.source)
+    res = translator.update(end, end, "\\it: D")
+    assert res == translate(translator.source)
+
+
+def test_update_blocks():
+    translated = []
+
+    def count(_state, arg):
+        translated.append(arg)
+        return arg
+
+    translator = Translator()
+    translator.commands["count"] = Command("count", count, "!")
+    source = "===\n" + "".join("{\\count{%d}}\n" % i for i in range(100))
+    translator.translate(source)
+    assert len(translated) == 100
+    translated.clear()
+    start = source.index("{50}") + 1
+    res = translator.update(start, start + 2, "fifty")
+    assert res == "\\begin{document}\n%s\\end{document}" % "".join(
+        "{%s}\n" % ("fifty" if i == 50 else i) for i in range(100)
+    )
+    assert translated == ["49", "fifty"]
+
+
+def test_update_error():
+    translator = Translator()
+    translator.translate("a\nb")
+    with pytest.raises(UnexpectedIndentation):
+        translator.update(2, 2, "  ")
+    assert translator.source == "a\n  b"
+    assert translator.update(2, 4, "") == "a\nb"
+
+
+def test_update_first():
+    translator = Translator()
+    assert translator.update(0, 0, "\\it: a") == "\\begin{it}a\\end{it}"
+
+
+def test_update_source():
+    translator = Translator()
+    translator.translate("a\n\\it:\n    b\nc\n")
+    assert translator.update_source("a\n\\it:\n    bb\nc\n") == translate(
+        "a\n\\it:\n    bb\nc\n"
+    )
+    assert translator.update_source("\\it:\n    bb\nc\n") == translate(
+        "\\it:\n    bb\nc\n"
+    )
+    assert translator.source == "\\it:\n    bb\nc\n"
+
+
+def stream(source, chunk_size):
+    out = io.StringIO()
+    with Translator() as translator:
+        translator.translate_stream(io.StringIO(source), out, chunk_size=chunk_size)
+    return out.getvalue()
+
+
+@pytest.mark.parametrize(
+    "source",
+    [
+        "",
+        "\\it: a",
+        "\\documentclass{article}\n\n\\it:\n    a\n\nb\n",
+        "\\documentclass{article}\n===\nA\n\\it:\n    B\n\nC\n",
+        "===\n\n\\itemize:\n  \\item a\n  \n\nb",
+        "{a\nb}\nc\n===\n{d\ne}\n",
+        # irregular documents, which are dedented as a whole
+        "===\n\\it:\n    a\n \r\nb\n\n  \n",
+        "===\n\n \r\n\n\\it:\n  a \r\n\n",
+        "  a\n  b\nc\n",
+    ],
+)
+def test_translate_stream(source):
+    for chunk_size in [1, 2, 5, 16, 1024]:
+        assert stream(source, chunk_size) == translate(source)
+
+
+def test_translate_stream_spill(monkeypatch):
+    monkeypatch.setattr(_DocumentBody, "max_held", 8)
+    source = "===\n\\it:\n    a\n \r\n" + "b\n \n" * 100
+    assert stream(source, 7) == translate(source)
+
+
+def test_translate_stream_incremental():
+    class Source(io.StringIO):
+        def read(self, size=-1):
+            reads.append(len(out.getvalue()))
+            return super().read(size)
+
+    reads = []
+    out = io.StringIO()
+    source = "===\n" + "\\textbf{a}\n" * 1000
+    translate_stream(Source(source), out)
+    assert out.getvalue() == translate(source)
+    # written out before the whole source was read
+    with Translator() as translator:
+        reads.clear()
+        out = io.StringIO()
+        translator.translate_stream(Source(source), out, chunk_size=100)
+    assert 0 < reads[len(reads) // 2] < len(out.getvalue())
+
+
+def test_translate_stream_error():
+    source = "a\n\\it:\n    b\n" * 10 + "c\n    d\n" + "e\n" * 10
+    with pytest.raises(UnexpectedIndentation) as expected:
+        translate(source)
+    with pytest.raises(UnexpectedIndentation) as e:
+        stream(source, 8)
+    assert (e.value.line, e.value.col) == (expected.value.line, expected.value.col)
+
+
+def mapped(tmp_path, source, chunk_size):
+    path = tmp_path / "source.hltex"
+    path.write_bytes(source.encode("utf-8"))
+    out = io.BytesIO()
+    with Translator() as translator:
+        translator.translate_mapped(str(path), out, chunk_size=chunk_size)
+    return out.getvalue().decode("utf-8")
+
+
+@pytest.mark.parametrize(
+    "source",
+    [
+        "",
+        "plain\n",
+        "a: b [c]\n\nd\n===\ne\n\\it:\n    f\ng é\n\n",
+        "===\n1 & 2 \\\\\n3 \\% 4 \\& 5\n\\\\[2pt]\nx \\{ y\n",
+        "===\n\\it:\n    a\n \r\nb\nc\n\nd\n",
+        "{a\nb\nc}\nd\ne\n",
+        "a\u2028b\nc\n\nd\x85e\nf",
+        "  a\n  b\nc\n",
+    ],
+)
+def test_translate_mapped(tmp_path, source):
+    for chunk_size in [1, 3, 16, 1024]:
+        assert mapped(tmp_path, source, chunk_size) == translate(source)
+
+
+def test_translate_mapped_plain(tmp_path, monkeypatch):
+    fed = []
+    feed = _Stream.feed
+
+    def record(self, text, at_eof):
+        fed.append(text)
+        return feed(self, text, at_eof)
+
+    monkeypatch.setattr(_Stream, "feed", record)
+    rows = "".join("%d & %d \\\\\n" % (i, i * i) for i in range(100))
+    source = "===\n\\table:\n    a\n" + rows + "\\it: b\n" + rows + "end\n"
+    path = tmp_path / "source.hltex"
+    path.write_text(source)
+    out = io.BytesIO()
+    translate_mapped(str(path), out)
+    assert out.getvalue().decode("utf-8") == translate(source)
+    # the rows are copied without being translated
+    assert all("0 & 0" not in text for text in fed)
+
+
+def test_translate_mapped_error(tmp_path):
+    source = "a\n\\it:\n    b\n" * 10 + "c\n    d\n" + "e\n" * 10
+    with pytest.raises(UnexpectedIndentation) as expected:
+        translate(source)
+    with pytest.raises(UnexpectedIndentation) as e:
+        mapped(tmp_path, source, 8)
+    assert (e.value.line, e.value.col) == (expected.value.line, expected.value.col)
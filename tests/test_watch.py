@@ -0,0 +1,106 @@
+import io
+import os
+
+import pytest
+
+from hltex.watch import (
+    Builder,
+    InotifyWatcher,
+    PollingWatcher,
+    Sources,
+    _written,
+    rebuild,
+)
+
+
+def write(path, text):
+    with open(str(path), "w") as f:
+        f.write(text)
+
+
+def test_sources(tmp_path):
+    write(tmp_path / "a.hltex", "a")
+    write(tmp_path / "b.tex", "b")
+    (tmp_path / "sub").mkdir()
+    write(tmp_path / "sub" / "c.hltex", "c")
+    write(tmp_path / "d.txt", "d")
+    sources = Sources([str(tmp_path / "sub"), str(tmp_path / "d.txt")])
+    assert list(sources) == [str(tmp_path / "d.txt"), str(tmp_path / "sub" / "c.hltex")]
+    assert sources.directories() == [str(tmp_path), str(tmp_path / "sub")]
+    assert str(tmp_path / "sub" / "e.hltex") in sources
+    assert str(tmp_path / "d.txt") in sources
+    assert str(tmp_path / "a.hltex") not in sources
+    assert str(tmp_path / "sub" / "b.tex") not in sources
+
+
+def test_polling(tmp_path):
+    write(tmp_path / "a.hltex", "a")
+    watcher = PollingWatcher([str(tmp_path)], interval=0.01)
+    assert watcher.read(0.02) == set()
+    write(tmp_path / "a.hltex", "ab")
+    write(tmp_path / "b.hltex", "b")
+    assert watcher.read(1) == {str(tmp_path / "a.hltex"), str(tmp_path / "b.hltex")}
+
+
+def test_inotify(tmp_path):
+    try:
+        watcher = InotifyWatcher([str(tmp_path)])
+    except (OSError, AttributeError, TypeError):
+        pytest.skip("inotify isn't available")
+    try:
+        assert watcher.read(0.01) == set()
+        write(tmp_path / "a.hltex", "a")
+        os.replace(str(tmp_path / "a.hltex"), str(tmp_path / "b.hltex"))
+        assert watcher.read(1) == {str(tmp_path / "a.hltex"), str(tmp_path / "b.hltex")}
+    finally:
+        watcher.close()
+
+
+def test_new_directory(tmp_path):
+    sources = Sources([str(tmp_path)])
+    watched = set(sources.directories())
+    try:
+        watcher = InotifyWatcher(sorted(watched))
+    except (OSError, AttributeError, TypeError):
+        watcher = PollingWatcher(sorted(watched), interval=0.01)
+    try:
+        (tmp_path / "sub").mkdir()
+        write(tmp_path / "sub" / "a.hltex", "a")
+        written = _written(watcher.read(1), sources, watcher, watched)
+        assert written == {str(tmp_path / "sub" / "a.hltex")}
+        assert str(tmp_path / "sub") in watched
+        write(tmp_path / "sub" / "b.hltex", "b")
+        written = _written(watcher.read(1), sources, watcher, watched)
+        assert str(tmp_path / "sub" / "b.hltex") in written
+    finally:
+        watcher.close()
+
+
+def test_rebuild(tmp_path):
+    write(tmp_path / "a.hltex", "===\n\\it: a\n")
+    write(tmp_path / "b.hltex", "\\it:\n  a\n b\n")
+    builder = Builder(output=lambda filename: filename[: -len(".hltex")] + ".tex")
+    log = io.StringIO()
+    rebuild(builder, [str(tmp_path / "a.hltex"), str(tmp_path / "b.hltex")], log=log)
+    assert "Rebuilt 1 of 2 file(s)" in log.getvalue()
+    assert "b.hltex: line 3" in log.getvalue()
+    with open(str(tmp_path / "a.tex")) as f:
+        assert f.read() == "\\begin{document}\n\\begin{it}a\\end{it}\n\\end{document}"
+    translator = builder.translators[str(tmp_path / "a.hltex")]
+    write(tmp_path / "a.hltex", "===\n\\it: b\n")
+    rebuild(builder, [str(tmp_path / "a.hltex")], log=log)
+    assert builder.translators[str(tmp_path / "a.hltex")] is translator
+    with open(str(tmp_path / "a.tex")) as f:
+        assert f.read() == "\\begin{document}\n\\begin{it}b\\end{it}\n\\end{document}"
+    builder.close()
+    assert not builder.translators
+
+
+def test_rebuild_undecodable(tmp_path):
+    with open(str(tmp_path / "a.hltex"), "wb") as f:
+        f.write(b"\\it: \xff\n")
+    builder = Builder(output=lambda filename: filename + ".tex")
+    log = io.StringIO()
+    rebuild(builder, [str(tmp_path / "a.hltex")], log=log)
+    assert "Rebuilt 0 of 1 file(s)" in log.getvalue()
+    assert "a.hltex: 'utf-8' codec can't decode" in log.getvalue()
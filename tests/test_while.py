@@ -1,4 +1,4 @@
-from hltex.context import parse_until, parse_while
+from hltex.context import parse_letters, parse_while, parse_whitespace
 from hltex.state import State
 
 
@@ -18,16 +18,22 @@ def test_parse_while_none():
     assert state.pos == 0
 
 
-def test_parse_until():
-    source = "aaaaabbbb"
+def test_parse_whitespace():
+    source = " \t\xa0 \n  text"
     state = State(source)
-    state.run(parse_until, pred=lambda c: c == "b")
-    assert source[state.pos] == "b"
-    assert state.pos == 5
+    assert state.run(parse_whitespace) == " \t\xa0 "
+    assert source[state.pos] == "\n"
 
 
-def test_parse_until_none():
-    source = "aaaaabbbb"
+def test_parse_letters():
+    source = "someName123"
+    state = State(source)
+    assert state.run(parse_letters) == "someName"
+    assert source[state.pos] == "1"
+
+
+def test_parse_letters_unicode():
+    source = "caf\xe9s\xb2"
     state = State(source)
-    state.run(parse_until, pred=lambda c: False)
-    assert state.pos == len(source)
+    assert state.run(parse_letters) == "caf\xe9s"
+    assert source[state.pos] == "\xb2"